@@ -0,0 +1,122 @@
+"""
+Async variant of the API: the same routes, SQL and JSON as app.py, served by
+Quart on asyncpg. Run it with an ASGI server, e.g.
+
+    hypercorn aio.app:app --workers 2 --bind 0.0.0.0:5001
+
+Requires the optional "async" dependencies (pip install -e ".[async]").
+
+Not ported yet, so only app.py has them: query instrumentation
+(Server-Timing, /stats/queries), Prometheus /metrics, rate limits and
+admission control, read replicas, response compression and /stats/jobs.
+Put a proxy that limits and compresses in front of this app.
+"""
+import asyncio
+import os
+import traceback
+from dotenv import load_dotenv
+from quart import Quart, jsonify
+from aio.auth import token_required, admin_required
+from aio.database import init_pool, close_pool, fetchrow, pool_stats
+from aio.routes.users import users_bp
+from aio.routes.products import products_bp
+from aio.routes.carts import cart_bp
+from aio.routes.orders import orders_bp
+from aio.routes.analytics import analytics_bp
+from cache import product_cache
+from json_provider import FastJSONProvider
+from passwords import password_stats, close_hasher
+from reservations import RESERVATION_SWEEP_INTERVAL, RESERVATION_SWEEP_BATCH, SWEEP_SQL
+
+load_dotenv()
+
+
+async def sweep_reservations(interval=RESERVATION_SWEEP_INTERVAL):
+    """
+    Event-loop twin of reservations.start_reservation_sweeper.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while True:
+                row = await fetchrow(SWEEP_SQL, {"batch": RESERVATION_SWEEP_BATCH})
+                if row["product_ids"]:
+                    product_cache.invalidate_products(*row["product_ids"])
+                if row["expired"] < RESERVATION_SWEEP_BATCH:
+                    break
+        except Exception:
+            traceback.print_exc()
+
+
+def create_app():
+    app = Quart(__name__)
+    app.json = FastJSONProvider(app)
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+
+    # same CORS policy as app.py (flask-cors has no Quart counterpart here)
+    @app.after_request
+    async def add_cors_headers(response):
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, PATCH, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Idempotency-Key, X-DB-LSN"
+        return response
+
+    background = []
+
+    @app.before_serving
+    async def startup():
+        await init_pool()
+        if RESERVATION_SWEEP_INTERVAL > 0:
+            background.append(asyncio.create_task(sweep_reservations()))
+
+    @app.after_serving
+    async def shutdown():
+        while background:
+            background.pop().cancel()
+        await close_pool()
+        close_hasher()
+
+    app.register_blueprint(users_bp, url_prefix="/users")
+    app.register_blueprint(products_bp, url_prefix="/products")
+    app.register_blueprint(cart_bp, url_prefix="/carts")
+    app.register_blueprint(orders_bp, url_prefix="/orders")
+    app.register_blueprint(analytics_bp, url_prefix="/analytics")
+
+    @app.route("/")
+    async def home():
+        return {"msg": "Quart + DB schema ready"}
+
+    @app.route("/health/live")
+    async def live():
+        return {"status": "ok"}
+
+    @app.route("/health/ready")
+    async def ready():
+        try:
+            await fetchrow("SELECT 1")
+        except Exception:
+            return jsonify({"status": "unavailable", "error": "Database unavailable"}), 503
+        return {"status": "ok"}
+
+    @app.route("/stats/db")
+    @token_required
+    @admin_required
+    async def db_stats(user):
+        return pool_stats()
+
+    @app.route("/stats/cache")
+    @token_required
+    @admin_required
+    async def cache_stats(user):
+        return product_cache.stats()
+
+    @app.route("/stats/passwords")
+    @token_required
+    @admin_required
+    async def passwords_stats(user):
+        return password_stats()
+
+    return app
+
+
+app = create_app()
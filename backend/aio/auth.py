@@ -0,0 +1,70 @@
+from functools import wraps
+from quart import request, jsonify, current_app, g
+import jwt
+from auth_middleware import AUTH_MODE, USER_SQL, cached_user, cache_user, user_from_claims, is_revoked
+from aio.database import fetchrow
+
+
+async def _load_user(data):
+    user_id = data["user_id"]
+
+    if AUTH_MODE == "claims":
+        return user_from_claims(data)
+
+    if AUTH_MODE == "cached":
+        user = cached_user(user_id)
+        if user is not None:
+            return user
+
+    row = await fetchrow(USER_SQL, {"user_id": user_id})
+    user = dict(row) if row else None
+    if user and AUTH_MODE == "cached":
+        cache_user(user)
+    return user
+
+
+def token_required(f):
+    """
+    Async twin of auth_middleware.token_required; shares its user cache,
+    revocation list and AUTH_MODE.
+    """
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = None
+
+        if "Authorization" in request.headers:
+            token = request.headers["Authorization"].split(" ")[1]  # "Bearer <token>"
+
+        if not token:
+            return jsonify({"error": "Token is missing!"}), 401
+
+        try:
+            data = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
+
+            if is_revoked(data):
+                return jsonify({"error": "Token has been revoked"}), 401
+
+            user = await _load_user(data)
+
+            if not user:
+                return jsonify({"error": "User not found"}), 404
+
+        except jwt.ExpiredSignatureError:
+            return jsonify({"error": "Token has expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+
+        g.token_claims = data
+
+        return await f(user, *args, **kwargs)
+
+    return decorated
+
+
+def admin_required(f):
+    @wraps(f)
+    async def decorated(user, *args, **kwargs):
+        if user["role"] != "admin":
+            return jsonify({"error": "Admin access required"}), 403
+        return await f(user, *args, **kwargs)
+    return decorated
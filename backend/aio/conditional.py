@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from quart import request, jsonify, current_app
+
+
+def is_fresh(etag, last_modified=None):
+    """
+    Same rules as conditional.is_fresh, against the Quart request.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= int(request.if_modified_since.timestamp())
+    return False
+
+
+def has_conditional_headers():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def _set_validators(response, etag, last_modified, cache_control):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(last_modified, tz=timezone.utc)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def not_modified(etag, last_modified=None, cache_control="no-cache"):
+    response = current_app.response_class("", status=304)
+    del response.headers["Content-Type"]  # a 304 has no body to describe
+    return _set_validators(response, etag, last_modified, cache_control)
+
+
+async def conditional_json(payload, etag, last_modified=None, cache_control="no-cache"):
+    """
+    ``payload`` may be a coroutine function, awaited only when the body is sent.
+    """
+    if is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified, cache_control)
+    if callable(payload):
+        payload = await payload()
+    return _set_validators(jsonify(payload), etag, last_modified, cache_control)
+
@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import asyncpg
+from database import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_AGE
+
+# The async API runs many requests per worker, so its pool is sized separately
+AIO_POOL_MIN_SIZE = int(os.getenv("AIO_POOL_MIN_SIZE", str(DB_POOL_MIN_SIZE)))
+AIO_POOL_MAX_SIZE = int(os.getenv("AIO_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE * 2)))
+
+_pool = None
+
+_PARAM = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def to_asyncpg(sql, params=()):
+    """
+    Rewrites psycopg2-style SQL (%s or %(name)s placeholders) into asyncpg's
+    $1, $2... form, so the sync and async APIs can share their statements.
+    Returns (sql, arg1, arg2, ...), ready to unpack into an asyncpg call.
+    Usage:
+        await conn.fetch(*to_asyncpg("SELECT * FROM carts WHERE user_id = %(user_id)s", {"user_id": 1}))
+    """
+    args, names = [], {}
+    position = 0
+
+    def substitute(match):
+        nonlocal position
+        token = match.group(0)
+        if token == "%%":
+            return "%"
+        if token == "%s":
+            args.append(params[position])
+            position += 1
+            return f"${len(args)}"
+        name = match.group(1)
+        if name not in names:
+            args.append(params[name])
+            names[name] = len(args)
+        return f"${names[name]}"
+
+    return (_PARAM.sub(substitute, sql), *args)
+
+
+async def _init_connection(conn):
+    # psycopg2 decodes json/jsonb into Python objects; do the same here
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def init_pool():
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=AIO_POOL_MIN_SIZE,
+            max_size=AIO_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_inactive_connection_lifetime=DB_POOL_MAX_AGE,
+            init=_init_connection,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool():
+    """
+    Returns the asyncpg pool. Each ``async with get_pool().acquire() as conn``
+    holds a connection only for that block, so independent queries of one
+    request can run on separate connections at the same time.
+    """
+    if _pool is None:
+        raise RuntimeError("Async pool is not initialised (init_pool runs before serving)")
+    return _pool
+
+
+async def fetch(sql, params=()):
+    async with get_pool().acquire() as conn:
+        return await conn.fetch(*to_asyncpg(sql, params))
+
+
+async def fetchrow(sql, params=()):
+    async with get_pool().acquire() as conn:
+        return await conn.fetchrow(*to_asyncpg(sql, params))
+
+
+async def execute(sql, params=()):
+    async with get_pool().acquire() as conn:
+        return await conn.execute(*to_asyncpg(sql, params))
+
+
+def pool_stats():
+    if _pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {"size": size, "idle": idle, "in_use": size - idle,
+            "min_size": _pool.get_min_size(), "max_size": _pool.get_max_size()}
@@ -0,0 +1,259 @@
+"""
+Parity check between the sync (Flask/psycopg2) and async (Quart/asyncpg) APIs.
+
+Plays the same scenario against both apps in-process, on the database in
+DATABASE_URL, and diffs status codes, key headers and JSON bodies. Values
+that legitimately differ between runs (ids, timestamps, tokens, the run's
+unique names) are normalised first.
+
+    python -m aio.parity          # exits 1 and prints the differences on mismatch
+
+tests/test_parity.py runs the same check under pytest.
+"""
+import asyncio
+import json
+import re
+import sys
+import uuid
+import psycopg2
+
+from database import DATABASE_URL
+
+# keys whose values change from run to run; only their shape is compared
+VOLATILE_KEYS = {"id", "order_id", "cart_id", "item_id", "product_id", "next_cursor",
+                 "user_id", "created_at", "updated_at", "expires_at", "rank"}
+SECRET_KEYS = {"token"}
+COMPARED_HEADERS = ("content-type", "cache-control", "idempotent-replayed", "retry-after")
+
+
+class SyncClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    async def request(self, method, path, json=None, headers=None):
+        response = self.client.open(path, method=method, json=json, headers=headers or {})
+        return response.status_code, {k.lower(): v for k, v in response.headers.items()}, body_of(response.get_data(as_text=True))
+
+
+class AsyncClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    async def request(self, method, path, json=None, headers=None):
+        response = await self.client.open(path, method=method, json=json, headers=headers or {})
+        body = await response.get_data(as_text=True)
+        return response.status_code, {k.lower(): v for k, v in response.headers.items()}, body_of(body)
+
+
+def body_of(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def shape(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int):
+        return "<int>"
+    if isinstance(value, float):
+        return "<float>"
+    # digit runs collapse: Postgres trims trailing zeros off fractional seconds
+    return re.sub(r"\d+", "0", re.sub(r"[A-Za-z]+", "a", str(value)))
+
+
+def normalise(value, run, key=None):
+    if isinstance(value, dict):
+        return {k: normalise(v, run, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalise(v, run, key) for v in value]
+    if key in SECRET_KEYS:
+        return "<secret>" if value else value
+    if key in VOLATILE_KEYS:
+        return shape(value)
+    if isinstance(value, str):
+        # driver error texts differ only in trailing whitespace
+        return re.sub(r"\b\d+\b", "<n>", value.replace(run, "<run>")).strip()
+    return value
+
+
+class ParityDatabase:
+    """Side channel for the scenario: what the API itself cannot do."""
+
+    def __init__(self, dsn):
+        self.conn = psycopg2.connect(dsn)
+
+    def promote(self, user_id):
+        with self.conn.cursor() as cur:
+            cur.execute("UPDATE users SET role = 'admin' WHERE id = %s", (user_id,))
+        self.conn.commit()
+
+    def now(self):
+        # database clock, the one orders.created_at is stamped with
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT LOCALTIMESTAMP")
+            now = cur.fetchone()[0]
+        self.conn.commit()
+        return now.isoformat()
+
+    def close(self):
+        self.conn.close()
+
+
+async def scenario(client, run, db):
+    """
+    Returns (label, status, headers, body) for every step.
+    """
+    async def call(label, method, path, body=None, headers=None):
+        status, response_headers, data = await client.request(method, path, json=body, headers=headers)
+        steps.append((label, status, response_headers, data))
+        return data
+
+    steps = []
+    email, password = f"{run}@parity.test", "pw"
+    user = await call("register", "POST", "/users/register",
+                      {"email": email, "username": run, "password": password})
+    await call("register duplicate", "POST", "/users/register",
+               {"email": email, "username": run, "password": password})
+    await call("login wrong password", "POST", "/users/login", {"email": email, "password": "nope"})
+    db.promote(user["id"])
+    started = db.now()
+    token = (await call("login", "POST", "/users/login", {"email": email, "password": password}))["token"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    await call("no token", "GET", "/carts/")
+    await call("bad token", "GET", "/carts/", headers={"Authorization": "Bearer nope"})
+
+    category = f"cat-{run}"
+    ids = []
+    for n, price in enumerate(["9.99", "24.50", "3.00"]):
+        product = await call(f"add product {n}", "POST", "/products/",
+                             {"name": f"Gadget {run} {n}", "description": "parity item",
+                              "price": price, "stock": 5, "category": category}, auth)
+        ids.append(product["id"])
+    await call("add product missing price", "POST", "/products/", {"name": "x"}, auth)
+
+    await call("list category", "GET", f"/products/?category={category}")
+    await call("list page", "GET", f"/products/?category={category}&limit=2")
+    await call("list fields", "GET", f"/products/?category={category}&fields=name,price")
+    await call("list bad field", "GET", "/products/?fields=nope")
+    await call("list empty", "GET", f"/products/?category=none-{run}")
+    await call("search", "GET", f"/products/search?q=gadget&category={category}")
+    await call("search missing", "GET", "/products/search")
+    product = await call("get product", "GET", f"/products/{ids[0]}")
+    await call("get missing product", "GET", "/products/0")
+
+    status, headers, _ = await client.request("GET", f"/products/{ids[0]}")
+    await call("get product 304", "GET", f"/products/{ids[0]}", headers={"If-None-Match": headers["etag"]})
+
+    await call("update product", "PUT", f"/products/{ids[2]}", {"price": "4.25", "stock": 7}, auth)
+    await call("update product empty", "PUT", f"/products/{ids[2]}", {"colour": "red"}, auth)
+    await call("decrement stock", "PATCH", f"/products/{ids[2]}/decrement_stock", {"quantity": 2}, auth)
+    await call("decrement too much", "PATCH", f"/products/{ids[2]}/decrement_stock", {"quantity": 99}, auth)
+
+    await call("empty cart", "GET", "/carts/", headers=auth)
+    await call("checkout empty cart", "POST", "/orders/create", headers=auth)
+    await call("add to cart", "POST", "/carts/add", {"product_id": ids[0], "quantity": 2}, auth)
+    await call("add to cart again", "POST", "/carts/add", {"product_id": ids[0], "quantity": 1}, auth)
+    await call("add items", "POST", "/carts/items",
+               {"items": [{"product_id": ids[1], "quantity": 1}, {"product_id": ids[1], "quantity": 1}]}, auth)
+    await call("add items invalid", "POST", "/carts/items", {"items": [{"quantity": 1}]}, auth)
+    await call("update quantity", "PUT", f"/carts/update/{ids[1]}", {"quantity": 1}, auth)
+    await call("cart", "GET", "/carts/", headers=auth)
+
+    reservation = await call("reserve", "POST", "/products/stock/reserve",
+                             {"items": [{"product_id": ids[0], "quantity": 3}]}, auth)
+    await call("reserve too much", "POST", "/products/stock/reserve",
+               {"items": [{"product_id": ids[0], "quantity": 50}]}, auth)
+    await call("checkout bad reservation", "POST", "/orders/create", {"reservation_id": 0}, auth)
+    keyed = dict(auth, **{"Idempotency-Key": f"checkout-{run}"})
+    order = await call("checkout", "POST", "/orders/create",
+                       {"reservation_id": reservation["reservation"]["id"]}, keyed)
+    await call("checkout retried", "POST", "/orders/create",
+               {"reservation_id": reservation["reservation"]["id"]}, keyed)
+    await call("checkout key reused", "POST", "/orders/create", {"reservation_id": 0}, keyed)
+    await call("release committed reservation", "POST",
+               f"/products/stock/reservations/{reservation['reservation']['id']}/release", headers=auth)
+
+    await call("orders", "GET", "/orders/", headers=auth)
+    await call("order details", "GET", f"/orders/{order['order_id']}", headers=auth)
+    await call("missing order", "GET", "/orders/0", headers=auth)
+    await call("set status", "PATCH", f"/orders/{order['order_id']}/status", {"status": "shipped"}, auth)
+    await call("set bad status", "PATCH", f"/orders/{order['order_id']}/status", {"status": "lost"}, auth)
+    await call("stock after checkout", "GET", f"/products/{ids[0]}")
+
+    # the rollups only change when worker.py refreshes them, so both runs read the same
+    await call("analytics sales", "GET", "/analytics/sales?from=2024-01-01&to=2024-02-01", headers=auth)
+    await call("analytics categories", "GET", "/analytics/categories?from=2024-01-01&to=2024-02-01", headers=auth)
+    await call("analytics top products", "GET", "/analytics/top-products?days=30&limit=5", headers=auth)
+    await call("analytics bad window", "GET", "/analytics/top-products?days=8", headers=auth)
+    await call("analytics bad range", "GET", "/analytics/sales?from=2024-02-01&to=2024-01-01", headers=auth)
+    await call("analytics low stock", "GET", "/analytics/low-stock?threshold=-1", headers=auth)
+
+    # only this run's orders: the other run's are older than ``started``
+    await call("all orders", "GET", f"/orders/all?from={started}", headers=auth)
+    await call("all orders page", "GET", f"/orders/all?from={started}&limit=2", headers=auth)
+    await call("all orders shipped", "GET", f"/orders/all?from={started}&status=shipped&limit=1", headers=auth)
+    await call("all orders bad status", "GET", "/orders/all?status=lost", headers=auth)
+    await call("all orders bad cursor", "GET", "/orders/all?after=nope", headers=auth)
+    await call("export ndjson", "GET", f"/orders/all?format=ndjson&from={started}", headers=auth)
+    await call("export csv", "GET", f"/orders/all?format=csv&from={started}", headers=auth)
+
+    await call("remove item", "DELETE", f"/carts/remove/{ids[0]}", headers=auth)
+    await call("clear cart", "DELETE", "/carts/clear", headers=auth)
+    await call("delete product", "DELETE", f"/products/{ids[2]}", headers=auth)
+    await call("delete missing product", "DELETE", f"/products/{ids[2]}", headers=auth)
+    await call("logout", "POST", "/users/logout", headers=auth)
+    await call("revoked token", "GET", "/orders/", headers=auth)
+    return steps
+
+
+def compare(sync_steps, async_steps, sync_run, async_run):
+    differences = []
+    for (label, *sync_result), (_, *async_result) in zip(sync_steps, async_steps):
+        if sync_result[0] != async_result[0]:
+            differences.append(f"{label}: status {sync_result[0]} (sync) != {async_result[0]} (async)")
+        sync_body = normalise(sync_result[2], sync_run)
+        async_body = normalise(async_result[2], async_run)
+        if sync_body != async_body:
+            differences.append(f"{label}: body\n  sync:  {sync_body}\n  async: {async_body}")
+        for header in COMPARED_HEADERS:
+            if sync_result[0] == 304 and header == "content-type":
+                continue  # Quart's test client fills in a default for empty bodies
+            if sync_result[1].get(header) != async_result[1].get(header):
+                differences.append(f"{label}: {header} header\n  sync:  {sync_result[1].get(header)}\n"
+                                   f"  async: {async_result[1].get(header)}")
+        if ("etag" in sync_result[1]) != ("etag" in async_result[1]):
+            differences.append(f"{label}: ETag present only on one side")
+    return differences
+
+
+async def run_parity(dsn=DATABASE_URL):
+    """
+    Plays the scenario on both apps; returns (steps played, differences).
+    """
+    from app import app as sync_app
+    from aio.app import app as async_app
+
+    db = ParityDatabase(dsn)
+    sync_run, async_run = f"s{uuid.uuid4().hex[:8]}", f"a{uuid.uuid4().hex[:8]}"
+    try:
+        sync_steps = await scenario(SyncClient(sync_app), sync_run, db)
+        async with async_app.test_app() as test_app:
+            async_steps = await scenario(AsyncClient(test_app), async_run, db)
+    finally:
+        db.close()
+    return len(sync_steps), compare(sync_steps, async_steps, sync_run, async_run)
+
+
+async def main():
+    steps, differences = await run_parity()
+    for difference in differences:
+        print(difference)
+    print(f"{steps} steps, {len(differences)} differences")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
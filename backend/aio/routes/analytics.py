@@ -0,0 +1,114 @@
+from quart import Blueprint, request, jsonify
+from aio.database import fetch, fetchrow
+from aio.auth import token_required, admin_required
+from aio.conditional import conditional_json
+from analytics import refresh_params
+from conditional import to_timestamp
+from jobs import ENQUEUE_SQL
+from routes.analytics import (ANALYTICS_STATE_SQL, SALES_DAILY_SQL, SALES_TOTALS_SQL, SALES_BY_CATEGORY_SQL,
+                              TOP_PRODUCTS_SQL, LOW_STOCK_SQL, LOW_STOCK_THRESHOLD, LOW_STOCK_MAX_LIMIT,
+                              parse_report_range, parse_top_products_args, report_etag, state_payload)
+
+analytics_bp = Blueprint("analytics", __name__)
+
+
+async def _report(name, params, build):
+    state = await fetchrow(ANALYTICS_STATE_SQL)
+
+    async def payload():
+        return dict(await build(), **state_payload(state))
+
+    return await conditional_json(payload, report_etag(state, name, params), to_timestamp(state["refreshed_at"]),
+                                  cache_control="private, no-cache")
+
+
+@analytics_bp.route("/sales", methods=["GET"])
+@token_required
+@admin_required
+async def sales(user):
+    try:
+        params, error = parse_report_range(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        async def build():
+            days = await fetch(SALES_DAILY_SQL, params)
+            totals = await fetchrow(SALES_TOTALS_SQL, params)
+            return {"days": [dict(row) for row in days], "totals": dict(totals),
+                    "from": params["from"].isoformat(), "to": params["to"].isoformat()}
+
+        return await _report("sales", params, build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/categories", methods=["GET"])
+@token_required
+@admin_required
+async def sales_by_category(user):
+    try:
+        params, error = parse_report_range(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        async def build():
+            rows = await fetch(SALES_BY_CATEGORY_SQL, params)
+            return {"categories": [dict(row) for row in rows],
+                    "from": params["from"].isoformat(), "to": params["to"].isoformat()}
+
+        return await _report("categories", params, build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/top-products", methods=["GET"])
+@token_required
+@admin_required
+async def top_products(user):
+    try:
+        params, error = parse_top_products_args(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        async def build():
+            rows = await fetch(TOP_PRODUCTS_SQL, params)
+            return {"products": [dict(row) for row in rows], "days": params["days"]}
+
+        return await _report("top-products", params, build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/low-stock", methods=["GET"])
+@token_required
+@admin_required
+async def low_stock(user):
+    try:
+        threshold = request.args.get("threshold", LOW_STOCK_THRESHOLD, type=int)
+        limit = min(max(request.args.get("limit", 100, type=int), 1), LOW_STOCK_MAX_LIMIT)
+        rows = await fetch(LOW_STOCK_SQL, {"threshold": threshold, "limit": limit})
+        return jsonify({"products": [dict(row) for row in rows], "threshold": threshold}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/status", methods=["GET"])
+@token_required
+@admin_required
+async def analytics_status(user):
+    try:
+        state = await fetchrow(ANALYTICS_STATE_SQL)
+        return jsonify(state_payload(state)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/refresh", methods=["POST"])
+@token_required
+@admin_required
+async def refresh(user):
+    try:
+        queued = await fetchrow(ENQUEUE_SQL, refresh_params(1))
+        return jsonify({"message": "Refresh queued", "job_id": queued["id"] if queued else None}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
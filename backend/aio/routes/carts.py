@@ -0,0 +1,138 @@
+import asyncio
+from quart import Blueprint, request, jsonify
+from aio.database import fetch, fetchrow, execute
+from aio.auth import token_required
+from routes.carts import CART_ID_SQL, LOCKED_CART_CTE, UPDATE_ITEM_SQL, REMOVE_ITEM_SQL, CLEAR_CART_SQL
+
+cart_bp = Blueprint("carts", __name__)
+
+# Items looked up through the user, so they do not wait on the cart upsert
+CART_ITEMS_SQL = """
+    SELECT ci.id AS item_id, p.name AS product_name, p.price::float8 AS price, ci.quantity,
+           (p.price * ci.quantity)::float8 AS total
+    FROM cart_items ci
+    JOIN carts c ON ci.cart_id = c.id
+    JOIN products p ON ci.product_id = p.id
+    WHERE c.user_id = %s
+"""
+
+
+@cart_bp.route("/", methods=["GET"])
+@token_required
+async def get_cart(user):
+    try:
+        # cart and item list run side by side; a missing cart has no items,
+        # so it is created afterwards without fetching them again
+        cart, items = await asyncio.gather(
+            fetchrow(CART_ID_SQL, {"user_id": user["id"]}),
+            fetch(CART_ITEMS_SQL, (user["id"],))
+        )
+        if cart is None:
+            cart = await fetchrow(f"WITH {LOCKED_CART_CTE} SELECT id FROM cart", {"user_id": user["id"]})
+
+        cart_items = [dict(row) for row in items]
+
+        return jsonify({
+            "cart_id": cart["id"],
+            "items": cart_items,
+            "total_price": sum(item["total"] for item in cart_items)
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@cart_bp.route("/add", methods=["POST"])
+@token_required
+async def add_to_cart(user):
+    try:
+        data = await request.get_json()
+        product_id = data.get("product_id")
+        quantity = int(data.get("quantity", 1))
+
+        await execute(f"""
+            WITH {LOCKED_CART_CTE}
+            INSERT INTO cart_items (cart_id, product_id, quantity)
+            SELECT cart.id, %(product_id)s::int, %(quantity)s FROM cart
+            ON CONFLICT (cart_id, product_id)
+            DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        """, {"user_id": user["id"], "product_id": product_id, "quantity": quantity})
+
+        return jsonify({"message": "Product added to cart"}), 201
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@cart_bp.route("/items", methods=["POST"])
+@token_required
+async def add_items_to_cart(user):
+    try:
+        data = await request.get_json() or {}
+        items = data.get("items")
+        if not items or not isinstance(items, list):
+            return jsonify({"error": "items must be a non-empty list"}), 400
+
+        product_ids = [int(item["product_id"]) for item in items]
+        quantities = [int(item.get("quantity", 1)) for item in items]
+        if any(quantity <= 0 for quantity in quantities):
+            return jsonify({"error": "Quantities must be positive"}), 400
+
+        await execute(f"""
+            WITH {LOCKED_CART_CTE},
+            requested AS (
+                SELECT product_id, SUM(quantity)::int AS quantity
+                FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS r(product_id, quantity)
+                GROUP BY product_id
+            )
+            INSERT INTO cart_items (cart_id, product_id, quantity)
+            SELECT cart.id, requested.product_id, requested.quantity FROM cart, requested
+            ON CONFLICT (cart_id, product_id)
+            DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        """, {"user_id": user["id"], "product_ids": product_ids, "quantities": quantities})
+
+        return jsonify({"message": "Products added to cart", "count": len(set(product_ids))}), 201
+
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each item needs a product_id and a quantity"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@cart_bp.route("/update/<int:product_id>", methods=["PUT"])
+@token_required
+async def update_quantity(user, product_id):
+    try:
+        data = await request.get_json()
+        quantity = int(data.get("quantity", 1))
+
+        await execute(UPDATE_ITEM_SQL, (quantity, product_id, user["id"]))
+
+        return jsonify({"message": "Quantity updated"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@cart_bp.route("/remove/<int:product_id>", methods=["DELETE"])
+@token_required
+async def remove_item(user, product_id):
+    try:
+        await execute(REMOVE_ITEM_SQL, (product_id, user["id"]))
+
+        return jsonify({"message": "Product removed from cart"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@cart_bp.route("/clear", methods=["DELETE"])
+@token_required
+async def clear_cart(user):
+    try:
+        await execute(CLEAR_CART_SQL, (user["id"],))
+
+        return jsonify({"message": "Cart cleared"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
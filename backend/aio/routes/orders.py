@@ -0,0 +1,244 @@
+import asyncio
+import asyncpg
+from datetime import datetime
+from quart import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from aio.database import get_pool, fetch, fetchrow, to_asyncpg
+from aio.auth import token_required, admin_required
+from aio.conditional import conditional_json
+from cache import product_cache
+from conditional import make_etag, to_timestamp
+from reservations import RELEASE_SQL
+from jobs import ENQUEUE_SQL, enqueue_params
+from analytics import ANALYTICS_REFRESH_DEBOUNCE, refresh_params
+from idempotency import (IDEMPOTENCY_HEADER, CLAIM_KEY_SQL, RESET_WAIT_TIMEOUT_SQL, STORED_RESPONSE_SQL,
+                         STORE_RESPONSE_SQL, WAIT_TIMEOUT_SQL, claim_params, count_outcome, outcome_response,
+                         parse_key, request_hash, stored_outcome, wait_timeout_params)
+from routes.orders import (LOCK_CART_SQL, LOCK_RESERVATION_SQL, LOCK_CHECKOUT_PRODUCTS_SQL,
+                           CHECKOUT_LINES_SQL, CREATE_ORDER_SQL, ORDER_STATUSES, ORDER_STATUS_SQL,
+                           USER_ORDERS_VALIDATOR_SQL, USER_ORDERS_SQL, ORDER_ITEMS_VALIDATOR_SQL,
+                           EXPORT_FORMATS, EXPORT_PAGE_SIZE, EXPORT_MAX_PAGE_SIZE, EXPORT_FETCH_SIZE,
+                           encode_order_cursor, order_lines, parse_export_args, is_paginated, all_orders_query,
+                           export_chunk, export_header, export_headers)
+
+orders_bp = Blueprint("orders", __name__)
+
+
+class CheckoutRejected(Exception):
+    """Rolls the checkout transaction back and carries the client response."""
+
+    def __init__(self, body, status, headers=None):
+        super().__init__(body.get("error") if isinstance(body, dict) else status)
+        self.body, self.status, self.headers = body, status, headers or {}
+
+
+@orders_bp.route("/create", methods=["POST"])
+@token_required
+async def create_order(user):
+    key, error = parse_key(request.headers.get(IDEMPOTENCY_HEADER))
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        user_id = user["id"]
+        data = await request.get_json(silent=True) or {}
+        reservation_id = data.get("reservation_id")
+        fingerprint = request_hash(request.method, request.path, await request.get_data()) if key else None
+
+        # same statements and lock order as routes/orders.create_order
+        async with get_pool().acquire() as conn:
+            released_ids = []
+            try:
+                async with conn.transaction():
+                    if key is not None:
+                        await conn.execute(*to_asyncpg(WAIT_TIMEOUT_SQL, wait_timeout_params()))
+                        claimed = await conn.fetchrow(*to_asyncpg(CLAIM_KEY_SQL, claim_params(user_id, key, fingerprint)))
+                        await conn.execute(RESET_WAIT_TIMEOUT_SQL)
+                        if claimed is None:
+                            row = await conn.fetchrow(*to_asyncpg(STORED_RESPONSE_SQL, {"user_id": user_id, "key": key}))
+                            raise CheckoutRejected(*outcome_response(stored_outcome(row, fingerprint)))
+
+                    cart = await conn.fetchrow(*to_asyncpg(LOCK_CART_SQL, {"user_id": user_id}))
+                    if not cart:
+                        raise CheckoutRejected({"error": "Cart not found"}, 404)
+
+                    params = {"cart_id": cart["id"], "user_id": user_id, "reservation_id": reservation_id}
+                    if reservation_id is not None:
+                        if not await conn.fetchrow(*to_asyncpg(LOCK_RESERVATION_SQL, params)):
+                            raise CheckoutRejected({"error": "Reservation not found or no longer active"}, 409)
+
+                    await conn.execute(*to_asyncpg(LOCK_CHECKOUT_PRODUCTS_SQL, params))
+
+                    if reservation_id is not None:
+                        released = await conn.fetchrow(*to_asyncpg(RELEASE_SQL, {
+                            "id": reservation_id, "user_id": user_id, "status": "committed"}))
+                        released_ids = released["product_ids"]
+
+                    lines = await conn.fetch(*to_asyncpg(CHECKOUT_LINES_SQL, params))
+                    if not lines:
+                        raise CheckoutRejected({"error": "Cart is empty"}, 400)
+
+                    shortages = [{
+                        "product_id": line["product_id"],
+                        "name": line["name"],
+                        "requested": int(line["quantity"]),
+                        "available": line["stock"]
+                    } for line in lines if line["stock"] < line["quantity"]]
+                    if shortages:
+                        raise CheckoutRejected({"error": "Insufficient stock", "items": shortages}, 409)
+
+                    order = await conn.fetchrow(*to_asyncpg(CREATE_ORDER_SQL, dict(params, **order_lines(lines))))
+                    await conn.execute(*to_asyncpg(ENQUEUE_SQL, enqueue_params(
+                        "order_created", {"order_id": order["id"]}, key=f"order_created:{order['id']}")))
+                    response = jsonify({
+                        "message": "Order created successfully",
+                        "order_id": order["id"],
+                        "status": order["status"],
+                        "total_amount": order["total_amount"],
+                        "created_at": order["created_at"]
+                    })
+                    if key is not None:
+                        await conn.execute(*to_asyncpg(STORE_RESPONSE_SQL, {
+                            "user_id": user_id, "key": key, "status": 201,
+                            "body": await response.get_data(as_text=True)}))
+                        count_outcome("created")
+            except CheckoutRejected as rejected:
+                return jsonify(rejected.body), rejected.status, rejected.headers
+            except asyncpg.exceptions.LockNotAvailableError:
+                body, status, headers = outcome_response(("in_progress",))
+                return jsonify(body), status, headers
+            except asyncpg.exceptions.CheckViolationError:
+                return jsonify({"error": "Insufficient stock"}), 409
+
+        product_cache.invalidate_products(*[line["product_id"] for line in lines], *released_ids)
+
+        return response, 201
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@orders_bp.route("/", methods=["GET"])
+@token_required
+async def get_user_orders(user):
+    try:
+        validator = await fetchrow(USER_ORDERS_VALIDATOR_SQL, (user["id"],))
+        etag = make_etag("orders", user["id"], validator["n"], validator["last_modified"])
+
+        async def load_orders():
+            rows = await fetch(USER_ORDERS_SQL, (user["id"],))
+            return [dict(row) for row in rows]
+
+        return await conditional_json(load_orders, etag, to_timestamp(validator["last_modified"]),
+                                      cache_control="private, no-cache")
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@orders_bp.route("/<int:order_id>", methods=["GET"])
+@token_required
+async def get_order_details(user, order_id):
+    try:
+        # header, items and their validator together; the items query carries
+        # the ownership check itself, so it is safe to start before the header
+        # is known, and the validator is only used once the header is
+        order, items, validator = await asyncio.gather(
+            fetchrow("SELECT * FROM orders WHERE id = %s AND user_id = %s", (order_id, user["id"])),
+            fetch("""
+                SELECT oi.id, p.name, oi.quantity, oi.unit_price, oi.subtotal
+                FROM order_items oi
+                JOIN orders o ON oi.order_id = o.id
+                JOIN products p ON oi.product_id = p.id
+                WHERE oi.order_id = %s AND o.user_id = %s
+            """, (order_id, user["id"])),
+            fetchrow(ORDER_ITEMS_VALIDATOR_SQL, (order_id,))
+        )
+        if not order:
+            return jsonify({"error": "Order not found"}), 404
+
+        etag = make_etag("order", order_id, order["updated_at"], validator["n"], validator["versions"])
+        last_modified = to_timestamp(max(filter(None, (order["updated_at"], validator["last_modified"]))))
+        return await conditional_json({"order": dict(order), "items": [dict(row) for row in items]},
+                                      etag, last_modified, cache_control="private, no-cache")
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@orders_bp.route("/<int:order_id>/status", methods=["PATCH"])
+@token_required
+@admin_required
+async def update_order_status(user, order_id):
+    try:
+        data = await request.get_json()
+        new_status = data.get("status")
+
+        if new_status not in ORDER_STATUSES:
+            return jsonify({"error": "Invalid status"}), 400
+
+        async with get_pool().acquire() as conn:
+            async with conn.transaction():
+                updated = await conn.fetchrow(*to_asyncpg(ORDER_STATUS_SQL, {
+                    "status": new_status, "updated_at": datetime.utcnow(), "order_id": order_id}))
+                if updated:
+                    await conn.execute(*to_asyncpg(ENQUEUE_SQL, refresh_params(ANALYTICS_REFRESH_DEBOUNCE)))
+
+        if not updated:
+            return jsonify({"error": "Order not found"}), 404
+
+        return jsonify({
+            "message": "Order status updated",
+            "order": dict(updated)
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@orders_bp.route("/all", methods=["GET"])
+@token_required
+@admin_required
+async def get_all_orders(user):
+    try:
+        fmt = request.args.get("format", "json")
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": "format must be json, ndjson or csv"}), 400
+        filters, error = parse_export_args(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        if fmt != "json":
+            if filters["after"]:
+                return jsonify({"error": "after is only supported with format=json"}), 400
+            dumps = current_app.json.dumps
+
+            @stream_with_context
+            async def generate():
+                yield export_header(fmt)
+                # asyncpg cursors are server-side and need a transaction
+                async with get_pool().acquire() as conn, conn.transaction():
+                    rows = []
+                    async for row in conn.cursor(*to_asyncpg(*all_orders_query(filters)),
+                                                 prefetch=EXPORT_FETCH_SIZE):
+                        rows.append(row)
+                        if len(rows) == EXPORT_FETCH_SIZE:
+                            yield export_chunk(rows, fmt, dumps)
+                            rows = []
+                    if rows:
+                        yield export_chunk(rows, fmt, dumps)
+
+            return Response(generate(), mimetype=EXPORT_FORMATS[fmt], headers=export_headers(fmt))
+
+        if not is_paginated(request.args):
+            return jsonify([dict(row) for row in await fetch(*all_orders_query(filters))]), 200
+
+        limit = min(max(request.args.get("limit", EXPORT_PAGE_SIZE, type=int), 1), EXPORT_MAX_PAGE_SIZE)
+        rows = await fetch(*all_orders_query(filters, limit + 1))
+
+        orders = [dict(row) for row in rows[:limit]]
+        return jsonify({
+            "orders": orders,
+            "next_cursor": encode_order_cursor(orders[-1]) if len(rows) > limit else None
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
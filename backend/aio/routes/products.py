@@ -0,0 +1,266 @@
+import asyncio
+from quart import Blueprint, request, jsonify
+from aio.database import fetch, fetchrow
+from aio.auth import token_required, admin_required
+from aio.conditional import is_fresh, has_conditional_headers, not_modified, conditional_json
+from cache import product_cache
+from conditional import make_etag, to_timestamp
+from json_provider import RawJSON
+from reservations import RESERVATION_TTL, RESERVATION_MAX_TTL, RESERVE_SQL, RELEASE_SQL
+from routes.products import (PRODUCT_FIELDS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, CATALOG_VALIDATOR_SQL,
+                             PRODUCT_SQL, product_row, parse_fields, search_terms,
+                             list_products_json_query,
+                             search_products_query, search_products_payload)
+
+products_bp = Blueprint("products", __name__)
+
+
+@products_bp.route("/", methods=["GET"])
+async def get_all_products():
+    try:
+        category = request.args.get("category")
+        search = request.args.get("search")
+
+        fields, error = parse_fields(request.args.get("fields"))
+        if error:
+            return jsonify({"error": error}), 400
+
+        limit = request.args.get("limit", type=int)
+        after = request.args.get("after", type=int)
+        paginate = limit is not None or after is not None
+        if paginate:
+            limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+        cache_params = {"category": category, "search": search, "fields": fields,
+                        "limit": limit, "after": after}
+        generation = product_cache.list_generation()
+        entry = product_cache.get_list("list-json", cache_params, generation)
+
+        if entry is None:
+            query = list_products_json_query(category, search, fields, after, limit)
+            if has_conditional_headers():
+                # revalidation: the validator alone may settle it with a 304
+                validator = await fetchrow(CATALOG_VALIDATOR_SQL)
+                row = None
+            else:
+                # nothing to revalidate: validator and list run side by side
+                validator, row = await asyncio.gather(fetchrow(CATALOG_VALIDATOR_SQL), fetchrow(*query))
+
+            etag = make_etag("products", cache_params, validator["version"])
+            if row is None:
+                if is_fresh(etag):
+                    return not_modified(etag)
+                row = await fetchrow(*query)
+
+            entry = {"etag": etag, "body": row["body"], "count": row["count"]}
+            product_cache.set_list("list-json", cache_params, entry, generation)
+
+        if not paginate and not entry["count"]:
+            return jsonify({"message": "No products found"}), 404
+        return await conditional_json(RawJSON(entry["body"]), entry["etag"])
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/search", methods=["GET"])
+async def search_products():
+    try:
+        term = (request.args.get("q") or "").strip()
+        if not search_terms(term):
+            return jsonify({"error": "Missing search query"}), 400
+
+        category = request.args.get("category")
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        offset = max(request.args.get("offset", 0, type=int), 0)
+
+        cache_params = {"q": term, "category": category, "limit": limit, "offset": offset}
+        generation = product_cache.list_generation()
+        payload = product_cache.get_list("search", cache_params, generation)
+        if payload is None:
+            rows = await fetch(*search_products_query(term, category, limit, offset))
+            payload = search_products_payload(rows, limit, offset)
+            product_cache.set_list("search", cache_params, payload, generation)
+
+        return jsonify(payload), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/<int:product_id>", methods=["GET"])
+async def get_product(product_id):
+    try:
+        version = product_cache.product_version(product_id)
+        entry = product_cache.get_product(product_id, version)
+
+        if entry is None:
+            row = await fetchrow(PRODUCT_SQL, (product_id,))
+            if not row:
+                return jsonify({"error": "Product not found"}), 404
+
+            entry = {
+                "etag": make_etag("product", product_id, row["version"]),
+                "last_modified": to_timestamp(row["updated_at"]),
+                "body": product_row(row, PRODUCT_FIELDS)
+            }
+            product_cache.set_product(product_id, entry, version)
+
+        return await conditional_json(entry["body"], entry["etag"], entry["last_modified"])
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/", methods=["POST"])
+@token_required
+@admin_required
+async def add_product(user):
+    try:
+        data = await request.get_json()
+        name = data.get("name")
+        price = data.get("price")
+
+        if not name or not price:
+            return jsonify({"error": "Missing required fields"}), 400
+
+        row = await fetchrow(f"""
+            INSERT INTO products (name, description, price, stock, category, image_url)
+            VALUES (%s, %s, %s::numeric, %s, %s, %s)
+            RETURNING {', '.join(PRODUCT_FIELDS)}
+        """, (name, data.get("description", ""), str(price), int(data.get("stock", 0)),
+              data.get("category", ""), data.get("image_url", "")))
+        product_cache.invalidate_lists()
+
+        return jsonify(product_row(row, PRODUCT_FIELDS)), 201
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/<int:product_id>", methods=["PUT"])
+@token_required
+@admin_required
+async def update_product(user, product_id):
+    try:
+        data = await request.get_json()
+        if not data:
+            return jsonify({"error": "Missing JSON body"}), 400
+
+        fields, values = [], []
+        for key in ["name", "description", "price", "stock", "category", "image_url"]:
+            if key in data:
+                if key == "price":
+                    fields.append("price = %s::numeric")
+                    values.append(str(data[key]))
+                else:
+                    fields.append(f"{key} = %s")
+                    values.append(int(data[key]) if key == "stock" else data[key])
+
+        if not fields:
+            return jsonify({"error": "No fields to update"}), 400
+
+        values.append(product_id)
+        row = await fetchrow(f"""
+            UPDATE products
+            SET {', '.join(fields)}
+            WHERE id = %s
+            RETURNING {', '.join(PRODUCT_FIELDS)}
+        """, values)
+
+        if not row:
+            return jsonify({"error": "Product not found"}), 404
+
+        product_cache.invalidate_products(product_id)
+        return jsonify(dict(row)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/<int:product_id>", methods=["DELETE"])
+@token_required
+@admin_required
+async def delete_product(user, product_id):
+    try:
+        deleted = await fetchrow("DELETE FROM products WHERE id = %s RETURNING id", (product_id,))
+        if not deleted:
+            return jsonify({"error": "Product not found"}), 404
+
+        product_cache.invalidate_products(product_id)
+        return jsonify({"message": f"Product {product_id} deleted"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/<int:product_id>/decrement_stock", methods=["PATCH"])
+@token_required
+async def decrement_stock(user, product_id):
+    try:
+        data = await request.get_json()
+        quantity = int(data.get("quantity", 1))
+
+        row = await fetchrow(f"""
+            UPDATE products
+            SET stock = stock - %s
+            WHERE id = %s AND stock >= %s
+            RETURNING {', '.join(PRODUCT_FIELDS)}
+        """, (quantity, product_id, quantity))
+        if not row:
+            return jsonify({"error": "Insufficient stock or product not found"}), 400
+
+        product_cache.invalidate_products(product_id)
+        return jsonify(product_row(row, PRODUCT_FIELDS)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/stock/reserve", methods=["POST"])
+@token_required
+async def reserve_stock_batch(user):
+    try:
+        data = await request.get_json() or {}
+        items = data.get("items")
+        if not items or not isinstance(items, list):
+            return jsonify({"error": "items must be a non-empty list"}), 400
+        for item in items:
+            if not isinstance(item, dict) or int(item.get("product_id", 0)) <= 0 \
+                    or int(item.get("quantity", 0)) <= 0:
+                return jsonify({"error": "Each item needs a product_id and a positive quantity"}), 400
+
+        ttl = min(max(int(data.get("ttl_seconds", RESERVATION_TTL)), 1), RESERVATION_MAX_TTL)
+
+        # one statement, so its implicit transaction gives all-or-nothing
+        row = await fetchrow(RESERVE_SQL, {
+            "product_ids": [int(item["product_id"]) for item in items],
+            "quantities": [int(item["quantity"]) for item in items],
+            "user_id": user["id"],
+            "ttl": float(ttl),
+        })
+        if row["reservation"] is None:
+            return jsonify({"error": "Insufficient stock", "items": row["shortages"]}), 409
+
+        product_cache.invalidate_products(*{int(item["product_id"]) for item in items})
+        return jsonify({"reservation": row["reservation"]}), 201
+
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid product_id or quantity"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route("/stock/reservations/<int:reservation_id>/release", methods=["POST"])
+@token_required
+async def release_stock_reservation(user, reservation_id):
+    try:
+        row = await fetchrow(RELEASE_SQL, {"id": reservation_id, "user_id": user["id"], "status": "released"})
+        if row["id"] is None:
+            return jsonify({"error": "Reservation not found or no longer active"}), 404
+
+        product_cache.invalidate_products(*row["product_ids"])
+        return jsonify({"message": f"Reservation {reservation_id} released"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,104 @@
+import datetime
+import uuid
+from quart import Blueprint, request, jsonify, current_app, g
+import jwt
+from aio.database import get_pool, fetchrow, execute, to_asyncpg
+from aio.auth import token_required
+from auth_middleware import TOKEN_LIFETIME, revoke_token
+from passwords import PASSWORD_RETRY_AFTER, PasswordPoolBusy, REHASH_SQL, get_hasher
+from routes.users import USER_BY_EMAIL_SQL
+
+users_bp = Blueprint("users", __name__)
+
+
+def busy():
+    return jsonify({"error": "Server busy, try again shortly"}), 503, {"Retry-After": str(PASSWORD_RETRY_AFTER)}
+
+
+@users_bp.route("/register", methods=["POST"])
+async def register():
+    try:
+        data = await request.get_json()
+        email = data.get("email")
+        username = data.get("username")
+        password = data.get("password")
+
+        if not email or not username or not password:
+            return jsonify({"error": "Missing required fields"}), 400
+
+        password_hash = await get_hasher().hash_password_async(password)
+
+        async with get_pool().acquire() as conn:
+            async with conn.transaction():
+                new_user = await conn.fetchrow(*to_asyncpg("""
+                    INSERT INTO users (email, password_hash, username)
+                    VALUES (%s, %s, %s)
+                    RETURNING id, email, username, created_at
+                """, (email, password_hash, username)))
+                await conn.execute(*to_asyncpg("INSERT INTO carts (user_id) VALUES (%s)", (new_user["id"],)))
+
+        return jsonify({
+            "id": new_user["id"],
+            "email": new_user["email"],
+            "username": new_user["username"],
+            "created_at": new_user["created_at"]
+        }), 201
+
+    except PasswordPoolBusy:
+        return busy()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@users_bp.route("/login", methods=["POST"])
+async def login():
+    try:
+        data = await request.get_json()
+        email = data.get("email")
+        password = data.get("password")
+
+        if not email or not password:
+            return jsonify({"error": "Missing email or password"}), 400
+
+        user = await fetchrow(USER_BY_EMAIL_SQL, {"email": email})
+        if not user:
+            return jsonify({"error": "Invalid email or password"}), 401
+
+        ok, new_hash = await get_hasher().verify_password_async(password, user["password_hash"])
+        if not ok:
+            return jsonify({"error": "Invalid email or password"}), 401
+
+        if new_hash:
+            await execute(REHASH_SQL, {"user_id": user["id"], "old_hash": user["password_hash"],
+                                       "new_hash": new_hash})
+
+        now = datetime.datetime.utcnow()
+        payload = {
+            "user_id": user["id"],
+            "username": user["username"],
+            "role": user["role"],
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + TOKEN_LIFETIME
+        }
+
+        token = jwt.encode(payload, current_app.config["SECRET_KEY"], algorithm="HS256")
+
+        return jsonify({
+            "message": "Login successful",
+            "token": token
+        }), 200
+
+    except PasswordPoolBusy:
+        return busy()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@users_bp.route("/logout", methods=["POST"])
+@token_required
+async def logout(user):
+    claims = g.token_claims
+    if claims.get("jti"):
+        revoke_token(claims["jti"], claims["exp"])
+    return jsonify({"message": "Logged out"}), 200
@@ -0,0 +1,192 @@
+"""
+Sales rollups behind the admin analytics endpoints (routes/analytics.py).
+
+Reports read small per-day tables instead of aggregating orders and
+order_items on every request:
+
+- sales_daily          orders, units and revenue per day (cancelled apart)
+- sales_daily_category the same per product category, cancelled orders left out
+- sales_daily_product  the same per product, from which top_products ranks
+                       the best sellers of the last ANALYTICS_TOP_WINDOWS days
+
+The "analytics_refresh" job (worker.py) rebuilds only the days that changed:
+days with orders placed since the previous refresh (by created_at, with
+ANALYTICS_REFRESH_OVERLAP seconds of margin for checkouts that were still
+committing), and days marked dirty by a status change. Each refresh runs in
+one transaction, so readers see either the old rollups or the new ones.
+Refreshes are queued every ANALYTICS_REFRESH_INTERVAL seconds and, batched
+over ANALYTICS_REFRESH_DEBOUNCE seconds, after an order changes status.
+The first refresh builds every day.
+"""
+import os
+import time
+from database import get_connection
+from jobs import ENQUEUE_SQL, enqueue_params, job
+from metrics import metrics
+
+ANALYTICS_REFRESH_INTERVAL = int(os.getenv("ANALYTICS_REFRESH_INTERVAL", "300"))   # seconds between scheduled refreshes; 0: none
+ANALYTICS_REFRESH_DEBOUNCE = int(os.getenv("ANALYTICS_REFRESH_DEBOUNCE", "10"))    # status changes batched this long
+ANALYTICS_REFRESH_OVERLAP = int(os.getenv("ANALYTICS_REFRESH_OVERLAP", "300"))     # seconds of orders scanned again
+ANALYTICS_TOP_WINDOWS = [int(days) for days in os.getenv("ANALYTICS_TOP_WINDOWS", "7,30,90").split(",")]
+ANALYTICS_TOP_N = 100                                                              # products ranked per window
+
+# SQL is kept in named-parameter form so the async API (aio/) can share it
+
+# Locks the state row, so refreshes run one at a time
+REFRESH_STATE_SQL = """
+    SELECT refresh_started_at - make_interval(secs => %(overlap)s) AS since, LOCALTIMESTAMP AS started
+    FROM analytics_state
+    FOR UPDATE
+"""
+
+DIRTY_DAYS_SQL = """
+    WITH marked AS (
+        DELETE FROM analytics_dirty_days RETURNING day
+    ),
+    placed AS (
+        SELECT DISTINCT created_at::date AS day FROM orders
+        WHERE %(since)s::timestamp IS NULL OR created_at >= %(since)s::timestamp
+    )
+    SELECT day FROM marked
+    UNION
+    SELECT day FROM placed
+    ORDER BY day
+"""
+
+# orders of the given days, by index range on created_at
+_DAY_ORDERS = """
+    FROM unnest(%(days)s::date[]) AS d(day)
+    JOIN orders o ON o.created_at >= d.day AND o.created_at < d.day + 1
+"""
+
+REFRESH_SQL = [
+    "DELETE FROM sales_daily WHERE day = ANY(%(days)s::date[])",
+    "DELETE FROM sales_daily_category WHERE day = ANY(%(days)s::date[])",
+    "DELETE FROM sales_daily_product WHERE day = ANY(%(days)s::date[])",
+    f"""
+    INSERT INTO sales_daily (day, orders, units, revenue, cancelled_orders, cancelled_revenue)
+    SELECT d.day,
+           count(*) FILTER (WHERE o.status <> 'cancelled'),
+           COALESCE(SUM(i.units) FILTER (WHERE o.status <> 'cancelled'), 0),
+           COALESCE(SUM(o.total_amount) FILTER (WHERE o.status <> 'cancelled'), 0),
+           count(*) FILTER (WHERE o.status = 'cancelled'),
+           COALESCE(SUM(o.total_amount) FILTER (WHERE o.status = 'cancelled'), 0)
+    {_DAY_ORDERS}
+    LEFT JOIN LATERAL (
+        SELECT SUM(quantity) AS units FROM order_items WHERE order_id = o.id
+    ) i ON TRUE
+    GROUP BY d.day
+    """,
+    f"""
+    INSERT INTO sales_daily_category (day, category, orders, units, revenue)
+    SELECT d.day, COALESCE(p.category, 'uncategorized'), count(DISTINCT o.id), SUM(oi.quantity), SUM(oi.subtotal)
+    {_DAY_ORDERS}
+    JOIN order_items oi ON oi.order_id = o.id
+    JOIN products p ON p.id = oi.product_id
+    WHERE o.status <> 'cancelled'
+    GROUP BY 1, 2
+    """,
+    f"""
+    INSERT INTO sales_daily_product (day, product_id, orders, units, revenue)
+    SELECT d.day, oi.product_id, count(DISTINCT o.id), SUM(oi.quantity), SUM(oi.subtotal)
+    {_DAY_ORDERS}
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.status <> 'cancelled'
+    GROUP BY 1, 2
+    """,
+]
+
+# Ranked again on every refresh: the windows move with the date
+RANK_TOP_PRODUCTS_SQL = [
+    "DELETE FROM top_products",
+    """
+    INSERT INTO top_products (window_days, rank, product_id, units, revenue)
+    SELECT window_days, rank, product_id, units, revenue
+    FROM (
+        SELECT w.days AS window_days, s.product_id, SUM(s.units) AS units, SUM(s.revenue) AS revenue,
+               row_number() OVER (PARTITION BY w.days ORDER BY SUM(s.revenue) DESC, s.product_id) AS rank
+        FROM unnest(%(windows)s::int[]) AS w(days)
+        JOIN sales_daily_product s ON s.day > CURRENT_DATE - w.days
+        GROUP BY w.days, s.product_id
+    ) ranked
+    WHERE rank <= %(top_n)s
+    """,
+]
+
+FINISH_REFRESH_SQL = """
+    UPDATE analytics_state
+    SET refreshed_at = LOCALTIMESTAMP, refresh_started_at = %(started)s,
+        duration_ms = %(duration_ms)s, days_refreshed = %(days_refreshed)s
+"""
+
+metrics.describe("analytics_refreshes_total", "counter", "Rollup refreshes run.")
+metrics.describe("analytics_refresh_days_total", "counter", "Days rebuilt by rollup refreshes.")
+metrics.describe("analytics_refresh_seconds_total", "counter", "Time spent refreshing rollups.")
+
+
+def refresh_params(within):
+    """
+    enqueue_params() of a refresh that runs at the end of the current
+    ``within``-second window. Every call in the same window shares its
+    idempotency key, so they queue one refresh between them.
+    """
+    now = time.time()
+    window = int(now // within)
+    return enqueue_params("analytics_refresh", key=f"analytics_refresh:{within}:{window}",
+                          delay=(window + 1) * within - now)
+
+
+def schedule_refresh(cur, within=ANALYTICS_REFRESH_DEBOUNCE):
+    """
+    Queues a refresh in the cursor's transaction, batched with the others
+    of the next ``within`` seconds.
+    """
+    cur.execute(ENQUEUE_SQL, refresh_params(within))
+
+
+def schedule_periodic_refresh():
+    """
+    Queues the refresh of the current ANALYTICS_REFRESH_INTERVAL window, if
+    no worker has yet. Called by every worker at each maintenance pass.
+    """
+    if ANALYTICS_REFRESH_INTERVAL <= 0:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        schedule_refresh(cur, ANALYTICS_REFRESH_INTERVAL)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def refresh_rollups(cur):
+    """
+    Rebuilds the days that changed since the last refresh, then ranks the
+    top products, in the cursor's transaction. Returns the number of days
+    rebuilt.
+    """
+    started = time.perf_counter()
+    cur.execute(REFRESH_STATE_SQL, {"overlap": ANALYTICS_REFRESH_OVERLAP})
+    state = cur.fetchone()
+    cur.execute(DIRTY_DAYS_SQL, {"since": state["since"]})
+    days = [row["day"] for row in cur.fetchall()]
+    if days:
+        for sql in REFRESH_SQL:
+            cur.execute(sql, {"days": days})
+    for sql in RANK_TOP_PRODUCTS_SQL:
+        cur.execute(sql, {"windows": ANALYTICS_TOP_WINDOWS, "top_n": ANALYTICS_TOP_N})
+    duration = time.perf_counter() - started
+    cur.execute(FINISH_REFRESH_SQL, {"started": state["started"], "duration_ms": int(duration * 1000),
+                                     "days_refreshed": len(days)})
+
+    metrics.inc("analytics_refreshes_total")
+    metrics.inc("analytics_refresh_days_total", value=len(days))
+    metrics.inc("analytics_refresh_seconds_total", value=duration)
+    return len(days)
+
+
+@job("analytics_refresh")
+def analytics_refresh(cur, payload, job_row):
+    refresh_rollups(cur)
@@ -1,46 +1,162 @@
-from flask import Flask
+from flask import Flask, jsonify
 from flask_cors import CORS
-from database import init_db
+from auth_middleware import token_required, admin_required
+from database import init_app as init_db_pool, get_connection, pool_stats, close_pool
+from cache import product_cache
+from json_provider import FastJSONProvider
+from compression import init_app as init_compression
+from jobs import queue_stats
+from instrumentation import init_app as init_instrumentation, query_log
+from metrics import init_app as init_metrics, metrics_response, start_metrics_flusher, flush as flush_metrics
+from passwords import password_stats, close_hasher
+from ratelimit import init_app as init_rate_limits
+from reservations import start_reservation_sweeper
 from routes.users import users_bp
 from routes.products import products_bp
 from routes.carts import cart_bp
 from routes.orders import orders_bp
+from routes.analytics import analytics_bp
 
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
-print("SECRET_KEY:", os.getenv("SECRET_KEY"))
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
-
-CORS(
-    app,
-    resources={r"/*": {
-        # 1. Be specific with your origin. Browsers block '*'
-        #    when 'Authorization' headers are used.
-        "origins": "*",
-        
-        # 2. Add "DELETE" and "OPTIONS"
-        "methods": ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
-        
-        # 3. This is the most important part you're missing
-        "allow_headers": ["Content-Type", "Authorization"]
-    }}
-)
-
-init_db()
-print("✅ Tables ensured.")
-
-app.register_blueprint(users_bp, url_prefix="/users")
-app.register_blueprint(products_bp, url_prefix="/products")
-app.register_blueprint(cart_bp,url_prefix="/carts")
-app.register_blueprint(orders_bp,url_prefix="/orders")
-
-
-@app.route("/")
-def home():
-    return {"msg": "Flask + DB schema ready"}
+
+# Background threads of this process (they do not survive a fork, so
+# servers that prefork start them per worker via start_background_tasks)
+_background_stops = []
+
+
+def create_app():
+    """
+    Application factory. Importing it has no side effects on the database:
+    schema changes live in migrate.py and run once per deploy.
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+
+    CORS(
+        app,
+        resources={r"/*": {
+            # 1. Be specific with your origin. Browsers block '*'
+            #    when 'Authorization' headers are used.
+            "origins": "*",
+
+            # 2. Add "DELETE" and "OPTIONS"
+            "methods": ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
+
+            # 3. This is the most important part you're missing
+            "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key", "X-DB-LSN"],
+
+            # 4. Read-your-writes token (database.py), sent back on reads
+            "expose_headers": ["X-DB-LSN"]
+        }}
+    )
+
+    init_db_pool(app)
+    init_instrumentation(app)
+    init_metrics(app)
+    init_rate_limits(app)
+    init_compression(app)
+
+    app.register_blueprint(users_bp, url_prefix="/users")
+    app.register_blueprint(products_bp, url_prefix="/products")
+    app.register_blueprint(cart_bp,url_prefix="/carts")
+    app.register_blueprint(orders_bp,url_prefix="/orders")
+    app.register_blueprint(analytics_bp, url_prefix="/analytics")
+
+    @app.route("/")
+    def home():
+        return {"msg": "Flask + DB schema ready"}
+
+    # liveness: the process is up and serving
+    @app.route("/health/live")
+    def live():
+        return {"status": "ok"}
+
+    # readiness: this worker can reach the database
+    @app.route("/health/ready")
+    def ready():
+        try:
+            conn = get_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.close()
+        except Exception:
+            # probes may be reachable from outside: no driver message, no DSN
+            return jsonify({"status": "unavailable", "error": "Database unavailable"}), 503
+        return {"status": "ok"}
+
+    # operational detail for admins; /metrics takes METRICS_TOKEN instead
+    @app.route("/stats/db")
+    @token_required
+    @admin_required
+    def db_stats(user):
+        return pool_stats()
+
+    @app.route("/stats/cache")
+    @token_required
+    @admin_required
+    def cache_stats(user):
+        return product_cache.stats()
+
+    # background jobs waiting, running and failed, by kind
+    @app.route("/stats/jobs")
+    @token_required
+    @admin_required
+    def jobs_stats(user):
+        return queue_stats()
+
+    @app.route("/stats/passwords")
+    @token_required
+    @admin_required
+    def passwords_stats(user):
+        return password_stats()
+
+    # Prometheus text format; all workers when METRICS_DIR is shared
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return metrics_response()
+
+    # slow queries and N+1 patterns by fingerprint, worst first
+    @app.route("/stats/queries")
+    @token_required
+    @admin_required
+    def queries_stats(user):
+        return query_log.stats()
+
+    return app
+
+
+def start_background_tasks():
+    """
+    Starts per-process background threads. Called once per worker after fork.
+    """
+    for start in (start_reservation_sweeper, start_metrics_flusher):
+        stop = start()
+        if stop is not None:
+            _background_stops.append(stop)
+
+
+def shutdown(drain_timeout=10.0):
+    """
+    Stops background threads and drains the connection pool: in-flight
+    requests get up to ``drain_timeout`` seconds to hand their connections back.
+    """
+    while _background_stops:
+        _background_stops.pop().set()
+    close_pool(drain_timeout=drain_timeout)
+    close_hasher()
+    flush_metrics()   # this worker's final counts, for the workers still running
+
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    start_background_tasks()
+    try:
+        app.run(debug=os.getenv("FLASK_DEBUG") == "1")
+    finally:
+        shutdown()
@@ -1,7 +1,101 @@
 from functools import wraps
-from flask import request, jsonify, current_app
+import datetime
+import os
+import time
+from flask import request, jsonify, current_app, g
 import jwt
 from database import get_connection
+from cache import make_backend, make_expiring_backend
+from ratelimit import check_user_limit
+
+TOKEN_LIFETIME = datetime.timedelta(hours=2)
+
+# How token_required resolves the user behind a valid token:
+#   "claims" - trust the verified token claims, no database hit at all
+#   "cached" - look the user up once, then serve it from the auth cache
+#   "db"     - look the user up on every request
+AUTH_MODE = os.getenv("AUTH_MODE", "cached")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Where cached users and revocations live. "memory" is per process: with
+# several workers (gunicorn.conf.py) a logout or invalidate_user() would only
+# reach the worker that ran it, so use "redis" there.
+AUTH_CACHE_BACKEND = os.getenv("AUTH_CACHE_BACKEND", "memory")   # memory | local | redis
+
+user_cache = make_backend(AUTH_CACHE_BACKEND, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Revocation list: revoked token ids (jti), and per-user cut-offs (tokens
+# issued up to the cut-off are rejected). Entries expire after a token
+# lifetime, once every token they could match has expired anyway, and never
+# earlier: an evicted revocation would let its token back in.
+revocations = make_expiring_backend(AUTH_CACHE_BACKEND, ttl=TOKEN_LIFETIME.total_seconds())
+
+
+def cached_user(user_id):
+    return user_cache.get(f"auth:user:{user_id}")
+
+
+def cache_user(user):
+    user_cache.set(f"auth:user:{user['id']}", user)
+
+
+def revoke_token(jti, expires_at):
+    """
+    Rejects a single token (by its jti claim) until it expires, e.g. on logout.
+    """
+    if expires_at > time.time():
+        revocations.set(f"auth:revoked:{jti}", True)
+
+
+def invalidate_user(user_id, revoke_tokens=True):
+    """
+    Drops the cached copy of a user. Call it after a role change or when a user
+    is deleted. With revoke_tokens, every token issued so far for the user is
+    rejected too - needed in "claims" mode, where the role lives in the token.
+    """
+    user_cache.delete(f"auth:user:{user_id}")
+    if revoke_tokens:
+        revocations.set(f"auth:cutoff:{user_id}", int(time.time()))
+
+
+def is_revoked(data):
+    if data.get("jti") and revocations.get(f"auth:revoked:{data['jti']}"):
+        return True
+    cutoff = revocations.get(f"auth:cutoff:{data['user_id']}")
+    # iat has whole seconds: a token from the second of the cut-off may predate it
+    return cutoff is not None and data.get("iat", 0) <= cutoff
+
+
+USER_SQL = "SELECT id, email, username, role, created_at FROM users WHERE id = %(user_id)s"
+
+
+def user_from_claims(data):
+    return {"id": data["user_id"], "username": data.get("username"), "role": data.get("role", "user")}
+
+
+def _load_user(data):
+    user_id = data["user_id"]
+
+    if AUTH_MODE == "claims":
+        return user_from_claims(data)
+
+    if AUTH_MODE == "cached":
+        user = cached_user(user_id)
+        if user is not None:
+            return user
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(USER_SQL, {"user_id": user_id})
+    user = cur.fetchone()
+    cur.close()
+    conn.close()
+
+    if user and AUTH_MODE == "cached":
+        user = dict(user)
+        cache_user(user)
+    return user
 
 
 def token_required(f):
@@ -18,14 +112,16 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
-            user_id = data["user_id"]
 
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
-            cur.close()
-            conn.close()
+            if is_revoked(data):
+                return jsonify({"error": "Token has been revoked"}), 401
+
+            # per-user rate limit, before the user costs a lookup
+            limited = check_user_limit(data["user_id"])
+            if limited is not None:
+                return limited
+
+            user = _load_user(data)
 
             if not user:
                 return jsonify({"error": "User not found"}), 404
@@ -35,9 +131,14 @@ def token_required(f):
         except jwt.InvalidTokenError:
             return jsonify({"error": "Invalid token"}), 401
 
+        # keep the verified claims around (e.g. for logout)
+        g.token_claims = data
+
         # attach user info to request for downstream use
         return f(user, *args, **kwargs)
 
+    # rate limited per user by the decorator, not per IP (ratelimit.py)
+    decorated.token_required = True
     return decorated
 
 
@@ -0,0 +1,11 @@
+"""
+Load test and benchmark suite for the API.
+
+    python -m benchmark seed                     # load benchmark data (tagged, replaceable)
+    python -m benchmark run                      # in-process server, results/<time>-<commit>.json
+    python -m benchmark run --url http://127.0.0.1:5000 --concurrency 32
+    python -m benchmark compare before.json after.json
+
+Run it against a local database: seeding deletes and recreates every
+benchmark row (``@bench.test`` users, ``bench-`` categories).
+"""
@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import psycopg2
+
+# a benchmark is one client hammering the API, which is what the rate
+# limits are there to stop; set RATE_LIMITING=1 to measure them as well
+os.environ.setdefault("RATE_LIMITING", "0")
+
+from database import DATABASE_URL
+from . import results, runner, seed
+from .scenarios import parse_mix
+
+
+def seed_command(args):
+    volumes = {name: getattr(args, name) for name in seed.DEFAULT_VOLUMES}
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        seed.seed(conn, volumes, seed=args.seed)
+    finally:
+        conn.close()
+    print("✅ Benchmark data ready: " + ", ".join(f"{n} {name}" for name, n in volumes.items()))
+    return 0
+
+
+def run_command(args):
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    try:
+        result = runner.run(url=args.url, concurrency=args.concurrency, duration=args.duration,
+                            warmup=args.warmup, mix=mix, seed=args.seed)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    print(results.format_table(result))
+    path = results.save(result, args.output)
+    print(f"Results saved to {path}")
+    return 0
+
+
+def compare_command(args):
+    print(results.format_comparison(results.load(args.before), results.load(args.after)))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark the API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="replace the benchmark data")
+    for name, default in seed.DEFAULT_VOLUMES.items():
+        seed_parser.add_argument(f"--{name}", type=int, default=default, help=f"default {default}")
+    seed_parser.add_argument("--seed", type=float, default=0.42, help="random seed for the data, -1 to 1")
+    seed_parser.set_defaults(func=seed_command)
+
+    run_parser = commands.add_parser("run", help="run the scenarios and save the results")
+    run_parser.add_argument("--url", help="server to load, e.g. http://127.0.0.1:5000 "
+                                          "(default: serve the app in this process)")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="virtual users (default 8)")
+    run_parser.add_argument("--duration", type=float, default=30, help="measured seconds (default 30)")
+    run_parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds first (default 5)")
+    run_parser.add_argument("--mix", help="scenario weights, e.g. browse=60,search=20,checkout=20")
+    run_parser.add_argument("--seed", type=int, default=42, help="random seed for the virtual users")
+    run_parser.add_argument("--output", help="result file (default: benchmark/results/<time>-<commit>.json)")
+    run_parser.set_defaults(func=run_command)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+# the password pool's forkserver re-imports __main__, so keep this guarded
+if __name__ == "__main__":
+    sys.exit(main())
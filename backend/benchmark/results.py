@@ -0,0 +1,143 @@
+"""
+Summaries of recorded samples, and the JSON result files runs are compared
+with. A sample is (label, status, milliseconds, queries); queries is None
+when the server does not report it.
+"""
+import datetime
+import json
+import os
+import subprocess
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+RESULT_FORMAT = 1
+COMPARED = ("rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request", "error_rate")
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))   # ceil without floats
+    return sorted_values[int(rank) - 1]
+
+
+def summarise(samples, seconds):
+    latencies = sorted(ms for _, _, ms, _ in samples)
+    queries = [q for _, _, _, q in samples if q is not None]
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    # 0 is a connection error, 5xx a server error; 4xx are the scenario's
+    # business (e.g. an empty cart) and count as answered
+    errors = sum(n for status, n in statuses.items() if status == "0" or status.startswith("5"))
+    count = len(samples)
+    return {
+        "requests": count,
+        "rps": round(count / seconds, 2) if seconds else None,
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p95_ms": _round(percentile(latencies, 95)),
+        "p99_ms": _round(percentile(latencies, 99)),
+        "mean_ms": _round(sum(latencies) / count) if count else None,
+        "max_ms": _round(latencies[-1]) if latencies else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "error_rate": round(errors / count, 4) if count else None,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def _round(ms):
+    return None if ms is None else round(ms, 2)
+
+
+def build_result(samples, seconds, config, scenarios):
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample[0], []).append(sample)
+    return {
+        "format": RESULT_FORMAT,
+        "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "config": config,
+        "seconds": round(seconds, 2),
+        "scenarios": scenarios,
+        "total": summarise(samples, seconds),
+        "endpoints": {label: summarise(by_label[label], seconds) for label in sorted(by_label)},
+    }
+
+
+def git_revision():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    commit = git("rev-parse", "--short", "HEAD")
+    return {"commit": commit, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))
+            if commit else None}
+
+
+def save(result, path=None):
+    """
+    Writes the result as JSON; by default to results/<time>-<commit>.json.
+    Returns the path.
+    """
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        commit = result["git"]["commit"] or "nogit"
+        path = os.path.join(RESULTS_DIR, f"{stamp}-{commit}{'-dirty' if result['git']['dirty'] else ''}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+        f.write("\n")
+    return path
+
+
+def load(path):
+    with open(path) as f:
+        result = json.load(f)
+    if result.get("format") != RESULT_FORMAT:
+        raise ValueError(f"{path}: unsupported result format {result.get('format')!r}")
+    return result
+
+
+def format_table(result):
+    rows = [("endpoint", "requests", "rps", "p50", "p95", "p99", "q/req", "errors")]
+    for label, stats in [("TOTAL", result["total"]), *result["endpoints"].items()]:
+        rows.append((label, str(stats["requests"]), _cell(stats["rps"]), _cell(stats["p50_ms"]),
+                     _cell(stats["p95_ms"]), _cell(stats["p99_ms"]),
+                     _cell(stats["queries_per_request"]), _cell(stats["error_rate"], "{:.2%}")))
+    return _table(rows)
+
+
+def format_comparison(before, after):
+    """
+    Side by side of two results, per endpoint, with the relative change.
+    """
+    rows = [("endpoint", "metric", "before", "after", "change")]
+    labels = ["TOTAL"] + sorted(set(before["endpoints"]) | set(after["endpoints"]))
+    for label in labels:
+        old = before["total"] if label == "TOTAL" else before["endpoints"].get(label, {})
+        new = after["total"] if label == "TOTAL" else after["endpoints"].get(label, {})
+        for metric in COMPARED:
+            a, b = old.get(metric), new.get(metric)
+            if a is None and b is None:
+                continue
+            change = f"{(b - a) / a:+.1%}" if a and b is not None else ""
+            rows.append((label, metric, _cell(a), _cell(b), change))
+            label = ""
+    header = (f"before: {before['git']['commit']} ({before['finished_at']})\n"
+              f"after:  {after['git']['commit']} ({after['finished_at']})\n")
+    return header + _table(rows)
+
+
+def _cell(value, fmt="{}"):
+    return "-" if value is None else fmt.format(value)
+
+
+def _table(rows):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                               for i, (cell, width) in enumerate(zip(row, widths))) for row in rows)
@@ -0,0 +1,247 @@
+"""
+Closed-loop load generator: ``concurrency`` virtual users, each a thread with
+its own keep-alive connection and login, run weighted scenarios back to back
+for the warm-up and then the measured period.
+
+Without a URL the app is served in this process (werkzeug, threaded);
+with one, e.g. gunicorn, that server is loaded. Queries per request come
+from the Server-Timing header the app sends (unless SERVER_TIMING=0).
+"""
+import http.client
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import psycopg2
+
+import database
+from .results import build_result
+from .scenarios import SCENARIOS
+from .seed import ADMIN_EMAIL, BENCH_PASSWORD, bench_catalog, bench_users
+
+# query count from the app's Server-Timing header (instrumentation.py)
+SERVER_TIMING_QUERIES = re.compile(r'(?:^|,)\s*db;[^,]*desc="(\d+) queries')
+LOGIN_ATTEMPTS = 10
+
+
+class Catalog:
+    def __init__(self, categories, product_ids):
+        self.categories = categories
+        self.product_ids = product_ids
+
+    def random_product(self, rng):
+        return rng.choice(self.product_ids)
+
+
+class Client:
+    """
+    One keep-alive HTTP connection. A request that fails because the server
+    closed an idle connection is retried once on a new one.
+    """
+
+    def __init__(self, base_url, timeout=30.0):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        for attempt in (1, 2):
+            reused = self.conn is not None
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, self.prefix + path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if reused and attempt == 1:
+                    continue
+                raise
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+            return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Session:
+    """
+    A virtual user: its client, tokens and the samples it recorded.
+    """
+
+    def __init__(self, client, token=None, admin_token=None):
+        self.client = client
+        self.token = token
+        self.admin_token = admin_token
+        self.recording = False
+        self.samples = []
+
+    def get(self, label, path, auth=False, admin=False):
+        return self.call(label, "GET", path, None, auth, admin)
+
+    def post(self, label, path, body=None, auth=False, admin=False):
+        return self.call(label, "POST", path, body, auth, admin)
+
+    def call(self, label, method, path, body, auth, admin):
+        headers = {}
+        token = self.admin_token if admin else self.token if auth else None
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            status, response_headers, data = self.client.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            status, response_headers, data = 0, {}, b""
+        ms = (time.perf_counter() - started) * 1000
+        if self.recording:
+            queries = SERVER_TIMING_QUERIES.search(response_headers.get("server-timing", ""))
+            self.samples.append((label, status, ms, int(queries.group(1)) if queries else None))
+        if response_headers.get("content-type", "").startswith("application/json"):
+            try:
+                return json.loads(data)
+            except ValueError:
+                return None
+        return None
+
+
+def login(base_url, email):
+    """
+    Token for a seeded user. Retries while the server sheds load (503), which
+    the hashing pool does when every virtual user logs in at once.
+    """
+    client = Client(base_url)
+    try:
+        for _ in range(LOGIN_ATTEMPTS):
+            status, headers, data = client.request("POST", "/users/login",
+                                                   {"email": email, "password": BENCH_PASSWORD})
+            if status == 200:
+                return json.loads(data)["token"]
+            if status != 503:
+                raise RuntimeError(f"Login as {email} failed ({status}): {data[:200]!r}")
+            time.sleep(float(headers.get("retry-after", "1")))
+        raise RuntimeError(f"Login as {email} kept failing with 503")
+    finally:
+        client.close()
+
+
+# --- in-process server ---
+
+def serve_in_process():
+    """
+    Starts the app on a free local port. Returns (base_url, stop).
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import create_app, shutdown
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass   # a log line per request would be measured too
+
+    app = create_app()
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        thread.join()
+        shutdown()
+
+    return f"http://127.0.0.1:{server.port}", stop
+
+
+# --- the run ---
+
+def run(url=None, concurrency=8, duration=30.0, warmup=5.0, mix=None, seed=42, log=print):
+    """
+    Runs the benchmark and returns its result (see results.build_result).
+    """
+    conn = psycopg2.connect(database.DATABASE_URL)
+    try:
+        emails = bench_users(conn, concurrency)
+        catalog = Catalog(*bench_catalog(conn))
+    finally:
+        conn.close()
+    if len(emails) < concurrency or not catalog.product_ids:
+        raise RuntimeError(f"Not enough benchmark data for {concurrency} virtual users; "
+                           "run `python -m benchmark seed` first")
+
+    stop_server = None
+    if url is None:
+        url, stop_server = serve_in_process()
+
+    try:
+        log(f"Logging in {concurrency} virtual users against {url}...")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            tokens = list(executor.map(lambda email: login(url, email), emails))
+        admin_token = login(url, ADMIN_EMAIL)
+        sessions = [Session(Client(url), token, admin_token) for token in tokens]
+
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        scenario_counts = {name: 0 for name in names}
+        counts_lock = threading.Lock()
+        stop = threading.Event()
+
+        def virtual_user(index, session):
+            rng = random.Random(seed * 1000 + index)
+            done = {name: 0 for name in names}
+            while not stop.is_set():
+                name = rng.choices(names, weights)[0]
+                SCENARIOS[name](session, rng, catalog)
+                if session.recording:
+                    done[name] += 1
+            session.client.close()
+            with counts_lock:
+                for name, n in done.items():
+                    scenario_counts[name] += n
+
+        threads = [threading.Thread(target=virtual_user, args=(i, s), name=f"vu-{i}", daemon=True)
+                   for i, s in enumerate(sessions)]
+        for thread in threads:
+            thread.start()
+
+        log(f"Warming up for {warmup:g}s...")
+        time.sleep(warmup)
+        for session in sessions:
+            session.recording = True
+        started = time.monotonic()
+        log(f"Measuring for {duration:g}s at concurrency {concurrency}...")
+        time.sleep(duration)
+        for session in sessions:
+            session.recording = False
+        seconds = time.monotonic() - started
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        if stop_server is not None:
+            stop_server()
+
+    samples = [sample for session in sessions for sample in session.samples]
+    config = {
+        "target": "in-process" if stop_server else url,
+        "concurrency": concurrency,
+        "duration": duration,
+        "warmup": warmup,
+        "mix": mix,
+        "seed": seed,
+        "products": len(catalog.product_ids),
+    }
+    if stop_server:
+        config["db_pool_max_size"] = database.DB_POOL_MAX_SIZE
+    return build_result(samples, seconds, config, scenario_counts)
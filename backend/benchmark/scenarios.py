@@ -0,0 +1,88 @@
+"""
+What a virtual user does in one iteration. Each scenario is a short user
+journey against the seeded data; the runner picks one per iteration by
+weight. Requests are recorded under the route they hit, with ids collapsed
+(``GET /products/<id>``), so results line up across runs.
+"""
+from routes.orders import ORDER_STATUSES
+from .seed import COLOURS, ITEMS
+
+# default mix, roughly a storefront: mostly reads, few writes
+DEFAULT_MIX = {
+    "browse": 40,
+    "search": 20,
+    "product": 15,
+    "cart": 15,
+    "checkout": 5,
+    "admin_orders": 5,
+}
+
+
+def browse(session, rng, catalog):
+    # a category page, and now and then the next one
+    category = rng.choice(catalog.categories)
+    data = session.get("GET /products", f"/products/?category={category}&limit=20")
+    cursor = (data or {}).get("next_cursor")
+    if cursor and rng.random() < 0.3:
+        session.get("GET /products", f"/products/?category={category}&limit=20&after={cursor}")
+
+
+def search(session, rng, catalog):
+    words = [rng.choice(COLOURS), rng.choice(ITEMS)]
+    term = " ".join(words[:rng.randint(1, 2)])
+    session.get("GET /products/search", f"/products/search?q={term.replace(' ', '+')}")
+
+
+def product(session, rng, catalog):
+    session.get("GET /products/<id>", f"/products/{catalog.random_product(rng)}")
+
+
+def cart(session, rng, catalog):
+    session.post("POST /carts/add", "/carts/add",
+                 {"product_id": catalog.random_product(rng), "quantity": 1}, auth=True)
+    session.get("GET /carts", "/carts/", auth=True)
+
+
+def checkout(session, rng, catalog):
+    session.post("POST /carts/add", "/carts/add",
+                 {"product_id": catalog.random_product(rng), "quantity": 1}, auth=True)
+    session.post("POST /orders/create", "/orders/create", auth=True)
+
+
+def admin_orders(session, rng, catalog):
+    path = "/orders/all?limit=50"
+    if rng.random() < 0.5:
+        path += f"&status={rng.choice(ORDER_STATUSES)}"
+    session.get("GET /orders/all", path, admin=True)
+
+
+SCENARIOS = {
+    "browse": browse,
+    "search": search,
+    "product": product,
+    "cart": cart,
+    "checkout": checkout,
+    "admin_orders": admin_orders,
+}
+
+
+def parse_mix(raw):
+    """
+    "browse=60,checkout=10" -> {"browse": 60, "checkout": 10}. Scenarios left
+    out do not run.
+    """
+    if not raw:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name}: {weight!r}")
+    if not any(mix.values()):
+        raise ValueError("The scenario mix needs at least one positive weight")
+    return mix
@@ -0,0 +1,176 @@
+"""
+Benchmark data: a catalog, users with carts and an order history, generated
+in SQL so even large volumes load in seconds. Every seeded row is tagged
+(``bench-`` categories, ``@bench.test`` emails) so a reseed replaces only
+its own data and never touches real rows.
+"""
+import bcrypt
+
+from passwords import BCRYPT_ROUNDS
+from routes.orders import ORDER_STATUSES
+
+BENCH_PASSWORD = "bench-password"
+ADMIN_EMAIL = "bench-admin@bench.test"
+EMAIL_DOMAIN = "@bench.test"
+CATEGORY_PREFIX = "bench-"
+
+# Product names are "<colour> <item>", so search scenarios can pick terms
+# that match a realistic share of the catalog
+COLOURS = ["red", "blue", "green", "black", "white", "silver", "golden", "wooden"]
+ITEMS = ["widget", "lamp", "chair", "kettle", "backpack", "notebook", "speaker",
+         "blanket", "bottle", "clock", "camera", "jacket"]
+
+DEFAULT_VOLUMES = {
+    "products": 10_000,
+    "categories": 20,
+    "users": 1_000,
+    "carts": 500,        # users whose cart starts with a few items
+    "orders": 50_000,
+}
+
+RESET_SQL = f"""
+    DELETE FROM users WHERE email LIKE '%{EMAIL_DOMAIN}';
+    DELETE FROM products WHERE category LIKE '{CATEGORY_PREFIX}%';
+"""
+
+PRODUCTS_SQL = """
+    INSERT INTO products (name, description, price, stock, category)
+    SELECT initcap((%(colours)s::text[])[1 + i %% cardinality(%(colours)s)] || ' '
+                   || (%(items)s::text[])[1 + (i / cardinality(%(colours)s)) %% cardinality(%(items)s)]) || ' ' || i,
+           'Benchmark item ' || i,
+           round((1 + random() * 199)::numeric, 2),
+           1000000,
+           %(prefix)s || (i %% %(categories)s)
+    FROM generate_series(1, %(products)s) AS i
+"""
+
+USERS_SQL = """
+    INSERT INTO users (email, password_hash, username, role)
+    SELECT 'bench-' || i || %(domain)s, %(password_hash)s, 'bench-' || i, 'user'
+    FROM generate_series(1, %(users)s) AS i
+    UNION ALL
+    SELECT %(admin_email)s, %(password_hash)s, 'bench-admin', 'admin'
+"""
+
+# one cart per user, as /users/register creates it
+CARTS_SQL = """
+    INSERT INTO carts (user_id)
+    SELECT id FROM users WHERE email LIKE '%%' || %(domain)s
+"""
+
+# "+ (c.id * 0)" ties the LATERAL subquery to the outer row, so random() is
+# drawn again for every cart (and, below, every order) instead of once
+CART_ITEMS_SQL = """
+    INSERT INTO cart_items (cart_id, product_id, quantity)
+    SELECT DISTINCT ON (c.id, p.product_id) c.id, p.product_id, 1 + (random() * 2)::int
+    FROM (SELECT c.id FROM carts c JOIN users u ON u.id = c.user_id
+          WHERE u.email LIKE 'bench-%%' || %(domain)s AND u.role = 'user'
+          ORDER BY u.id LIMIT %(carts)s) c
+    CROSS JOIN LATERAL (
+        SELECT (%(product_ids)s::int[])[1 + floor(random() * cardinality(%(product_ids)s::int[]))::int] AS product_id
+        FROM generate_series(1, 1 + (random() * 4)::int + (c.id * 0))
+    ) p
+"""
+
+# orders spread over the last year, then one to three lines each; totals are
+# fixed up from the lines afterwards
+ORDERS_SQL = """
+    WITH new_orders AS (
+        INSERT INTO orders (user_id, status, created_at, updated_at)
+        SELECT (%(user_ids)s::int[])[1 + floor(random() * cardinality(%(user_ids)s::int[]))::int],
+               (%(statuses)s::text[])[1 + floor(random() * cardinality(%(statuses)s))::int],
+               ts, ts
+        FROM (SELECT LOCALTIMESTAMP - random() * interval '365 days' AS ts
+              FROM generate_series(1, %(orders)s)) s
+        RETURNING id
+    )
+    INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+    SELECT o.id, l.product_id, 1 + (random() * 3)::int, p.price
+    FROM new_orders o
+    CROSS JOIN LATERAL (
+        SELECT DISTINCT (%(product_ids)s::int[])[1 + floor(random() * cardinality(%(product_ids)s::int[]))::int] AS product_id
+        FROM generate_series(1, 1 + (random() * 2)::int + (o.id * 0))
+    ) l
+    JOIN products p ON p.id = l.product_id
+"""
+
+ORDER_TOTALS_SQL = """
+    UPDATE orders o SET total_amount = t.total
+    FROM (SELECT order_id, SUM(subtotal) AS total FROM order_items GROUP BY order_id) t
+    WHERE t.order_id = o.id AND o.user_id = ANY(%(user_ids)s)
+"""
+
+
+def seed(conn, volumes=None, seed=0.42, log=print):
+    """
+    Replaces the benchmark rows with freshly generated ones. ``seed`` (between
+    -1 and 1) makes the generated data repeatable. Returns the row counts.
+    """
+    volumes = dict(DEFAULT_VOLUMES, **(volumes or {}))
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"),
+                                  bcrypt.gensalt(BCRYPT_ROUNDS)).decode("utf-8")
+    params = dict(volumes, colours=COLOURS, items=ITEMS, statuses=ORDER_STATUSES,
+                  prefix=CATEGORY_PREFIX, domain=EMAIL_DOMAIN, admin_email=ADMIN_EMAIL,
+                  password_hash=password_hash)
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", (seed,))
+        log("Removing previous benchmark data...")
+        cur.execute(RESET_SQL)
+
+        log(f"Seeding {volumes['products']} products in {volumes['categories']} categories...")
+        cur.execute(PRODUCTS_SQL, params)
+        cur.execute("SELECT array_agg(id ORDER BY id) FROM products WHERE category LIKE %s",
+                    (CATEGORY_PREFIX + "%",))
+        params["product_ids"] = cur.fetchone()[0]
+
+        log(f"Seeding {volumes['users']} users and their carts...")
+        cur.execute(USERS_SQL, params)
+        cur.execute(CARTS_SQL, params)
+        cur.execute("SELECT array_agg(id ORDER BY id) FROM users WHERE email LIKE %s AND role = 'user'",
+                    ("%" + EMAIL_DOMAIN,))
+        params["user_ids"] = cur.fetchone()[0]
+        cur.execute(CART_ITEMS_SQL, params)
+
+        log(f"Seeding {volumes['orders']} orders...")
+        cur.execute(ORDERS_SQL, params)
+        cur.execute(ORDER_TOTALS_SQL, params)
+    conn.commit()
+
+    # fresh statistics, so the planner sees the new volumes right away
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in ("products", "users", "carts", "cart_items", "orders", "order_items"):
+                cur.execute(f"ANALYZE {table}")
+    finally:
+        conn.autocommit = False
+    return volumes
+
+
+def bench_users(conn, limit):
+    """
+    Emails of the first ``limit`` seeded (non-admin) users, one per virtual user.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT email FROM users WHERE email LIKE %s AND role = 'user'
+            ORDER BY id LIMIT %s
+        """, ("%" + EMAIL_DOMAIN, limit))
+        emails = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return emails
+
+
+def bench_catalog(conn):
+    """
+    Seeded category names and product ids.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT array_agg(DISTINCT category), array_agg(id)
+            FROM products WHERE category LIKE %s
+        """, (CATEGORY_PREFIX + "%",))
+        categories, product_ids = cur.fetchone()
+    conn.commit()
+    return categories or [], product_ids or []
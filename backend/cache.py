@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import ThreadShards, metrics, sample
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+    Usage:
+        users = TTLCache(maxsize=1000, ttl=60)
+        users.set(1, {...})
+        users.get(1)
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# --- Product cache ---------------------------------------------------------
+
+PRODUCT_CACHE_BACKEND = os.getenv("PRODUCT_CACHE_BACKEND", "memory")   # memory | local | redis
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "5000"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "300"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class MemoryBackend:
+    """
+    In-process LRU + TTL backend. Counters (list generations, product versions)
+    live outside the LRU so they can never be evicted and roll back to an old
+    generation.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._cache.delete(key)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class LocalSharedBackend:
+    """
+    Local stand-in for a shared store such as Redis. Values go through JSON on
+    the way in and out, exactly like they would over the wire, so callers
+    never share mutable objects. Useful for tests and single-node setups.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}       # key -> (expires_at, json string)
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return None
+            return json.loads(entry[1])
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge:
+                # drop entries that expired without being read again, so the
+                # store only holds what was set in the last two TTLs
+                self._data = {k: entry for k, entry in self._data.items() if entry[0] >= now}
+                self._next_purge = now + self.ttl
+            self._data[key] = (now + self.ttl, json.dumps(value, default=str))
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """
+    Shared backend so every worker and node sees the same entries and
+    invalidations. Needs the optional ``redis`` package.
+    """
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.ttl = int(ttl)
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self._client.setex(key, self.ttl, json.dumps(value, default=str))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def get_counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+def make_backend(name, maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL):
+    if name == "memory":
+        return MemoryBackend(maxsize, ttl)
+    if name == "local":
+        return LocalSharedBackend(ttl)
+    if name == "redis":
+        return RedisBackend(REDIS_URL, ttl)
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+def make_expiring_backend(name, ttl):
+    """
+    Backend for entries that must stay until their TTL runs out, never evicted
+    to make room (e.g. token revocations). In process that is the TTL-only
+    LocalSharedBackend rather than the size-capped LRU.
+    """
+    return make_backend("local" if name == "memory" else name, ttl=ttl)
+
+
+COUNTS = ("product_hits", "product_misses", "list_hits", "list_misses", "invalidations")
+
+
+class ProductCache:
+    """
+    Read-through cache for single products and filtered product lists.
+
+    Every key embeds a counter: a list generation shared by all lists, and a
+    version per product. A write bumps the counters, which orphans the old
+    entries at once (they age out of the backend on their own).
+
+    Readers take the counter before loading from the database and store under
+    it. A write that lands during the load bumps it first, so the row read
+    before the write goes under a key no one looks up any more, instead of
+    replacing the invalidation:
+
+        version = product_cache.product_version(product_id)
+        entry = product_cache.get_product(product_id, version)
+        if entry is None:
+            entry = load(product_id)
+            product_cache.set_product(product_id, entry, version)
+    """
+
+    LIST_GENERATION_KEY = "products:list:generation"
+
+    def __init__(self, backend):
+        self.backend = backend
+        # per-thread, so a cache hit never waits on a lock
+        self._counts = ThreadShards()
+
+    def _count(self, name):
+        self._counts.add(name)
+
+    def list_generation(self):
+        return self.backend.get_counter(self.LIST_GENERATION_KEY)
+
+    def product_version(self, product_id):
+        return self.backend.get_counter(f"product:{product_id}:version")
+
+    def get_product(self, product_id, version):
+        value = self.backend.get(f"product:{product_id}:{version}")
+        self._count("product_hits" if value is not None else "product_misses")
+        return value
+
+    def set_product(self, product_id, entry, version):
+        self.backend.set(f"product:{product_id}:{version}", entry)
+
+    def get_list(self, kind, params, generation):
+        value = self.backend.get(self._list_key(kind, params, generation))
+        self._count("list_hits" if value is not None else "list_misses")
+        return value
+
+    def set_list(self, kind, params, entry, generation):
+        self.backend.set(self._list_key(kind, params, generation), entry)
+
+    def _list_key(self, kind, params, generation):
+        return f"products:{kind}:{generation}:{json.dumps(params, sort_keys=True)}"
+
+    def invalidate_products(self, *product_ids):
+        """
+        Call after a product changed or was deleted.
+        """
+        for product_id in product_ids:
+            self.backend.incr(f"product:{product_id}:version")
+        self.invalidate_lists()
+
+    def invalidate_lists(self):
+        """
+        Call after a change that can only affect lists, e.g. a new product.
+        """
+        self.backend.incr(self.LIST_GENERATION_KEY)
+        self._count("invalidations")
+
+    def stats(self):
+        counts = dict.fromkeys(COUNTS, 0)
+        counts.update(self._counts.totals())
+        for kind in ("product", "list"):
+            total = counts[f"{kind}_hits"] + counts[f"{kind}_misses"]
+            counts[f"{kind}_hit_ratio"] = round(counts[f"{kind}_hits"] / total, 4) if total else 0.0
+        counts["backend"] = type(self.backend).__name__
+        return counts
+
+
+product_cache = ProductCache(make_backend(PRODUCT_CACHE_BACKEND))
+
+metrics.describe("product_cache_hits_total", "counter", "Product cache hits.")
+metrics.describe("product_cache_misses_total", "counter", "Product cache misses.")
+metrics.describe("product_cache_invalidations_total", "counter", "Catalog writes that invalidated cached lists.")
+metrics.ratio("product_cache_hit_ratio", "Share of product cache lookups that hit.",
+              "product_cache_hits_total", "product_cache_misses_total")
+
+
+@metrics.collector
+def _cache_metrics():
+    counts = product_cache.stats()
+    samples = {sample("product_cache_invalidations_total"): counts["invalidations"]}
+    for kind in ("product", "list"):
+        samples[sample("product_cache_hits_total", {"kind": kind})] = counts[f"{kind}_hits"]
+        samples[sample("product_cache_misses_total", {"kind": kind})] = counts[f"{kind}_misses"]
+    return samples
@@ -0,0 +1,128 @@
+"""
+EXPLAIN check for the hot queries of routes/*.py: fails (exit 1) if any of
+them would read a table with a sequential scan.
+
+    python check_query_plans.py               # is there an index for every query?
+    python check_query_plans.py --as-planned  # what the planner picks on this data
+
+By default sequential scans are disabled for the session, so on a small dev
+or CI database the planner still shows whether a usable index exists at all
+(a Seq Scan then means there is none). --as-planned keeps the planner's own
+choice, which is meaningful against production-sized data.
+"""
+import json
+import os
+import sys
+from datetime import date
+import psycopg2
+from dotenv import load_dotenv
+
+from auth_middleware import USER_SQL
+from idempotency import STORED_RESPONSE_SQL, PURGE_EXPIRED_SQL
+from jobs import CLAIM_SQL, RECOVER_SQL
+from reservations import SWEEP_SQL
+from routes.analytics import SALES_DAILY_SQL, TOP_PRODUCTS_SQL, LOW_STOCK_SQL
+from routes.carts import CART_ID_SQL, CART_ITEMS_SQL
+from routes.orders import (USER_ORDERS_VALIDATOR_SQL, USER_ORDERS_SQL, ORDER_ITEMS_SQL, ORDER_ITEMS_VALIDATOR_SQL,
+                           LOCK_CHECKOUT_PRODUCTS_SQL, CHECKOUT_LINES_SQL, LOCK_CART_SQL, all_orders_query)
+from routes.products import (PRODUCT_FIELDS, DEFAULT_PAGE_SIZE, PRODUCT_SQL, CATALOG_VALIDATOR_SQL,
+                             list_products_json_query, search_products_query)
+from routes.users import USER_BY_EMAIL_SQL
+
+load_dotenv()
+
+_checkout = {"cart_id": 1, "user_id": 1, "reservation_id": None}
+_no_filters = {"status": None, "from": None, "to": None, "after": None}
+
+# (name, sql, params) - the same statements the handlers run
+HOT_QUERIES = [
+    ("product by id", PRODUCT_SQL, (1,)),
+    ("catalog validator", CATALOG_VALIDATOR_SQL, ()),
+    ("products by category", *list_products_json_query("books", None, PRODUCT_FIELDS, None, DEFAULT_PAGE_SIZE)),
+    ("products by category, next page", *list_products_json_query("books", None, PRODUCT_FIELDS, 1000, DEFAULT_PAGE_SIZE)),
+    ("product search", *search_products_query("blue widget", None, DEFAULT_PAGE_SIZE, 0)),
+    ("user by id", USER_SQL, {"user_id": 1}),
+    ("user by email (login)", USER_BY_EMAIL_SQL, {"email": "someone@example.com"}),
+    ("cart by user", CART_ID_SQL, {"user_id": 1}),
+    ("cart items", CART_ITEMS_SQL, (1,)),
+    ("user orders validator", USER_ORDERS_VALIDATOR_SQL, (1,)),
+    ("user orders", USER_ORDERS_SQL, (1,)),
+    ("order items", ORDER_ITEMS_SQL, (1,)),
+    ("order items validator", ORDER_ITEMS_VALIDATOR_SQL, (1,)),
+    ("checkout cart lock", LOCK_CART_SQL, _checkout),
+    ("checkout product locks", LOCK_CHECKOUT_PRODUCTS_SQL, _checkout),
+    ("checkout lines", CHECKOUT_LINES_SQL, _checkout),
+    ("checkout idempotent replay", STORED_RESPONSE_SQL, {"user_id": 1, "key": "k"}),
+    ("all orders page", *all_orders_query(_no_filters, 101)),
+    ("all orders, filtered", *all_orders_query(
+        dict(_no_filters, status="shipped", **{"from": "2024-01-01", "to": "2024-02-01"}), 101)),
+    ("reservation sweep", SWEEP_SQL, {"batch": 500}),
+    ("job claim", CLAIM_SQL, {"worker": "check", "kinds": None, "batch": 1}),
+    ("abandoned job recovery", RECOVER_SQL, {"timeout": 300}),
+    ("expired idempotency keys", PURGE_EXPIRED_SQL, {}),
+    ("analytics sales", SALES_DAILY_SQL, {"from": date(2024, 1, 1), "to": date(2024, 2, 1)}),
+    ("analytics top products", TOP_PRODUCTS_SQL, {"days": 30, "limit": 10}),
+    ("analytics low stock", LOW_STOCK_SQL, {"threshold": 5, "limit": 100}),
+]
+
+
+# Tables with a fixed handful of rows, read whole on purpose
+FIXED_SIZE_TABLES = {"catalog_version"}
+
+
+def seq_scans(plan):
+    """
+    Relations read by a Seq Scan anywhere in an EXPLAIN (FORMAT JSON) plan.
+    """
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan["Relation Name"] not in FIXED_SIZE_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def access_paths(plan):
+    paths = []
+    if "Relation Name" in plan:
+        index = f" using {plan['Index Name']}" if "Index Name" in plan else ""
+        paths.append(f"{plan['Node Type']} on {plan['Relation Name']}{index}")
+    for child in plan.get("Plans", []):
+        paths.extend(access_paths(child))
+    return paths
+
+
+def check(conn, as_planned=False):
+    failures = 0
+    with conn.cursor() as cur:
+        for name, sql, params in HOT_QUERIES:
+            if not as_planned:
+                cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]["Plan"]
+            conn.rollback()
+
+            scanned = seq_scans(plan)
+            if scanned:
+                failures += 1
+                print(f"FAIL {name}: sequential scan on {', '.join(sorted(set(scanned)))}")
+            else:
+                print(f"ok   {name}: {'; '.join(access_paths(plan)) or 'no table access'}")
+    return failures
+
+
+def main():
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        failures = check(conn, as_planned="--as-planned" in sys.argv[1:])
+    finally:
+        conn.close()
+    print(f"{len(HOT_QUERIES)} queries, {failures} with sequential scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Response compression.
+
+An after-request hook picks the best encoding the client accepts (zstd, br,
+gzip, in that order on equal q-values) and compresses text and JSON bodies
+of at least COMPRESSION_MIN_SIZE bytes. gzip is always available; br and
+zstd need the ``compression`` extra (brotli, zstandard).
+
+- Catalog responses (COMPRESSION_CACHE_BLUEPRINTS) that carry an ETag are
+  compressed once per version and encoding: the compressed bytes are kept,
+  at the higher COMPRESSION_CACHED_LEVELS, and later hits only copy them.
+- Streamed responses (order exports) are compressed chunk by chunk, each
+  chunk flushed so the client keeps receiving rows as they are read.
+
+ETags stay as they are: they are weak, so every encoding of a version
+matches the same validator and 304s keep working.
+"""
+import gzip
+import os
+import zlib
+from flask import request
+
+from cache import TTLCache
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION = os.getenv("COMPRESSION", "1") == "1"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))     # bytes; smaller bodies go as they are
+COMPRESSION_LEVELS = os.getenv("COMPRESSION_LEVELS", "zstd=3,br=4,gzip=6")
+COMPRESSION_CACHED_LEVELS = os.getenv("COMPRESSION_CACHED_LEVELS", "zstd=12,br=9,gzip=9")
+COMPRESSION_CACHE_BLUEPRINTS = os.getenv("COMPRESSION_CACHE_BLUEPRINTS", "products").split(",")
+COMPRESSION_CACHE_SIZE = int(os.getenv("COMPRESSION_CACHE_SIZE", "512"))  # compressed bodies kept
+COMPRESSION_CACHE_TTL = float(os.getenv("COMPRESSION_CACHE_TTL", "300"))
+
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+
+# --- codecs: one-shot compress(data, level) and stream(level) -> (compress, flush, finish) ---
+
+def _gzip_stream(level):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+def _br_compress(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _br_stream(level):
+    c = brotli.Compressor(quality=level)
+    return c.process, c.flush, c.finish
+
+
+def _zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_stream(level):
+    c = zstandard.ZstdCompressor(level=level).compressobj()
+    return (c.compress, lambda: c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            lambda: c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH))
+
+
+# in order of preference
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd_compress, _zstd_stream)
+if brotli is not None:
+    CODECS["br"] = (_br_compress, _br_stream)
+CODECS["gzip"] = (lambda data, level: gzip.compress(data, level, mtime=0), _gzip_stream)
+
+
+def parse_levels(raw):
+    """
+    "zstd=3,br=4,gzip=6" -> {"zstd": 3, "br": 4, "gzip": 6}
+    """
+    levels = {}
+    for part in raw.split(","):
+        name, _, level = part.partition("=")
+        if name.strip():
+            levels[name.strip()] = int(level)
+    return levels
+
+
+LEVELS = parse_levels(COMPRESSION_LEVELS)
+CACHED_LEVELS = parse_levels(COMPRESSION_CACHED_LEVELS)
+
+# (encoding, path, etag) -> compressed body
+compressed_cache = TTLCache(maxsize=COMPRESSION_CACHE_SIZE, ttl=COMPRESSION_CACHE_TTL)
+
+metrics.describe("http_compressed_responses_total", "counter", "Compressed responses, by encoding.")
+metrics.describe("http_compression_bytes_in_total", "counter", "Bytes before compression, by encoding.")
+metrics.describe("http_compression_bytes_out_total", "counter", "Bytes after compression, by encoding.")
+metrics.describe("http_compression_cache_hits_total", "counter", "Responses sent from compressed bytes kept earlier.")
+
+
+def negotiate(accept_encodings):
+    """
+    Best encoding of CODECS for an Accept-Encoding header (werkzeug's parsed
+    request.accept_encodings), or None to send the body as it is.
+    """
+    best, best_q = None, 0
+    for name in CODECS:
+        q = accept_encodings.quality(name)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _is_compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return False
+    if "no-transform" in response.headers.get("Cache-Control", ""):
+        return False
+    return response.mimetype in COMPRESSIBLE_TYPES
+
+
+def _count(encoding, size_in, size_out):
+    labels = {"encoding": encoding}
+    metrics.inc("http_compressed_responses_total", labels)
+    metrics.inc("http_compression_bytes_in_total", labels, size_in)
+    metrics.inc("http_compression_bytes_out_total", labels, size_out)
+
+
+def _cache_key(response, encoding):
+    """
+    Key for keeping the compressed body, or None when it is not worth it:
+    only catalog GETs whose ETag names the version of the body.
+    """
+    etag, _ = response.get_etag()
+    if etag is None or request.method != "GET" or response.status_code != 200:
+        return None
+    if request.blueprint not in COMPRESSION_CACHE_BLUEPRINTS:
+        return None
+    return encoding, request.full_path, etag
+
+
+def _compress_stream(chunks, encoding):
+    compress, flush, finish = CODECS[encoding][1](LEVELS.get(encoding, 6))
+    size_in = size_out = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            size_in += len(chunk)
+            data = compress(chunk) + flush()
+            size_out += len(data)
+            if data:
+                yield data
+        data = finish()
+        size_out += len(data)
+        yield data
+    finally:
+        _count(encoding, size_in, size_out)
+
+
+def compress_response(response):
+    if not _is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        close = getattr(response.response, "close", None)
+        if close is not None:
+            # the body is closed even if it never got to be sent
+            response.call_on_close(close)
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    key = _cache_key(response, encoding)
+    compressed = compressed_cache.get(key) if key is not None else None
+    if compressed is not None:
+        metrics.inc("http_compression_cache_hits_total")
+    else:
+        levels = CACHED_LEVELS if key is not None else LEVELS
+        compressed = CODECS[encoding][0](body, levels.get(encoding, 6))
+        if key is not None:
+            compressed_cache.set(key, compressed)
+    if len(compressed) >= len(body):
+        return response
+    _count(encoding, len(body), len(compressed))
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    Registers the hook. Call after the other init_app()s: after-request hooks
+    run last registered first, so Server-Timing's app time includes this.
+    """
+    if COMPRESSION:
+        app.after_request(compress_response)
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from flask import request, jsonify, current_app
+
+
+def make_etag(*parts):
+    """
+    Builds an opaque validator from cheap version data (ids, row versions,
+    counts, timestamps) instead of hashing the serialized response body.
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def to_timestamp(value):
+    """
+    TIMESTAMP columns are naive UTC; returns whole epoch seconds (or None).
+    """
+    if value is None:
+        return None
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+def has_conditional_headers():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def is_fresh(etag, last_modified=None):
+    """
+    True when the client's cached copy is still valid. If-None-Match wins over
+    If-Modified-Since, as required by RFC 9110.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= int(request.if_modified_since.timestamp())
+    return False
+
+
+def _set_validators(response, etag, last_modified, cache_control):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(last_modified, tz=timezone.utc)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def not_modified(etag, last_modified=None, cache_control="no-cache"):
+    response = current_app.response_class(status=304)
+    return _set_validators(response, etag, last_modified, cache_control)
+
+
+def conditional_json(payload, etag, last_modified=None, cache_control="no-cache"):
+    """
+    Returns 304 if the client already has this version, otherwise the JSON
+    payload with ETag / Last-Modified set. ``payload`` may be a callable so the
+    body is only built when it is actually sent.
+    """
+    if is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified, cache_control)
+    if callable(payload):
+        payload = payload()
+    return _set_validators(jsonify(payload), etag, last_modified, cache_control)
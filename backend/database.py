@@ -1,88 +1,678 @@
+import itertools
+import math
 import os
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from flask import g, has_app_context, has_request_context, request
+
+from cache import make_backend
+from instrumentation import QUERY_INSTRUMENTATION, InstrumentedConnection, record_acquire
+from metrics import metrics, sample
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def get_connection():
-    """
-    Returns a new database connection with dict-style cursor.
-    Usage:
-        conn = get_connection()
-        cur = conn.cursor()
-    """
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+# Pool tuning, all overridable from the environment
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))            # seconds to wait for a free connection
+DB_POOL_MAX_AGE = float(os.getenv("DB_POOL_MAX_AGE", "1800"))          # recycle connections older than this
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # ping connections idle longer than this
+
+# Read replicas (hot standbys of DATABASE_URL), comma-separated; none: every read goes to the primary
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_POOL_MAX_SIZE = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))   # per replica
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))               # seconds behind before reads go to the primary
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))  # seconds a replica's measured lag is trusted
+DB_REPLICA_TOKEN_BACKEND = os.getenv("DB_REPLICA_TOKEN_BACKEND", "memory")    # memory | local | redis, for write LSNs
+
+# Sent with the LSN of a committed write; a client that sends it back on a
+# read gets a replica that has replayed that write, or the primary
+LSN_HEADER = "X-DB-LSN"
+
+WAIT_HALF_LIFE = 1.0      # seconds for the recent pool wait to halve once waits stop
 
-def init_db():
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class PoolClosed(Exception):
+    """Raised when a connection is requested from a closed pool."""
+
+
+class ConnectionPool:
     """
-    Ensures required tables exist.
+    Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to ``max_size``. On checkout a connection
+    is recycled if it is older than ``max_age`` and pinged if it sat idle for
+    longer than ``health_check_after``; broken ones are replaced transparently.
+    With ``readonly``, every transaction on its connections is read-only.
     """
-    commands = [
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=10.0,
+                 max_age=1800.0, health_check_after=30.0, readonly=False):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.readonly = readonly
+
+        self._cond = threading.Condition()
+        self._idle = deque()      # (conn, last_used) - most recently used on the right
+        self._created = {}        # conn -> creation time, for every open connection
+        self._in_use = 0
+        self._waiting = 0
+        self._wait_started = {}   # waiting thread -> when it started waiting
+        self._closed = False
+        self.pid = os.getpid()
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_recent = 0.0   # decaying average of recent waits
+        self._wait_recent_at = time.monotonic()
+        self._recycled = 0
+        self._health_check_failures = 0
+
+        for _ in range(min_size):
+            conn = self._connect()
+            self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor,
+                                connection_factory=InstrumentedConnection if QUERY_INSTRUMENTATION else None)
+        if self.readonly:
+            conn.set_session(readonly=True)
+        self._created[conn] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _size(self):
+        return len(self._idle) + self._in_use
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._created.get(conn, 0) > self.max_age:
+            self._recycled += 1
+            return False
+        if time.monotonic() - last_used > self.health_check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                self._health_check_failures += 1
+                return False
+        return True
+
+    def getconn(self):
         """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            email VARCHAR(255) UNIQUE NOT NULL,
-            password_hash VARCHAR(255) NOT NULL,
-            username VARCHAR(100) UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
+        Checks out a connection, waiting up to ``timeout`` seconds for one to be
+        returned if the pool is exhausted.
         """
-        CREATE TABLE IF NOT EXISTS products (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            description TEXT,
-            price DECIMAL(10,2) NOT NULL,
-            stock NUMBER NOT NULL,
-            category VARCHAR(100),
-            image_url TEXT
-        )
-        """,
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = last_used = None
+
+        with self._cond:
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size() < self.max_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._waiting += 1
+                    self._wait_started.setdefault(threading.get_ident(), start)
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            finally:
+                self._wait_started.pop(threading.get_ident(), None)
+            self._in_use += 1
+
+        # validating or opening a connection does I/O, so it happens outside the lock
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._wait_recent = self._decayed_wait() * 0.8 + waited * 0.2
+            self._wait_recent_at = time.monotonic()
+        return conn
+
+    def _decayed_wait(self):
+        return self._wait_recent * 0.5 ** ((time.monotonic() - self._wait_recent_at) / WAIT_HALF_LIFE)
+
+    def wait_estimate(self):
         """
-            CREATE TABLE IF NOT EXISTS orders (
-            id SERIAL PRIMARY KEY,
-            user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            total_amount DECIMAL(10,2) NOT NULL DEFAULT 0.00,
-            status VARCHAR(20) NOT NULL DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW()
-        )
-        """,
+        Seconds a checkout can expect to wait right now: how long the longest
+        current waiter has been waiting, or the recent waits, whichever is
+        more.
         """
-            CREATE TABLE IF NOT EXISTS order_items (
-            id SERIAL PRIMARY KEY,
-            order_id INT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
-            product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
-            quantity INT NOT NULL CHECK (quantity > 0),
-            unit_price DECIMAL(10,2) NOT NULL,
-            subtotal DECIMAL(10,2) GENERATED ALWAYS AS (quantity * unit_price) STORED
-        )
+        with self._cond:
+            oldest = min(self._wait_started.values(), default=None)
+            current = time.monotonic() - oldest if oldest is not None else 0.0
+            return max(current, self._decayed_wait())
 
-        """,
+    def putconn(self, conn, discard=False):
         """
-        CREATE TABLE IF NOT EXISTS carts (
-        id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-        created_at TIMESTAMP DEFAULT NOW(),
-        updated_at TIMESTAMP DEFAULT NOW()
-         )
-        """,
+        Returns a connection to the pool. Any open transaction is rolled back;
+        connections that are broken, too old or explicitly discarded are closed.
         """
-        CREATE TABLE IF NOT EXISTS cart_items (
-            id SERIAL PRIMARY KEY,
-            cart_id INT NOT NULL REFERENCES carts(id) ON DELETE CASCADE,
-            product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
-            quantity INT NOT NULL CHECK (quantity > 0),
-            added_at TIMESTAMP DEFAULT NOW()
-        )
+        if not discard and not conn.closed:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            expired = time.monotonic() - self._created.get(conn, 0) > self.max_age
+            if discard or conn.closed or expired or self._closed:
+                if expired:
+                    self._recycled += 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            if self._closed:
+                self._cond.notify_all()   # wake close() waiting to drain
+            else:
+                self._cond.notify()
+
+    def close(self, drain_timeout=0.0):
         """
-        
-    ]
+        Refuses new checkouts and closes idle connections. With drain_timeout,
+        waits up to that many seconds for checked-out connections to come back
+        (they are closed as they are returned).
+        """
+        deadline = time.monotonic() + drain_timeout
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._discard(conn)
+            self._cond.notify_all()
+            while self._in_use and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "size": self._size(),
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+                "wait_time_recent_ms": round(self._decayed_wait() * 1000, 3),
+                "recycled": self._recycled,
+                "health_check_failures": self._health_check_failures,
+            }
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled psycopg2 connection. Everything is delegated to
+    the real connection except ``close()``, which hands it back to the pool
+    instead of tearing down the socket. Request-scoped connections are only
+    released by the teardown hook, so ``close()`` just ends the transaction.
+    """
+
+    def __init__(self, conn, pool, scoped=False):
+        self._conn = conn
+        self._pool = pool
+        self._scoped = scoped
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    @property
+    def closed(self):
+        return self._released or self._conn.closed
+
+    def commit(self):
+        self._conn.commit()
+        # the request wrote to the primary: stamp_request_write() records it
+        if self._scoped and self._conn is g.get("_db_conn"):
+            g._db_committed = True
+
+    def close(self):
+        if self._released:
+            return
+        if self._scoped:
+            # same semantics as a real close: uncommitted work is discarded
+            if not self._conn.closed and \
+                    self._conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                self._conn.rollback()
+            return
+        self._released = True
+        self._pool.putconn(self._conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    A pool inherited through fork() is abandoned, not closed: its sockets
+    still belong to the parent process.
+    """
+    global _pool
+    if _pool is not None and _pool.pid != os.getpid():
+        _pool = None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_age=DB_POOL_MAX_AGE,
+                    health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                )
+    return _pool
+
+
+def get_connection():
+    """
+    Returns a pooled database connection with dict-style cursor.
+    Inside a Flask request every call shares one connection, which is handed
+    back to the pool when the app context tears down.
+    Usage:
+        conn = get_connection()
+        cur = conn.cursor()
+        ...
+        conn.close()   # returns it to the pool
+    """
+    pool = get_pool()
+    if has_app_context():
+        if "_db_conn" not in g:
+            started = time.perf_counter()
+            g._db_conn = pool.getconn()
+            record_acquire((time.perf_counter() - started) * 1000)
+        return PooledConnection(g._db_conn, pool, scoped=True)
+    return PooledConnection(pool.getconn(), pool)
+
+
+# On a replica: how far it has replayed the primary's WAL, and how many
+# seconds that is behind (0 when it has replayed all it received). Pointed
+# at a primary, as in development, it reports the primary's own position.
+REPLICA_STATUS_SQL = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                ELSE pg_current_wal_lsn() END::text AS lsn,
+           CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS lag
+"""
+
+WRITE_LSN_SQL = "SELECT pg_current_wal_lsn()::text AS lsn"
+
+CATALOG_WRITE_KEY = "db_lsn:catalog"
+
+
+def parse_lsn(value):
+    """
+    "16/B374D848" -> a comparable int, None if ``value`` is not an LSN.
+    """
+    hi, sep, lo = (value or "").partition("/")
+    try:
+        return int(hi, 16) << 32 | int(lo, 16) if sep else None
+    except ValueError:
+        return None
+
+
+class Replica:
+    """
+    A read replica: its pool of read-only connections, and how far behind
+    the primary it was when last checked.
+    """
 
-    with get_connection() as conn:
+    def __init__(self, name, dsn):
+        self.name = name
+        self.pool = ConnectionPool(
+            dsn,
+            min_size=0,   # an unreachable replica must not stop the app starting
+            max_size=DB_REPLICA_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_age=DB_POOL_MAX_AGE,
+            health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+            readonly=True,
+        )
+        self.lsn = 0
+        self.lag = None
+        self.checked_at = float("-inf")
+        self.down_until = 0.0
+
+    def check(self, conn):
         with conn.cursor() as cur:
-            for command in commands:
-                cur.execute(command)
-        conn.commit()
+            cur.execute(REPLICA_STATUS_SQL)
+            row = cur.fetchone()
+        conn.rollback()
+        self.lsn = parse_lsn(row["lsn"]) or 0
+        self.lag = float(row["lag"]) if row["lag"] is not None else None
+        self.checked_at = time.monotonic()
+
+    def stats(self):
+        return dict(self.pool.stats(), name=self.name, lag_seconds=self.lag)
+
+
+_replicas = None
+_replica_turns = itertools.count()
+
+# LSNs of recent writes, by writer. Kept long enough for any replica within
+# DB_REPLICA_MAX_LAG to have replayed them; past that they are not needed.
+_write_lsns = make_backend(DB_REPLICA_TOKEN_BACKEND, maxsize=100000,
+                           ttl=math.ceil(DB_REPLICA_MAX_LAG + DB_REPLICA_CHECK_INTERVAL)) \
+    if DATABASE_REPLICA_URLS else None
+
+
+def get_replicas():
+    """
+    Returns the process-wide read replicas (empty without
+    DATABASE_REPLICA_URLS), creating them on first use. Like get_pool(),
+    replicas inherited through fork() are abandoned.
+    """
+    global _replicas
+    if not DATABASE_REPLICA_URLS:
+        return []
+    if _replicas is not None and _replicas[0].pool.pid != os.getpid():
+        _replicas = None
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(DATABASE_REPLICA_URLS)]
+    return _replicas
+
+
+def _writer_key(user_id):
+    return f"db_lsn:user:{user_id}" if user_id is not None else CATALOG_WRITE_KEY
+
+
+def _remember_lsn(key, lsn):
+    known = parse_lsn(_write_lsns.get(key))
+    if known is None or known < parse_lsn(lsn):
+        _write_lsns.set(key, lsn)
+
+
+def stamp_write(conn, user_id=None, catalog=False):
+    """
+    Call on a primary connection right after it committed: records the
+    primary's WAL position as the point a replica must have replayed to
+    serve ``user_id``'s own reads and, with ``catalog``, reads without a
+    user (the catalog). Returns the LSN, None without replicas.
+    """
+    if not DATABASE_REPLICA_URLS:
+        return None
+    with conn.cursor() as cur:
+        cur.execute(WRITE_LSN_SQL)
+        lsn = cur.fetchone()["lsn"]
+    conn.rollback()
+    if catalog:
+        _remember_lsn(CATALOG_WRITE_KEY, lsn)
+    if user_id is not None:
+        _remember_lsn(_writer_key(user_id), lsn)
+    return lsn
+
+
+def stamp_catalog_write(conn):
+    """
+    Call right after committing a change to products (stock included), and
+    before invalidating the product cache: catalog reads then wait for a
+    replica that has the change, so the cache is not refilled with the old
+    row. Other writes do not hold back catalog reads.
+    """
+    return stamp_write(conn, catalog=True)
+
+
+def required_lsn(user_id=None):
+    """
+    The WAL position a replica must have replayed to serve a read: the
+    last write of ``user_id`` (the last catalog write, without a user) and
+    the LSN the client sent back in LSN_HEADER, whichever is later. 0 if none.
+    """
+    tokens = [_write_lsns.get(_writer_key(user_id))]
+    if has_request_context():
+        tokens.append(request.headers.get(LSN_HEADER))
+    return max([lsn for lsn in map(parse_lsn, tokens) if lsn is not None], default=0)
+
+
+metrics.describe("db_reads_total", "counter", "Read-only handlers' connections, by server.")
+metrics.describe("db_replica_skipped_total", "counter", "Replicas passed over for a read, by reason.")
+metrics.describe("db_replica_lag_seconds", "gauge", "How far behind the primary each replica was when last checked.")
+
+
+def _skip(replica, reason):
+    metrics.inc("db_replica_skipped_total", {"replica": replica.name, "reason": reason})
+
+
+def _pick_replica(replicas, required):
+    """
+    (replica, connection) of the first replica, in turn, that is within
+    DB_REPLICA_MAX_LAG and has replayed ``required``; None if there is none.
+    A replica's lag is measured again once it is DB_REPLICA_CHECK_INTERVAL
+    old, or when it looks behind ``required``.
+    """
+    first = next(_replica_turns) % len(replicas)
+    for replica in replicas[first:] + replicas[:first]:
+        now = time.monotonic()
+        if replica.down_until > now:
+            _skip(replica, "unavailable")
+            continue
+        fresh = now - replica.checked_at <= DB_REPLICA_CHECK_INTERVAL
+        if fresh and (replica.lag is None or replica.lag > DB_REPLICA_MAX_LAG):
+            _skip(replica, "lag")
+            continue
+
+        try:
+            conn = replica.pool.getconn()
+        except (psycopg2.Error, PoolTimeout, PoolClosed):
+            replica.down_until = now + DB_REPLICA_CHECK_INTERVAL
+            _skip(replica, "unavailable")
+            continue
+        try:
+            if not fresh or replica.lsn < required:
+                replica.check(conn)
+        except psycopg2.Error:
+            replica.pool.putconn(conn, discard=True)
+            replica.down_until = now + DB_REPLICA_CHECK_INTERVAL
+            _skip(replica, "unavailable")
+            continue
+
+        if replica.lag is None or replica.lag > DB_REPLICA_MAX_LAG:
+            _skip(replica, "lag")
+        elif replica.lsn < required:
+            _skip(replica, "behind")
+        else:
+            return replica, conn
+        replica.pool.putconn(conn)
+    return None
+
+
+def get_read_connection(user_id=None):
+    """
+    get_connection() for handlers that only read. Returns a connection to a
+    read replica when one is within DB_REPLICA_MAX_LAG seconds of the
+    primary and has replayed the writes the read must see (required_lsn()),
+    otherwise the primary's. Pass the user whose own writes must show;
+    without one, the read waits for everyone's. Without replicas this is
+    get_connection().
+    """
+    replicas = get_replicas()
+    if not replicas:
+        return get_connection()
+    if has_app_context() and "_db_replica" in g:
+        replica, conn = g._db_replica
+        return PooledConnection(conn, replica.pool, scoped=True)
+
+    started = time.perf_counter()
+    picked = _pick_replica(replicas, required_lsn(user_id))
+    if picked is None:
+        metrics.inc("db_reads_total", {"server": "primary"})
+        return get_connection()
+    metrics.inc("db_reads_total", {"server": "replica"})
+
+    replica, conn = picked
+    if has_app_context():
+        record_acquire((time.perf_counter() - started) * 1000)
+        g._db_replica = picked
+        return PooledConnection(conn, replica.pool, scoped=True)
+    return PooledConnection(conn, replica.pool)
+
+
+def stamp_request_write(response):
+    """
+    After-request hook: when the request committed on the primary, records
+    the write for read-your-writes (stamp_write()) and tells the client its
+    LSN in LSN_HEADER.
+    """
+    if g.pop("_db_committed", False) and DATABASE_REPLICA_URLS and "_db_conn" in g:
+        claims = g.get("token_claims")
+        try:
+            lsn = stamp_write(g._db_conn, claims["user_id"] if claims else None)
+        except psycopg2.Error:
+            return response   # reads stay within DB_REPLICA_MAX_LAG regardless
+        response.headers[LSN_HEADER] = lsn
+    return response
+
+
+def release_request_connection(exc=None):
+    """
+    Teardown hook: returns the request-scoped connections to their pools.
+    """
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        get_pool().putconn(conn)
+    picked = g.pop("_db_replica", None)
+    if picked is not None:
+        replica, conn = picked
+        replica.pool.putconn(conn)
+
+
+def pool_stats():
+    """
+    Pool utilisation counters for monitoring.
+    """
+    stats = _pool.stats() if _pool is not None else {"size": 0, "in_use": 0, "idle": 0, "waiting": 0}
+    if _replicas:
+        stats["replicas"] = [replica.stats() for replica in _replicas]
+    return stats
+
+
+def pool_wait_estimate():
+    """
+    ConnectionPool.wait_estimate() of the process-wide pool, 0 before it exists.
+    """
+    return _pool.wait_estimate() if _pool is not None else 0.0
+
+
+metrics.describe("db_pool_connections", "gauge", "Pooled database connections by state.")
+metrics.describe("db_pool_max_size", "gauge", "Most connections the pool may open.")
+metrics.describe("db_pool_waiting", "gauge", "Requests waiting for a free connection.")
+metrics.describe("db_pool_checkouts_total", "counter", "Connections handed out.")
+metrics.describe("db_pool_timeouts_total", "counter", "Requests that gave up waiting for a connection.")
+metrics.describe("db_pool_wait_seconds_total", "counter", "Time spent waiting for connections.")
+metrics.describe("db_pool_recycled_total", "counter", "Connections closed for age.")
+
+
+@metrics.collector
+def _pool_metrics():
+    stats = pool_stats()
+    return {
+        sample("db_pool_connections", {"state": "in_use"}): stats["in_use"],
+        sample("db_pool_connections", {"state": "idle"}): stats["idle"],
+        sample("db_pool_max_size"): stats.get("max_size", DB_POOL_MAX_SIZE),
+        sample("db_pool_waiting"): stats["waiting"],
+        sample("db_pool_checkouts_total"): stats.get("checkouts", 0),
+        sample("db_pool_timeouts_total"): stats.get("timeouts", 0),
+        sample("db_pool_wait_seconds_total"): stats.get("wait_time_total_ms", 0.0) / 1000,
+        sample("db_pool_recycled_total"): stats.get("recycled", 0),
+    }
+
+
+@metrics.collector
+def _replica_metrics():
+    return {sample("db_replica_lag_seconds", {"replica": replica.name}): replica.lag
+            for replica in _replicas or [] if replica.lag is not None}
+
+
+def close_pool(drain_timeout=0.0):
+    """
+    Graceful shutdown: drains and closes the process-wide pool and the
+    replicas' pools.
+    """
+    global _pool, _replicas
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close(drain_timeout=drain_timeout)
+            _pool = None
+        for replica in _replicas or []:
+            replica.pool.close(drain_timeout=drain_timeout)
+        _replicas = None
+
+
+def init_app(app):
+    """
+    Registers the hooks that stamp writes for read-your-writes and release
+    request-scoped connections.
+    """
+    app.after_request(stamp_request_write)
+    app.teardown_appcontext(release_request_connection)
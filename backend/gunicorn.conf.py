@@ -0,0 +1,54 @@
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Threaded workers: psycopg2 releases the GIL while waiting on Postgres.
+# Keep workers * threads within what the database accepts, given
+# DB_POOL_MAX_SIZE connections per worker at most.
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Import the app once in the master and fork afterwards: workers share the
+# imported code pages and start serving immediately. Nothing at import time
+# touches the database, and the pool is created lazily in each worker.
+preload_app = True
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# recycle workers now and then to cap slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+accesslog = "-"
+
+
+def on_starting(server):
+    from auth_middleware import AUTH_CACHE_BACKEND
+    from cache import PRODUCT_CACHE_BACKEND
+    from metrics import clear_metrics_dir
+
+    clear_metrics_dir()
+    if workers > 1 and AUTH_CACHE_BACKEND == "memory":
+        server.log.warning("AUTH_CACHE_BACKEND=memory with %d workers: a logout only reaches "
+                           "the worker that handled it; use redis", workers)
+    if workers > 1 and PRODUCT_CACHE_BACKEND in ("memory", "local"):
+        server.log.warning("PRODUCT_CACHE_BACKEND=%s with %d workers: product changes only "
+                           "invalidate the worker that made them; use redis",
+                           PRODUCT_CACHE_BACKEND, workers)
+
+
+def post_fork(server, worker):
+    from app import start_background_tasks
+
+    start_background_tasks()
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+
+    shutdown(drain_timeout=graceful_timeout)
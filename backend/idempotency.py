@@ -0,0 +1,184 @@
+"""
+Idempotency-Key support for non-idempotent POSTs (checkout).
+
+A client that may retry sends a key of its choosing, unique per attempt to
+do something:
+
+    POST /orders/create
+    Idempotency-Key: 7c0a3a4e-checkout-1
+
+The key is claimed, per user, by inserting it in the transaction that does
+the work, and the response is stored on it before that transaction commits.
+So the order and its stored response exist together or not at all, and:
+
+- a retry after the commit gets the stored response again (same status and
+  body, plus ``Idempotent-Replayed: true``) without running the checkout;
+- a duplicate sent while the first is still running waits on the key's row
+  until the first commits, then gets its response, instead of racing it;
+  after IDEMPOTENCY_WAIT_TIMEOUT seconds it gets a 409 with Retry-After;
+- a request that is rejected (empty cart, stock) or fails rolls back and
+  leaves the key free, so the client can fix the cause and retry with it;
+- reusing a key for a different request body is a 422.
+
+Keys expire after IDEMPOTENCY_KEY_TTL seconds; an expired key counts as
+new. worker.py deletes expired keys.
+"""
+import hashlib
+import os
+from database import get_connection
+from json_provider import RawJSON
+from metrics import metrics
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))              # seconds a response is replayed
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "10"))    # seconds a duplicate waits for the first
+IDEMPOTENCY_RETRY_AFTER = 1                                                      # Retry-After (seconds) on a 409
+
+# SQL is kept in named-parameter form so the async API (aio/) can share it
+
+# Bounds the wait on a concurrent duplicate's uncommitted key; set back to
+# the default right after, so the checkout's own locks are not affected
+WAIT_TIMEOUT_SQL = "SELECT set_config('lock_timeout', %(timeout)s, true)"
+RESET_WAIT_TIMEOUT_SQL = "SET LOCAL lock_timeout = DEFAULT"
+
+# A row back means the key is ours; nothing back means it is taken (by a
+# committed request, or by one that committed while we waited on it)
+CLAIM_KEY_SQL = """
+    INSERT INTO idempotency_keys (user_id, key, request_hash, expires_at)
+    VALUES (%(user_id)s, %(key)s, %(request_hash)s, NOW() + make_interval(secs => %(ttl)s))
+    ON CONFLICT (user_id, key) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash, response_status = NULL, response_body = NULL,
+        created_at = NOW(), expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at < NOW()
+    RETURNING key
+"""
+
+STORED_RESPONSE_SQL = """
+    SELECT request_hash, response_status, response_body
+    FROM idempotency_keys
+    WHERE user_id = %(user_id)s AND key = %(key)s
+"""
+
+STORE_RESPONSE_SQL = """
+    UPDATE idempotency_keys
+    SET response_status = %(status)s, response_body = %(body)s
+    WHERE user_id = %(user_id)s AND key = %(key)s
+"""
+
+PURGE_EXPIRED_SQL = """
+    DELETE FROM idempotency_keys
+    WHERE (user_id, key) IN (
+        SELECT user_id, key FROM idempotency_keys
+        WHERE expires_at < NOW()
+        LIMIT 1000
+    )
+"""
+
+metrics.describe("idempotency_requests_total", "counter", "Requests with an Idempotency-Key, by outcome.")
+
+
+def count_outcome(outcome):
+    metrics.inc("idempotency_requests_total", {"outcome": outcome})
+
+
+def parse_key(value):
+    """
+    The Idempotency-Key header -> (key or None, error message or None).
+    """
+    if value is None:
+        return None, None
+    key = value.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH or not key.isprintable():
+        return None, f"Invalid {IDEMPOTENCY_HEADER}: 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} printable characters"
+    return key, None
+
+
+def request_hash(method, path, body):
+    """
+    Fingerprint of what a key was first used for, to refuse reusing it for
+    something else.
+    """
+    digest = hashlib.sha256(f"{method} {path}\n".encode("utf-8"))
+    digest.update(body or b"")
+    return digest.hexdigest()
+
+
+def claim_params(user_id, key, fingerprint):
+    return {"user_id": user_id, "key": key, "request_hash": fingerprint, "ttl": IDEMPOTENCY_KEY_TTL}
+
+
+def wait_timeout_params():
+    return {"timeout": f"{int(IDEMPOTENCY_WAIT_TIMEOUT * 1000)}ms"}
+
+
+def stored_outcome(row, fingerprint):
+    """
+    What to answer a request whose key was taken, given the key's row
+    (None if it vanished): ("replay", status, body), ("mismatch",) or
+    ("in_progress",).
+    """
+    if row is None or row["response_status"] is None:
+        return ("in_progress",)
+    if row["request_hash"] != fingerprint:
+        return ("mismatch",)
+    return ("replay", row["response_status"], row["response_body"])
+
+
+def outcome_response(outcome):
+    """
+    (body, status, headers) answering a request whose key was taken, for the
+    handler to return as ``jsonify(body), status, headers``. Replayed bodies
+    are RawJSON, so they go out byte for byte as first sent.
+    """
+    if outcome[0] == "replay":
+        count_outcome("replayed")
+        return RawJSON(outcome[2]), outcome[1], {"Idempotent-Replayed": "true"}
+    if outcome[0] == "mismatch":
+        count_outcome("mismatch")
+        return {"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}, 422, {}
+    count_outcome("in_progress")
+    return ({"error": "A request with this Idempotency-Key is still in progress"}, 409,
+            {"Retry-After": str(IDEMPOTENCY_RETRY_AFTER)})
+
+
+def claim_key(cur, user_id, key, fingerprint):
+    """
+    Claims the key in the cursor's transaction, waiting for a concurrent
+    request that holds it. Returns None when the key is ours to use,
+    otherwise stored_outcome() of the request that used it.
+    Past IDEMPOTENCY_WAIT_TIMEOUT the driver's lock-not-available error is
+    raised; answer it with outcome_response(("in_progress",)).
+    """
+    cur.execute(WAIT_TIMEOUT_SQL, wait_timeout_params())
+    cur.execute(CLAIM_KEY_SQL, claim_params(user_id, key, fingerprint))
+    claimed = cur.fetchone() is not None
+    cur.execute(RESET_WAIT_TIMEOUT_SQL)
+    if claimed:
+        return None
+    cur.execute(STORED_RESPONSE_SQL, {"user_id": user_id, "key": key})
+    return stored_outcome(cur.fetchone(), fingerprint)
+
+
+def store_response(cur, user_id, key, status, body):
+    """
+    Saves the response to replay for this key; call before committing.
+    ``body`` is the response text.
+    """
+    cur.execute(STORE_RESPONSE_SQL, {"user_id": user_id, "key": key, "status": status, "body": body})
+
+
+def purge_expired_keys():
+    """
+    Deletes up to 1000 expired keys. Returns how many.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(PURGE_EXPIRED_SQL)
+        deleted = cur.rowcount
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return deleted
@@ -0,0 +1,315 @@
+"""
+Per-request database instrumentation.
+
+Connections from the pool hand out cursors that report every statement to
+the current request: query count, time spent in the database, rows returned,
+plus the time the request waited for its pooled connection. At the end of
+the request these go out as a ``Server-Timing`` header, e.g.
+
+    Server-Timing: db;dur=3.21;desc="4 queries, 12 rows", db-pool;dur=0.05, app;dur=7.80
+
+and, with QUERY_LOG=all, as one JSON log line. Statements are grouped by
+fingerprint (the SQL with literals and parameters replaced by ``?``) to spot
+slow queries and N+1 patterns, the same fingerprint run over and over in one
+request. Both are logged and aggregated for GET /stats/queries.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from flask import g, has_app_context, has_request_context, request
+from psycopg2 import extensions
+
+QUERY_INSTRUMENTATION = os.getenv("QUERY_INSTRUMENTATION", "1") == "1"
+QUERY_LOG = os.getenv("QUERY_LOG", "slow")                             # off | slow | all
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))     # fingerprints kept for /stats/queries
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))     # same fingerprint this often in one request
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+logger = logging.getLogger("queries")
+
+_FINGERPRINT_RULES = [
+    (re.compile(r"--[^\n]*|/\*.*?\*/", re.S), " "),          # comments
+    (re.compile(r"'(?:[^']|'')*'"), "?"),                      # string literals
+    (re.compile(r"%\(\w+\)s|%s|\$\d+"), "?"),                  # parameters
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),                   # numbers
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?+)"),      # IN lists of any length
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """
+    Normalised SQL: the same statement with other values gives the same
+    fingerprint, e.g. "SELECT * FROM users WHERE id = ?".
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    for pattern, replacement in _FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestStats:
+    """Database work of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.rows = 0
+        self.acquire_ms = 0.0
+        self.status = None
+        self.fingerprints = {}   # fingerprint -> times run
+
+    def add(self, fp, ms, rows, counted=True):
+        if counted:
+            self.queries += 1
+            self.fingerprints[fp] = self.fingerprints.get(fp, 0) + 1
+        self.db_ms += ms
+        self.rows += rows
+
+    def repeated(self, threshold):
+        return {fp: n for fp, n in self.fingerprints.items() if n >= threshold}
+
+
+class QueryLog:
+    """
+    Process-wide aggregates per fingerprint, for slow queries and N+1
+    patterns. Holds at most ``maxsize`` fingerprints of each, evicting the
+    least recently seen.
+    """
+
+    def __init__(self, maxsize=200):
+        self.maxsize = maxsize
+        self._slow = OrderedDict()
+        self._repeated = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, entries, fp, **initial):
+        entry = entries.get(fp)
+        if entry is None:
+            entry = entries[fp] = dict(fingerprint=fp, **initial)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        entries.move_to_end(fp)
+        return entry
+
+    def slow(self, fp, ms, path):
+        with self._lock:
+            entry = self._entry(self._slow, fp, count=0, total_ms=0.0, max_ms=0.0)
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["last_path"] = path
+
+    def repeated(self, fp, times, path):
+        with self._lock:
+            entry = self._entry(self._repeated, fp, requests=0, max_per_request=0)
+            entry["requests"] += 1
+            entry["max_per_request"] = max(entry["max_per_request"], times)
+            entry["last_path"] = path
+
+    def stats(self):
+        with self._lock:
+            slow = sorted((dict(e, total_ms=round(e["total_ms"], 3), max_ms=round(e["max_ms"], 3))
+                           for e in self._slow.values()), key=lambda e: e["total_ms"], reverse=True)
+            repeated = sorted((dict(e) for e in self._repeated.values()),
+                              key=lambda e: e["requests"], reverse=True)
+        return {
+            "slow_query_ms": SLOW_QUERY_MS,
+            "n_plus_one_threshold": N_PLUS_ONE_THRESHOLD,
+            "slow_queries": slow,
+            "n_plus_one": repeated,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._slow.clear()
+            self._repeated.clear()
+
+
+query_log = QueryLog(maxsize=SLOW_QUERY_LOG_SIZE)
+
+
+def current_stats():
+    """
+    Stats of the request (app context) in progress, None outside of one.
+    """
+    if not has_app_context():
+        return None
+    stats = g.get("_query_stats")
+    if stats is None:
+        stats = g._query_stats = RequestStats()
+    return stats
+
+
+def _path():
+    return request.path if has_request_context() else None
+
+
+def _log(event, **fields):
+    logger.warning(json.dumps(dict(event=event, **fields)))
+
+
+def record_query(query, started, rows, counted=True):
+    ms = (time.perf_counter() - started) * 1000
+    fp = fingerprint(query)
+    stats = current_stats()
+    if stats is not None:
+        stats.add(fp, ms, rows, counted)
+    if ms >= SLOW_QUERY_MS:
+        path = _path()
+        query_log.slow(fp, ms, path)
+        if QUERY_LOG != "off":
+            _log("slow_query", fingerprint=fp, ms=round(ms, 2), rows=rows, path=path)
+
+
+def record_acquire(ms):
+    stats = current_stats()
+    if stats is not None:
+        stats.acquire_ms += ms
+
+
+# --- cursors ---
+
+class InstrumentedCursorMixin:
+    """
+    Times execute()/executemany(). For named (server-side) cursors, whose rows
+    arrive with each fetch, the fetches add time and rows to the same query.
+    """
+
+    def execute(self, query, vars=None):
+        self._statement = query
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, started, self._rows_returned())
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, started, 0)
+
+    def fetchmany(self, size=None):
+        if self.name is None:
+            return super().fetchmany() if size is None else super().fetchmany(size)
+        started = time.perf_counter()
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        record_query(self._statement, started, len(rows), counted=False)
+        return rows
+
+    def fetchall(self):
+        if self.name is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        record_query(self._statement, started, len(rows), counted=False)
+        return rows
+
+    def _rows_returned(self):
+        if self.name is not None or self.description is None:
+            return 0
+        return max(self.rowcount, 0)
+
+
+_cursor_classes = {}
+
+
+def instrumented(cursor_class):
+    """
+    Instrumented subclass of a psycopg2 cursor class (cached).
+    """
+    cls = _cursor_classes.get(cursor_class)
+    if cls is None:
+        cls = _cursor_classes[cursor_class] = type(
+            f"Instrumented{cursor_class.__name__}", (InstrumentedCursorMixin, cursor_class), {})
+    return cls
+
+
+class InstrumentedConnection(extensions.connection):
+    """
+    psycopg2 connection whose cursors, whatever their cursor_factory, are
+    instrumented. Pass as ``connection_factory`` to psycopg2.connect().
+    """
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = instrumented(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# --- Flask hooks ---
+
+def server_timing(stats, app_ms):
+    return (f'db;dur={stats.db_ms:.2f};desc="{stats.queries} queries, {stats.rows} rows", '
+            f'db-pool;dur={stats.acquire_ms:.2f}, app;dur={app_ms:.2f}')
+
+
+def _start_request():
+    g._query_stats = RequestStats()
+
+
+def _finish_response(response):
+    stats = current_stats()
+    stats.status = response.status_code
+    if SERVER_TIMING:
+        app_ms = (time.perf_counter() - stats.started) * 1000
+        response.headers["Server-Timing"] = server_timing(stats, app_ms)
+    return response
+
+
+def _log_request(exc=None):
+    # runs once a streamed body has been sent too, so its queries count
+    stats = g.pop("_query_stats", None)
+    if stats is None:
+        return
+    path = _path()
+    repeated = stats.repeated(N_PLUS_ONE_THRESHOLD)
+    for fp, times in repeated.items():
+        query_log.repeated(fp, times, path)
+        if QUERY_LOG != "off":
+            _log("n_plus_one", fingerprint=fp, times=times, method=request.method, path=path)
+    if QUERY_LOG == "all":
+        logger.info(json.dumps({
+            "event": "request",
+            "method": request.method,
+            "path": path,
+            "status": stats.status,
+            "ms": round((time.perf_counter() - stats.started) * 1000, 2),
+            "queries": stats.queries,
+            "db_ms": round(stats.db_ms, 2),
+            "rows": stats.rows,
+            "db_pool_ms": round(stats.acquire_ms, 2),
+            "n_plus_one": sorted(repeated),
+        }))
+
+
+def init_app(app):
+    """
+    Registers the request hooks, and a stderr handler for the "queries"
+    logger unless logging was configured for it already.
+    """
+    if not QUERY_INSTRUMENTATION:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_response)
+    app.teardown_request(_log_request)
+
+    if QUERY_LOG != "off" and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO if QUERY_LOG == "all" else logging.WARNING)
+        logger.propagate = False
@@ -0,0 +1,286 @@
+"""
+Background jobs, queued in Postgres and run by worker.py.
+
+Route handlers enqueue work on their own cursor, so a job is queued if and
+only if the request's transaction commits:
+
+    enqueue(cur, "order_created", {"order_id": order["id"]}, key=f"order_created:{order['id']}")
+    conn.commit()
+
+Jobs with an idempotency key are queued once per key; enqueuing the same key
+again returns None and changes nothing. Workers claim due jobs with
+``FOR UPDATE SKIP LOCKED``, so any number of them can poll the table without
+blocking each other or taking the same job. A handler runs in the same
+transaction that marks its job done, so its database writes and the job's
+completion commit together. A failed job is retried with exponential backoff
+and jitter up to its max_attempts, then left as "failed". A job whose worker
+died while running it is queued again after JOB_LOCK_TIMEOUT seconds, so
+handlers must tolerate running more than once for the same job; the key
+(job["idempotency_key"]) is there to dedupe outside effects.
+
+Handlers are registered per kind:
+
+    @job("order_created")
+    def order_created(cur, payload, job):
+        ...
+"""
+import json
+import logging
+import os
+import random
+import time
+import traceback
+from database import get_connection
+from metrics import metrics
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "5"))        # seconds before the first retry, doubled after each
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "900"))        # longest wait between attempts
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", "300"))    # seconds before a running job counts as abandoned
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))  # finished jobs (and their keys) kept this long
+
+# enqueue notifies this channel (see ENQUEUE_SQL); listening workers check
+# the table at once instead of at their next poll
+NOTIFY_CHANNEL = "jobs"
+
+logger = logging.getLogger("jobs")
+
+# SQL is kept in named-parameter form so the async API (aio/) can share it.
+# The payload is passed as JSON text, which both drivers send as is.
+
+ENQUEUE_SQL = """
+    WITH queued AS (
+        INSERT INTO jobs (kind, payload, idempotency_key, max_attempts, run_at)
+        VALUES (%(kind)s, %(payload)s::text::jsonb, %(key)s, %(max_attempts)s,
+                NOW() + make_interval(secs => %(delay)s))
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+    )
+    SELECT id, pg_notify('jobs', %(kind)s)::text AS notified FROM queued
+"""
+
+CLAIM_SQL = """
+    UPDATE jobs
+    SET status = 'running', attempts = attempts + 1,
+        locked_at = NOW(), locked_by = %(worker)s, updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND run_at <= NOW()
+          AND (%(kinds)s::text[] IS NULL OR kind = ANY(%(kinds)s::text[]))
+        ORDER BY run_at
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, idempotency_key, attempts, max_attempts
+"""
+
+COMPLETE_SQL = """
+    UPDATE jobs
+    SET status = 'done', locked_at = NULL, locked_by = NULL, last_error = NULL, updated_at = NOW()
+    WHERE id = %(id)s AND locked_by = %(worker)s
+"""
+
+# back in the queue after ``delay`` seconds, or failed for good
+FAIL_SQL = """
+    UPDATE jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        run_at = NOW() + make_interval(secs => %(delay)s),
+        locked_at = NULL, locked_by = NULL, last_error = %(error)s, updated_at = NOW()
+    WHERE id = %(id)s AND locked_by = %(worker)s
+    RETURNING status
+"""
+
+# jobs of workers that died mid-run; an abandoned last attempt counts as failed
+RECOVER_SQL = """
+    UPDATE jobs
+    SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        run_at = NOW(), locked_at = NULL, locked_by = NULL,
+        last_error = 'abandoned by ' || COALESCE(locked_by, 'unknown worker'), updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM jobs
+        WHERE status = 'running' AND locked_at < NOW() - make_interval(secs => %(timeout)s)
+        FOR UPDATE SKIP LOCKED
+    )
+"""
+
+PRUNE_SQL = """
+    DELETE FROM jobs
+    WHERE id IN (
+        SELECT id FROM jobs
+        WHERE status IN ('done', 'failed') AND updated_at < NOW() - make_interval(days => %(days)s)
+        LIMIT 1000
+    )
+"""
+
+STATS_SQL = """
+    SELECT kind, status, count(*) AS n, min(run_at) AS oldest_run_at
+    FROM jobs
+    WHERE status IN ('queued', 'running', 'failed')
+    GROUP BY kind, status
+    ORDER BY kind, status
+"""
+
+metrics.describe("jobs_enqueued_total", "counter", "Jobs queued, by kind (duplicate keys not counted).")
+metrics.describe("jobs_processed_total", "counter", "Job attempts finished, by kind and outcome.")
+metrics.describe("job_duration_seconds_total", "counter", "Time spent running jobs, by kind.")
+
+HANDLERS = {}
+
+
+def job(kind):
+    """
+    Registers the decorated function as the handler of ``kind``. It is called
+    as handler(cur, payload, job) inside the transaction that completes the job.
+    """
+    def register(handler):
+        if kind in HANDLERS:
+            raise ValueError(f"Job kind {kind!r} already has a handler")
+        HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+def enqueue_params(kind, payload=None, key=None, delay=0, max_attempts=None):
+    return {
+        "kind": kind,
+        "payload": json.dumps(payload or {}),
+        "key": key,
+        "delay": float(delay),
+        "max_attempts": max_attempts or JOB_MAX_ATTEMPTS,
+    }
+
+
+def enqueue(cur, kind, payload=None, key=None, delay=0, max_attempts=None):
+    """
+    Queues a job in the cursor's transaction; it runs once that commits.
+    ``payload`` must be JSON serialisable. ``delay`` postpones the first run
+    by that many seconds.
+    Returns the job id, or None when a job with the same key already exists.
+    """
+    cur.execute(ENQUEUE_SQL, enqueue_params(kind, payload, key, delay, max_attempts))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    metrics.inc("jobs_enqueued_total", {"kind": kind})
+    return row["id"]
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before attempt ``attempts + 1``: exponential, capped at
+    JOB_RETRY_MAX, and jittered over its upper half so jobs that failed
+    together do not retry in lockstep.
+    """
+    ceiling = min(JOB_RETRY_MAX, JOB_RETRY_BASE * 2 ** (attempts - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def _execute(sql, params, fetch=False):
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        rows = cur.fetchall() if fetch else cur.rowcount
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def claim(worker, kinds=None, batch=1):
+    """
+    Marks up to ``batch`` due jobs as running by ``worker`` and returns them.
+    Jobs other workers are claiming at the same moment are skipped, not waited for.
+    """
+    return _execute(CLAIM_SQL, {"worker": worker, "kinds": kinds, "batch": batch}, fetch=True)
+
+
+def run(job_row, worker):
+    """
+    Runs one claimed job. Returns its new status: "done", "queued" (to be
+    retried) or "failed".
+    """
+    kind = job_row["kind"]
+    handler = HANDLERS.get(kind)
+    conn = get_connection()
+    cur = conn.cursor()
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {kind!r}")
+        handler(cur, job_row["payload"], job_row)
+        cur.execute(COMPLETE_SQL, {"id": job_row["id"], "worker": worker})
+        conn.commit()
+        status = "done"
+    except Exception as e:
+        conn.rollback()
+        delay = retry_delay(job_row["attempts"])
+        cur.execute(FAIL_SQL, {"id": job_row["id"], "worker": worker, "delay": delay,
+                               "error": traceback.format_exc(limit=5)})
+        row = cur.fetchone()
+        conn.commit()
+        status = row["status"] if row else "lost"
+        logger.warning(json.dumps({
+            "event": "job_failed", "id": job_row["id"], "kind": kind, "attempt": job_row["attempts"],
+            "status": status, "retry_in": round(delay, 1) if status == "queued" else None, "error": str(e),
+        }))
+    finally:
+        cur.close()
+        conn.close()
+    metrics.inc("jobs_processed_total", {"kind": kind, "outcome": status})
+    metrics.inc("job_duration_seconds_total", {"kind": kind}, time.perf_counter() - started)
+    return status
+
+
+def recover_abandoned(timeout=JOB_LOCK_TIMEOUT):
+    """
+    Queues again the jobs left running for longer than ``timeout`` seconds.
+    Returns how many there were.
+    """
+    return _execute(RECOVER_SQL, {"timeout": timeout})
+
+
+def prune_finished(days=JOB_RETENTION_DAYS):
+    """
+    Deletes up to 1000 jobs finished more than ``days`` ago. Returns how many.
+    """
+    return _execute(PRUNE_SQL, {"days": days})
+
+
+def queue_stats():
+    """
+    Jobs waiting, running and failed, by kind.
+    """
+    rows = _execute(STATS_SQL, {}, fetch=True)
+    return {"jobs": rows}
+
+
+# --- handlers ---
+
+ORDER_SUMMARY_SQL = """
+    SELECT o.id, o.user_id, u.email, o.total_amount, o.status,
+           (SELECT count(*) FROM order_items oi WHERE oi.order_id = o.id) AS items
+    FROM orders o
+    JOIN users u ON u.id = o.user_id
+    WHERE o.id = %(order_id)s
+"""
+
+
+@job("order_created")
+def order_created(cur, payload, job_row):
+    """
+    Post-checkout work for a new order, off the request path. For now the
+    order confirmation is logged; mail, stock sync and the like go here.
+    """
+    cur.execute(ORDER_SUMMARY_SQL, payload)
+    order = cur.fetchone()
+    if order is None:
+        return   # deleted since; nothing to confirm
+    logger.info(json.dumps({
+        "event": "order_confirmation", "order_id": order["id"], "user_id": order["user_id"],
+        "email": order["email"], "items": order["items"], "total_amount": str(order["total_amount"]),
+    }))
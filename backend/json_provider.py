@@ -0,0 +1,97 @@
+"""
+JSON encoding of API responses.
+
+FastJSONProvider writes what Flask's default provider writes: keys sorted,
+Decimal and UUID as strings, datetime and date as HTTP dates, dataclasses as
+objects. With orjson installed (the ``fast-json`` extra) the encoding runs in
+C, rows from RealDictCursor included, so handlers can return database rows
+without converting them first; without it the stdlib encoder is used.
+JSON_PROVIDER=std forces the stdlib one.
+
+Bodies Postgres already built (json_agg / json_build_object) are wrapped in
+RawJSON and go out as they are, without being parsed or encoded again:
+
+    return jsonify(RawJSON(cur.fetchone()["body"]))
+"""
+import os
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto")      # auto | orjson | std
+
+orjson = None
+if JSON_PROVIDER != "std":
+    try:
+        import orjson
+    except ImportError:
+        if JSON_PROVIDER == "orjson":
+            raise
+
+
+_DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+class RawJSON(str):
+    """JSON text sent as the response body as it is."""
+
+
+def http_date(value):
+    """
+    werkzeug.http.http_date() of a datetime (naive is UTC) or date, without
+    the detour through email.utils, which dominates encoding rows with
+    timestamps.
+    """
+    if not isinstance(value, datetime):
+        return f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} 00:00:00 GMT"
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+def _default(o):
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, date):
+        return http_date(o)
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    DefaultJSONProvider on orjson. Calls with extra json.dumps() arguments
+    (cls, indent, ...) are passed on to the stdlib encoder unchanged.
+    """
+
+    default = staticmethod(_default)
+
+    def _option(self):
+        # datetimes go to default() so they come out as HTTP dates, like Flask's
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._option()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if isinstance(obj, RawJSON):
+            return self._app.response_class(obj, mimetype=self.mimetype)
+        if orjson is None:
+            return super().response(obj)
+        option = self._option() | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option),
+                                        mimetype=self.mimetype)
@@ -0,0 +1,409 @@
+"""
+Prometheus metrics, served as text at GET /metrics.
+
+Recording is lock-free: every thread adds to its own shard (a plain dict),
+and a scrape sums the shards. A thread's shard is folded into the process
+totals when the thread exits, so servers that start a thread per connection
+keep a bounded set. Values only ever go up (gauges like in-flight requests
+are +1/-1 pairs), so shards, processes and exited threads merge by adding.
+
+With several server processes (gunicorn workers) set METRICS_DIR to a
+directory shared by them: each worker writes its totals there every
+METRICS_FLUSH_INTERVAL seconds and a scrape, whichever worker answers it,
+adds up all of them. Gauges of workers that are gone are left out; their
+counters stay, so totals never go backwards.
+
+Scrapes must send METRICS_TOKEN as a bearer token; without it set, GET
+/metrics is refused.
+"""
+import bisect
+import fcntl
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import traceback
+import weakref
+from contextlib import contextmanager
+from flask import Response, g, jsonify, request
+
+METRICS_DIR = os.getenv("METRICS_DIR")                                  # unset: this process only
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")                              # bearer token scrapers send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Holder:
+    """Lives in the thread's local storage; its finalizer retires the shard."""
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class ThreadShards:
+    """
+    Additive counters kept per thread. add() touches only the calling
+    thread's dict, so it never waits on another thread; totals() copies each
+    dict, which CPython does atomically under the GIL.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = {}      # id(shard) -> shard
+        self._retired = {}
+
+    def _shard(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            shard = {}
+            holder = self._local.holder = _Holder(shard)
+            with self._lock:
+                self._live[id(shard)] = shard
+            weakref.finalize(holder, self._retire, shard)
+        return holder.shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._live.pop(id(shard), None)
+            for key, value in shard.items():
+                self._retired[key] = self._retired.get(key, 0) + value
+
+    def add(self, key, value=1):
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + value
+
+    def totals(self):
+        with self._lock:
+            shards = [dict(shard) for shard in self._live.values()]
+            totals = dict(self._retired)
+        for shard in shards:
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def sample(name, labels=None):
+    """
+    Key of a counter or gauge value, for collectors.
+    """
+    return (name, _labels(labels), None)
+
+
+class Metrics:
+    """
+    Registry of metric families. Samples are keyed by
+    (name, labels, part): part is None for counters and gauges, the bucket
+    index or "sum" for histograms.
+    """
+
+    def __init__(self):
+        self.families = {}      # name -> (type, help, buckets)
+        self.samples = ThreadShards()
+        self._collectors = []
+        self._ratios = []
+
+    def describe(self, name, kind, help, buckets=None):
+        self.families[name] = (kind, help, buckets)
+
+    def collector(self, fn):
+        """
+        Registers fn() -> {sample(name, labels): value} for values read at
+        scrape time (pool, cache, password hashing). Used as a decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def ratio(self, name, help, numerator, denominator):
+        """
+        Gauge computed at render time as numerator / (numerator + denominator),
+        per label set, after every process has been added up.
+        """
+        self.describe(name, "gauge", help)
+        self._ratios.append((name, numerator, denominator))
+
+    # --- hot path ---
+
+    def inc(self, name, labels=None, value=1):
+        self.samples.add((name, _labels(labels), None), value)
+
+    def observe(self, name, value, labels=None):
+        key = _labels(labels)
+        buckets = self.families[name][2]
+        self.samples.add((name, key, bisect.bisect_left(buckets, value)))
+        self.samples.add((name, key, "sum"), value)
+
+    # --- scrape ---
+
+    def collect(self):
+        """
+        This process: recorded samples plus the collectors' current values.
+        """
+        totals = self.samples.totals()
+        for fn in self._collectors:
+            try:
+                totals.update(fn())
+            except Exception:
+                traceback.print_exc()
+        return totals
+
+    def render(self, totals):
+        by_name = {}
+        for (name, labels, part), value in totals.items():
+            by_name.setdefault(name, {}).setdefault(labels, {})[part] = value
+        for name, numerator, denominator in self._ratios:
+            hits, misses = by_name.get(numerator, {}), by_name.get(denominator, {})
+            for labels in set(hits) | set(misses):
+                h, m = hits.get(labels, {}).get(None, 0), misses.get(labels, {}).get(None, 0)
+                by_name.setdefault(name, {})[labels] = {None: h / (h + m) if h + m else 0.0}
+
+        lines = []
+        for name in sorted(by_name):
+            if name not in self.families:
+                continue
+            kind, help, buckets = self.families[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, parts in sorted(by_name[name].items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(parts.get(None, 0))}")
+                    continue
+                cumulative = 0
+                for i, bound in enumerate(buckets):
+                    cumulative += parts.get(i, 0)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                cumulative += parts.get(len(buckets), 0)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(parts.get('sum', 0))}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+# --- several processes ---
+
+RETIRED_FILE = "retired.json"   # counters of workers that have exited
+
+
+def _path(pid):
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _dir_lock(exclusive):
+    # scrapes share it; folding an exited worker into RETIRED_FILE takes it
+    # alone, so no scrape counts that worker twice or not at all
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    data["samples"] = {(name, tuple(tuple(pair) for pair in labels), part): value
+                       for name, labels, part, value in data["samples"]}
+    return data
+
+
+def _serialise(totals):
+    return [[name, [list(pair) for pair in labels], part, value]
+            for (name, labels, part), value in totals.items()]
+
+
+def _is_gauge(key):
+    return metrics.families.get(key[0], ("gauge",))[0] == "gauge"
+
+
+def _add(totals, samples, gauges=True):
+    for key, value in samples.items():
+        if gauges or not _is_gauge(key):
+            totals[key] = totals.get(key, 0) + value
+
+
+def flush():
+    """
+    Writes this process's totals to METRICS_DIR, then folds the files of
+    workers that have exited into RETIRED_FILE.
+    """
+    if not METRICS_DIR:
+        return
+    _write(_path(os.getpid()), {"pid": os.getpid(), "written_at": time.time(),
+                                "samples": _serialise(metrics.collect())})
+    dead = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+        data = _read(path)
+        if data is not None and not _is_alive(data["pid"]):
+            dead.append(path)
+    if not dead:
+        return
+    with _dir_lock(exclusive=True):
+        retired = _read(os.path.join(METRICS_DIR, RETIRED_FILE)) or {"samples": {}}
+        folded = []
+        for path in dead:
+            data = _read(path)   # None: another worker folded it first
+            if data is not None:
+                _add(retired["samples"], data["samples"], gauges=False)
+                folded.append(path)
+        if folded:
+            _write(os.path.join(METRICS_DIR, RETIRED_FILE), {"samples": _serialise(retired["samples"])})
+            for path in folded:
+                os.remove(path)
+
+
+def gather():
+    """
+    Totals of every process sharing METRICS_DIR (or just this one).
+    """
+    totals = metrics.collect()
+    if not METRICS_DIR:
+        return totals
+    with _dir_lock(exclusive=False):
+        retired = _read(os.path.join(METRICS_DIR, RETIRED_FILE))
+        if retired is not None:
+            _add(totals, retired["samples"])
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            data = _read(path)
+            if data is None or data["pid"] == os.getpid():
+                continue   # None: being replaced right now
+            _add(totals, data["samples"], gauges=_is_alive(data["pid"]))
+    return totals
+
+
+def clear_metrics_dir():
+    """
+    Forgets previous processes; call once when the server (re)starts.
+    """
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for name in os.listdir(METRICS_DIR):
+            if name.startswith("metrics-") or name.startswith(RETIRED_FILE):
+                os.remove(os.path.join(METRICS_DIR, name))
+
+
+def start_metrics_flusher(interval=METRICS_FLUSH_INTERVAL):
+    """
+    Flushes every ``interval`` seconds on a daemon thread. Returns the stop
+    event, or None without METRICS_DIR.
+    """
+    if not METRICS_DIR or interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                flush()
+            except Exception:
+                traceback.print_exc()
+
+    threading.Thread(target=run, name="metrics-flusher", daemon=True).start()
+    return stop
+
+
+# --- HTTP ---
+
+metrics.describe("http_request_duration_seconds", "histogram",
+                 "Request latency by route and status, streamed bodies included.", LATENCY_BUCKETS)
+metrics.describe("http_requests_in_flight", "gauge", "Requests being handled.")
+metrics.describe("db_queries_total", "counter", "Statements run, by route.")
+metrics.describe("db_query_seconds_total", "counter", "Time spent in statements, by route.")
+
+
+def _start_request():
+    g._metrics_started = time.perf_counter()
+    metrics.inc("http_requests_in_flight")
+
+
+def _note_status(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    started = g.pop("_metrics_started", None)
+    if started is None:
+        return
+    metrics.inc("http_requests_in_flight", value=-1)
+    # routes, not paths, as labels: unmatched URLs all count as "none"
+    endpoint = request.endpoint or "none"
+    status = g.pop("_metrics_status", None) or 500
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - started, {
+        "blueprint": request.blueprint or "",
+        "endpoint": endpoint,
+        "method": request.method,
+        "status": str(status),
+    })
+    # instrumentation.py's numbers for this request; its teardown hook, which
+    # clears them, was registered earlier and so runs after this one
+    stats = g.get("_query_stats")
+    if stats is not None and stats.queries:
+        metrics.inc("db_queries_total", {"endpoint": endpoint}, stats.queries)
+        metrics.inc("db_query_seconds_total", {"endpoint": endpoint}, stats.db_ms / 1000)
+
+
+def scrape_authorized():
+    """
+    True when the request carries METRICS_TOKEN. Scrapers cannot log in for a
+    JWT, so /metrics takes a static token instead of admin_required.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return (METRICS_TOKEN is not None and scheme.lower() == "bearer"
+            and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()))
+
+
+def metrics_response():
+    if not scrape_authorized():
+        return jsonify({"error": "Metrics token required"}), 401
+    return Response(metrics.render(gather()), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """
+    Registers the request hooks. Call after instrumentation.init_app.
+    """
+    app.before_request(_start_request)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_request)
@@ -1,45 +1,280 @@
+"""
+Schema migrations: applies the pending files of migrations/ in name order.
+
+    python migrate.py            # apply everything pending
+    python migrate.py --plan     # list pending files and checksum drift, change nothing
+    python migrate.py --dry-run  # run pending files in transactions that are rolled back
+
+Safe to run from every node of a rolling deploy at once: a Postgres advisory
+lock lets one node migrate while the others wait, then find nothing to do.
+"""
+import argparse
+import hashlib
 import os
+import re
+import sys
+import time
+from contextlib import contextmanager
 import psycopg2
 from dotenv import load_dotenv
 
 load_dotenv()
 
-MIGRATIONS_DIR = "migrations"
+MIGRATIONS_DIR = os.getenv(
+    "MIGRATIONS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"))
+
+# Session-level advisory lock shared by every node; the value is arbitrary
+# but must never change
+MIGRATION_LOCK_ID = 4_120_731_806
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "600"))   # seconds to wait for another node
+
+# First line of a migration that must run outside a transaction block,
+# e.g. CREATE INDEX CONCURRENTLY. Its statements are run one at a time in
+# autocommit mode, so keep them idempotent (IF NOT EXISTS): a failure part
+# way leaves the earlier statements applied and the file is retried whole.
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+
+class MigrationError(Exception):
+    """Raised when migrations cannot be applied safely (drift, lock timeout, invalid index)."""
+
+
+class Migration:
+    def __init__(self, filename, sql):
+        self.filename = filename
+        self.sql = sql
+        self.checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        self.transactional = not sql.startswith(NO_TRANSACTION_MARKER)
+
+
+def split_statements(sql):
+    """
+    Splits a SQL script on top-level semicolons, leaving quoted strings,
+    dollar-quoted bodies and comments intact.
+    """
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+        elif ch in ("'", '"'):
+            end = sql.find(ch, i + 1)
+            while end != -1 and sql.startswith(ch * 2, end):
+                end = sql.find(ch, end + 2)
+            end = n if end == -1 else end + 1
+        elif ch == "$" and re.match(r"\$\w*\$", sql[i:]):
+            tag = re.match(r"\$\w*\$", sql[i:]).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end == -1 else end + len(tag)
+        elif ch == ";":
+            statements.append("".join(current).strip())
+            current = []
+            i += 1
+            continue
+        else:
+            end = i + 1
+        current.append(sql[i:end])
+        i = end
+    statements.append("".join(current).strip())
+    return [s for s in statements if s and not all(
+        line.strip().startswith("--") or not line.strip() for line in s.splitlines())]
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".sql"):
+            with open(os.path.join(directory, filename), "r") as f:
+                migrations.append(Migration(filename, f.read()))
+    return migrations
+
+
+def ensure_history_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                filename VARCHAR(255) PRIMARY KEY
+            );
+            ALTER TABLE schema_migrations
+            ADD COLUMN IF NOT EXISTS checksum CHAR(64),
+            ADD COLUMN IF NOT EXISTS applied_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS duration_ms INTEGER;
+        """)
+    conn.commit()
+
+
+def applied_migrations(conn):
+    """
+    filename -> recorded checksum (None for files applied before checksums).
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT filename, checksum FROM schema_migrations")
+        applied = dict(cur.fetchall())
+    conn.commit()
+    return applied
+
+
+@contextmanager
+def migration_lock(conn, timeout=MIGRATION_LOCK_TIMEOUT):
+    """
+    Holds the migration advisory lock. Polls instead of blocking so a node
+    stuck behind a long migration gives up after ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    announced = False
+    with conn.cursor() as cur:
+        while True:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            locked = cur.fetchone()[0]
+            conn.commit()
+            if locked:
+                break
+            if time.monotonic() >= deadline:
+                raise MigrationError(f"Timed out after {timeout:.0f}s waiting for another node's migrations")
+            if not announced:
+                print("Another node is migrating, waiting...")
+                announced = True
+            time.sleep(1)
+    try:
+        yield
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            conn.commit()
+
+
+def check_drift(migrations, applied):
+    """
+    Applied files whose content changed since they ran. Files recorded
+    before checksums existed have nothing to compare and are not drift.
+    """
+    return [m.filename for m in migrations
+            if applied.get(m.filename) is not None and applied[m.filename] != m.checksum]
+
+
+def invalid_indexes(conn):
+    # left behind when CREATE INDEX CONCURRENTLY fails part way
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT i.indisvalid AND n.nspname = current_schema()
+        """)
+        return [row[0] for row in cur.fetchall()]
+
+
+def apply_migration(conn, migration, commit=True):
+    """
+    Runs one file and records it with its checksum and duration, in the same
+    transaction for ordinary files. With commit=False that transaction is
+    left open (dry runs roll it back). Returns the duration in milliseconds.
+    """
+    started = time.monotonic()
+    with conn.cursor() as cur:
+        if migration.transactional:
+            cur.execute(migration.sql)
+        else:
+            conn.autocommit = True
+            try:
+                for statement in split_statements(migration.sql):
+                    cur.execute(statement)
+            finally:
+                conn.autocommit = False
+            broken = invalid_indexes(conn)
+            conn.commit()
+            if broken:
+                raise MigrationError(
+                    f"{migration.filename} left invalid indexes: {', '.join(broken)}. "
+                    "Drop them and run the migration again.")
+        duration_ms = int((time.monotonic() - started) * 1000)
+        cur.execute("""
+            INSERT INTO schema_migrations (filename, checksum, applied_at, duration_ms)
+            VALUES (%s, %s, NOW(), %s)
+        """, (migration.filename, migration.checksum, duration_ms))
+    if commit:
+        conn.commit()
+    return duration_ms
+
 
-def run_migrations():
+def run_migrations(plan=False, dry_run=False):
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
         raise ValueError("DATABASE_URL environment variable not set")
 
+    migrations = load_migrations()
     conn = psycopg2.connect(db_url)
-    cursor = conn.cursor()
-
-    # create a table to track applied migrations
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS schema_migrations (
-        filename VARCHAR(255) PRIMARY KEY
-    );
-    """)
-    conn.commit()
+    try:
+        with migration_lock(conn):
+            # all under the lock: another node may have just finished
+            ensure_history_table(conn)
+            applied = applied_migrations(conn)
+
+            drifted = check_drift(migrations, applied)
+            if drifted:
+                raise MigrationError(
+                    "Applied migrations changed since they ran: " + ", ".join(drifted) +
+                    ". Put the change in a new migration file instead.")
+
+            pending = [m for m in migrations if m.filename not in applied]
 
-    cursor.execute("SELECT filename FROM schema_migrations;")
-    applied = {row[0] for row in cursor.fetchall()}
-
-    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
-        if filename.endswith(".sql") and filename not in applied:
-            print(f"Applying {filename}...")
-            with open(os.path.join(MIGRATIONS_DIR, filename), "r") as f:
-                sql = f.read()
-                cursor.execute(sql)
-                cursor.execute(
-                    "INSERT INTO schema_migrations (filename) VALUES (%s);",
-                    (filename,)
-                )
+            if plan:
+                for m in pending:
+                    print(f"pending  {m.filename}{'' if m.transactional else '  (no transaction)'}")
+                print(f"{len(pending)} pending, {len(migrations) - len(pending)} applied")
+                return pending
+
+            # record checksums of files applied before they were tracked
+            baseline = [m for m in migrations if m.filename in applied and applied[m.filename] is None]
+            if baseline and not dry_run:
+                with conn.cursor() as cur:
+                    for m in baseline:
+                        cur.execute("UPDATE schema_migrations SET checksum = %s WHERE filename = %s",
+                                    (m.checksum, m.filename))
                 conn.commit()
+                print(f"Recorded checksums for {len(baseline)} previously applied migrations")
+
+            # a dry run keeps one transaction open across all files, so later
+            # files see what earlier ones created, and rolls it back at the end
+            for m in pending:
+                if dry_run and not m.transactional:
+                    print(f"Skipping {m.filename} (no transaction, cannot be rolled back)")
+                    continue
+                print(f"{'Checking' if dry_run else 'Applying'} {m.filename}...", end=" ", flush=True)
+                duration_ms = apply_migration(conn, m, commit=not dry_run)
+                print(f"{duration_ms} ms")
+            if dry_run:
+                conn.rollback()
+
+            return pending
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--plan", action="store_true", help="list pending migrations and exit")
+    mode.add_argument("--dry-run", action="store_true",
+                      help="run pending migrations in transactions that are rolled back")
+    args = parser.parse_args()
+
+    try:
+        run_migrations(plan=args.plan, dry_run=args.dry_run)
+    except MigrationError as e:
+        print(f"❌ {e}")
+        return 1
+    if not args.plan:
+        print("✅ Dry run finished, nothing changed" if args.dry_run else "✅ All migrations applied!")
+    return 0
 
-    cursor.close()
-    conn.close()
-    print("✅ All migrations applied!")
 
 if __name__ == "__main__":
-    run_migrations()
+    sys.exit(main())
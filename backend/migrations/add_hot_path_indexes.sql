@@ -0,0 +1,30 @@
+-- migrate: no-transaction
+-- Secondary indexes for the route handlers' hot queries. Built CONCURRENTLY
+-- so writes keep flowing on a live database; see check_query_plans.py for
+-- the queries each one serves.
+
+-- GET /orders/: a user's orders, newest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_user_created_at
+ON orders (user_id, created_at DESC);
+
+-- GET /orders/all: keyset pages and exports over (created_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_created_at_id
+ON orders (created_at DESC, id DESC);
+
+-- GET /orders/<id>: the order's lines, without visiting the heap
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_items_order_id
+ON order_items (order_id) INCLUDE (product_id, quantity, unit_price);
+
+-- DELETE /products/<id> cascades into these tables by product_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_items_product_id
+ON order_items (product_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cart_items_product_id
+ON cart_items (product_id);
+
+-- GET /products/?category=: filtered list in keyset (id DESC) order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_category_id
+ON products (category, id DESC);
+
+-- carts.user_id (uq_carts_user_id) and cart_items.cart_id
+-- (uq_cart_items_cart_product) are already served by their unique indexes
@@ -0,0 +1,16 @@
+-- Idempotency-Key of POST /orders/create (idempotency.py): one row per
+-- user and key, holding the response to replay to retries
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,                 -- sha256 of method, path and body
+    response_status INT,
+    response_body TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+
+-- expired keys are deleted in batches by worker.py
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+ON idempotency_keys (expires_at);
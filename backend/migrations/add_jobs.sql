@@ -0,0 +1,28 @@
+-- Background jobs (jobs.py), run by worker.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    idempotency_key VARCHAR(255) UNIQUE,              -- enqueuing the same key again is a no-op
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',     -- queued | running | done | failed
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_at TIMESTAMP,
+    locked_by VARCHAR(100),
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- workers claim the oldest due queued job
+CREATE INDEX IF NOT EXISTS idx_jobs_queued_run_at
+ON jobs (run_at) WHERE status = 'queued';
+
+-- running jobs whose worker went away are found by their lock age
+CREATE INDEX IF NOT EXISTS idx_jobs_running_locked_at
+ON jobs (locked_at) WHERE status = 'running';
+
+-- finished jobs are pruned by age
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_updated_at
+ON jobs (updated_at) WHERE status IN ('done', 'failed');
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- GET /analytics/low-stock: products at or under a stock threshold, lowest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_stock_id
+ON products (stock, id);
@@ -0,0 +1,64 @@
+-- Sales rollups for the admin analytics endpoints (analytics.py). Rebuilt
+-- per day by the analytics_refresh job; never written by request handlers.
+
+-- one row per day: every order placed that day, cancelled ones counted apart
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE PRIMARY KEY,
+    orders INT NOT NULL,
+    units INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    cancelled_orders INT NOT NULL,
+    cancelled_revenue DECIMAL(14,2) NOT NULL
+);
+
+-- revenue of orders that were not cancelled, by product category
+CREATE TABLE IF NOT EXISTS sales_daily_category (
+    day DATE NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    orders INT NOT NULL,
+    units INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (day, category)
+);
+
+CREATE TABLE IF NOT EXISTS sales_daily_product (
+    day DATE NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    orders INT NOT NULL,
+    units INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (day, product_id)
+);
+
+-- best sellers over the last N days, ranked at each refresh
+CREATE TABLE IF NOT EXISTS top_products (
+    window_days INT NOT NULL,
+    rank INT NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    units INT NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (window_days, rank)
+);
+
+-- days whose orders changed status since the last refresh (new orders are
+-- found by created_at instead, to keep checkout off a shared row)
+CREATE TABLE IF NOT EXISTS analytics_dirty_days (
+    day DATE PRIMARY KEY
+);
+
+-- a single row: when the rollups were last refreshed
+CREATE TABLE IF NOT EXISTS analytics_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMP,
+    refresh_started_at TIMESTAMP,
+    duration_ms INT,
+    days_refreshed INT
+);
+INSERT INTO analytics_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+-- deleting a product cascades into the rollups by product_id
+CREATE INDEX IF NOT EXISTS idx_sales_daily_product_product_id
+ON sales_daily_product (product_id);
+
+CREATE INDEX IF NOT EXISTS idx_top_products_product_id
+ON top_products (product_id);
@@ -0,0 +1,17 @@
+-- Full-text + trigram search over the product catalog
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE products
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_products_search_vector
+ON products USING GIN (search_vector);
+
+-- typo / partial-word matching on the product name
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm
+ON products USING GIN (name gin_trgm_ops);
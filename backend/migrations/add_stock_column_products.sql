@@ -1,2 +1,2 @@
 ALTER TABLE products 
-ADD COLUMN stock INTEGER NOT NULL DEFAULT 0;
+ADD COLUMN IF NOT EXISTS stock INTEGER NOT NULL DEFAULT 0;
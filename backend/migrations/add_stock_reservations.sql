@@ -0,0 +1,19 @@
+-- Time-limited stock holds created by POST /products/stock/reserve
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',   -- active | released | expired | committed
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS stock_reservation_items (
+    reservation_id INT NOT NULL REFERENCES stock_reservations(id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    PRIMARY KEY (reservation_id, product_id)
+);
+
+-- the sweeper only ever looks at active holds past their expiry
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_expiry
+ON stock_reservations (expires_at) WHERE status = 'active';
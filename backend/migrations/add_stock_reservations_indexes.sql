@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Foreign-key lookups on the reservation tables (user / product deletes cascade)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_reservations_user_id
+ON stock_reservations (user_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_reservation_items_product_id
+ON stock_reservation_items (product_id);
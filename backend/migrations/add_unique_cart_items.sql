@@ -0,0 +1,32 @@
+-- One cart per user: move items of duplicate carts into the oldest cart
+UPDATE cart_items ci
+SET cart_id = keep.id
+FROM carts c
+JOIN (SELECT user_id, MIN(id) AS id FROM carts GROUP BY user_id) keep ON keep.user_id = c.user_id
+WHERE ci.cart_id = c.id AND c.id <> keep.id;
+
+DELETE FROM carts c
+USING (SELECT user_id, MIN(id) AS id FROM carts GROUP BY user_id) keep
+WHERE c.user_id = keep.user_id AND c.id <> keep.id;
+
+-- One line per product: fold duplicates into the earliest row
+WITH merged AS (
+    SELECT MIN(id) AS keep_id, cart_id, product_id, SUM(quantity) AS quantity
+    FROM cart_items
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+),
+summed AS (
+    UPDATE cart_items ci
+    SET quantity = merged.quantity
+    FROM merged
+    WHERE ci.id = merged.keep_id
+)
+DELETE FROM cart_items ci
+USING merged
+WHERE ci.cart_id = merged.cart_id
+  AND ci.product_id = merged.product_id
+  AND ci.id <> merged.keep_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_carts_user_id ON carts (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_product ON cart_items (cart_id, product_id);
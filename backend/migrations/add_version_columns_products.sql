@@ -0,0 +1,21 @@
+-- Row versions for HTTP validators (ETag / Last-Modified)
+ALTER TABLE products
+ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_bump_version ON products;
+CREATE TRIGGER products_bump_version
+BEFORE UPDATE ON products
+FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+
+-- count(*) / max(updated_at) validators come straight from these indexes
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products (updated_at);
+CREATE INDEX IF NOT EXISTS idx_orders_user_updated_at ON orders (user_id, updated_at);
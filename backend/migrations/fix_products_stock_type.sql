@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+-- products.stock was declared with the invalid type NUMBER in the base
+-- schema. Make sure it is an integer that can never go negative. Each
+-- statement commits on its own, so the CHECK is validated without holding
+-- the ACCESS EXCLUSIVE lock that adding it takes.
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'products' AND column_name = 'stock') <> 'integer' THEN
+        ALTER TABLE products ALTER COLUMN stock TYPE INTEGER USING stock::integer;
+    END IF;
+END;
+$$;
+
+ALTER TABLE products
+ALTER COLUMN stock SET DEFAULT 0,
+ALTER COLUMN stock SET NOT NULL;
+
+ALTER TABLE products DROP CONSTRAINT IF EXISTS products_stock_non_negative;
+ALTER TABLE products ADD CONSTRAINT products_stock_non_negative CHECK (stock >= 0) NOT VALID;
+ALTER TABLE products VALIDATE CONSTRAINT products_stock_non_negative;
@@ -0,0 +1,267 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+from metrics import metrics, sample
+
+# bcrypt cost factor for new hashes. Existing hashes with another cost are
+# upgraded (or downgraded) transparently on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashing runs in a process pool so a login burst burns those CPUs instead of
+# stalling the request threads. Sized per server process: keep
+# WEB_CONCURRENCY * PASSWORD_WORKERS close to the number of cores.
+# 0 hashes inline on the request thread.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))   # jobs running or queued, per process
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", "10"))        # seconds a request waits for its job
+PASSWORD_RETRY_AFTER = 1                                             # Retry-After (seconds) on a 503
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the hashing queue is full or a job does not finish in time."""
+
+
+# --- runs in the pool's processes: module-level so it pickles ---
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(password, hashed, rounds):
+    """
+    Returns (ok, new_hash). new_hash is set when the password is right but
+    was hashed with another cost, so the caller can store the upgrade.
+    """
+    if not bcrypt.checkpw(password, hashed):
+        return False, None
+    if _rounds_of(hashed) != rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+
+def _rounds_of(hashed):
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# --- request side ---
+
+class PasswordHasher:
+    """
+    Bounded front for the hashing processes. At most ``queue_limit`` jobs are
+    admitted at once; past that, callers get PasswordPoolBusy right away
+    instead of queueing behind a login storm.
+    """
+
+    def __init__(self, workers=2, queue_limit=32, timeout=10.0, rounds=12):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.rounds = rounds
+        self.pid = os.getpid()
+
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._jobs = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._rehashes = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # forkserver: safe to start from a process that already runs threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolBusy("Password hashing queue is full")
+        with self._lock:
+            self._pending += 1
+            self._jobs += 1
+
+    def _done(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, func, *args):
+        """
+        Runs func(*args) in the pool and returns its future. The queue slot is
+        held until the job finishes, even if the caller stops waiting.
+        """
+        self._admit()
+        if self.workers <= 0:
+            try:
+                result = func(*args)
+            finally:
+                self._done()
+            future = _Done(result)
+        else:
+            future = self._get_executor().submit(func, *args)
+            future.add_done_callback(self._done)
+        return future
+
+    def run(self, func, *args):
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._timeouts += 1
+            raise PasswordPoolBusy("Password hashing timed out")
+
+    async def run_async(self, func, *args):
+        """
+        run() for the async API: awaits the job without blocking the event loop.
+        """
+        if self.workers <= 0:
+            return await asyncio.get_running_loop().run_in_executor(None, self.run, func, *args)
+        future = asyncio.wrap_future(self.submit(func, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise PasswordPoolBusy("Password hashing timed out")
+
+    def _checked(self, result):
+        if result[1]:
+            with self._lock:
+                self._rehashes += 1
+        return result
+
+    def hash_password(self, password):
+        return self.run(_hash, password.encode("utf-8"), self.rounds)
+
+    def verify_password(self, password, hashed):
+        """
+        Returns (ok, new_hash); see _check.
+        """
+        return self._checked(self.run(_check, password.encode("utf-8"), hashed.encode("utf-8"), self.rounds))
+
+    async def hash_password_async(self, password):
+        return await self.run_async(_hash, password.encode("utf-8"), self.rounds)
+
+    async def verify_password_async(self, password, hashed):
+        return self._checked(await self.run_async(
+            _check, password.encode("utf-8"), hashed.encode("utf-8"), self.rounds))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "queue_limit": self.queue_limit,
+                "pending": self._pending,
+                "jobs": self._jobs,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "rehashes": self._rehashes,
+            }
+
+
+class _Done:
+    """Already-resolved stand-in for a future, for inline hashing."""
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self, timeout=None):
+        return self._result
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """
+    Returns the process-wide hasher. Like the connection pool, one inherited
+    through fork() is abandoned: its worker processes belong to the parent.
+    """
+    global _hasher
+    if _hasher is not None and _hasher.pid != os.getpid():
+        _hasher = None
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    workers=PASSWORD_WORKERS,
+                    queue_limit=PASSWORD_QUEUE_LIMIT,
+                    timeout=PASSWORD_TIMEOUT,
+                    rounds=BCRYPT_ROUNDS,
+                )
+    return _hasher
+
+
+def hash_password(password):
+    return get_hasher().hash_password(password)
+
+
+def verify_password(password, hashed):
+    return get_hasher().verify_password(password, hashed)
+
+
+def password_stats():
+    return get_hasher().stats()
+
+
+def close_hasher():
+    global _hasher
+    if _hasher is not None and _hasher.pid == os.getpid():
+        _hasher.close()
+    _hasher = None
+
+
+metrics.describe("password_hash_queue_depth", "gauge", "bcrypt jobs running or queued.")
+metrics.describe("password_hash_queue_limit", "gauge", "Most bcrypt jobs admitted at once.")
+metrics.describe("password_hash_jobs_total", "counter", "bcrypt jobs admitted.")
+metrics.describe("password_hash_rejected_total", "counter", "bcrypt jobs refused because the queue was full.")
+metrics.describe("password_hash_timeouts_total", "counter", "bcrypt jobs the caller stopped waiting for.")
+metrics.describe("password_rehashes_total", "counter", "Hashes upgraded to the current cost on login.")
+
+
+@metrics.collector
+def _password_metrics():
+    stats = password_stats()
+    return {
+        sample("password_hash_queue_depth"): stats["pending"],
+        sample("password_hash_queue_limit"): stats["queue_limit"],
+        sample("password_hash_jobs_total"): stats["jobs"],
+        sample("password_hash_rejected_total"): stats["rejected"],
+        sample("password_hash_timeouts_total"): stats["timeouts"],
+        sample("password_rehashes_total"): stats["rehashes"],
+    }
+
+
+# Rehash-on-login: only replaces the hash the password was checked against,
+# so a concurrent password change is never overwritten
+REHASH_SQL = """
+    UPDATE users SET password_hash = %(new_hash)s
+    WHERE id = %(user_id)s AND password_hash = %(old_hash)s
+"""
@@ -0,0 +1,265 @@
+"""
+Rate limiting and admission control.
+
+Rate limits are token buckets, one per client and route class. A client is
+the user for routes behind token_required, which takes the token itself, and
+the IP address for every other route. Each class allows RATE_LIMITS bursts
+of N requests, refilled at N per period:
+
+    RATE_LIMITS="login=10/60,search=30/10,write=60/60,default=300/60"
+
+A request over the limit gets a 429 with Retry-After. Buckets live in
+RATE_LIMIT_BACKEND: "memory" (per process), "redis" (shared by every worker
+and node, needs the ``redis`` package) or "local", an in-process stand-in
+for the shared store.
+
+Admission control protects latency under overload: while a database
+connection takes longer than ADMISSION_MAX_POOL_WAIT_MS to get, new requests
+get a 503 with Retry-After straight away instead of queueing behind the ones
+already admitted. The wait estimate decays once the pool frees up, so the
+worker starts admitting again on its own.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, jsonify, request
+
+from cache import REDIS_URL
+from database import pool_wait_estimate
+from metrics import metrics
+
+RATE_LIMITING = os.getenv("RATE_LIMITING", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")          # memory | local | redis
+RATE_LIMITS = os.getenv("RATE_LIMITS", "login=10/60,search=30/10,write=60/60,default=300/60")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))    # buckets kept by the memory backend
+RATE_LIMIT_PROXIES = int(os.getenv("RATE_LIMIT_PROXIES", "0"))           # trusted proxies adding X-Forwarded-For
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_MAX_POOL_WAIT_MS = float(os.getenv("ADMISSION_MAX_POOL_WAIT_MS", "200"))
+ADMISSION_RETRY_AFTER = 1                                                # Retry-After (seconds) on a 503
+
+# endpoints with a class of their own; otherwise writes are "write", reads "default"
+ROUTE_CLASSES = {
+    "users.login": "login",
+    "users.register": "login",
+    "products.search_products": "search",
+}
+# never limited nor shed: probes and monitoring
+EXEMPT_ENDPOINTS = {"live", "ready", "prometheus_metrics"}
+
+
+def parse_limits(raw):
+    """
+    "login=10/60,default=300/60" -> {"login": (10, 60.0), "default": (300, 60.0)},
+    i.e. (burst, seconds to refill it).
+    """
+    limits = {}
+    for part in raw.split(","):
+        name, _, limit = part.partition("=")
+        if not name.strip():
+            continue
+        burst, _, seconds = limit.partition("/")
+        limits[name.strip()] = (int(burst), float(seconds or 1))
+    if "default" not in limits:
+        raise ValueError("RATE_LIMITS needs a default limit")
+    return limits
+
+
+LIMITS = parse_limits(RATE_LIMITS)
+
+
+# --- buckets ---
+
+def refill(tokens, updated, now, capacity, rate):
+    """
+    Refills a bucket that held ``tokens`` at time ``updated`` and takes one
+    token from it if it can. Returns (allowed, tokens left).
+    """
+    tokens = min(capacity, tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class MemoryBuckets:
+    """
+    Buckets of this process, least recently used ones dropped past
+    ``maxsize`` (a dropped bucket comes back full).
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()   # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            allowed, tokens = refill(tokens, updated, now, capacity, rate)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class LocalSharedBuckets:
+    """
+    Local stand-in for RedisBuckets: wall-clock time, and buckets that
+    expire once they would be full again, like the Redis keys do.
+    """
+
+    def __init__(self):
+        self._buckets = {}              # key -> (tokens, updated, expires_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.time()
+        with self._lock:
+            tokens, updated, expires_at = self._buckets.get(key, (capacity, now, now))
+            if expires_at < now:
+                tokens, updated = capacity, now
+            allowed, tokens = refill(tokens, updated, now, capacity, rate)
+            self._buckets[key] = (tokens, now, now + capacity / rate)
+            if len(self._buckets) > RATE_LIMIT_MAX_KEYS:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] >= now}
+        return allowed, tokens
+
+
+# same as refill(), on the Redis server's clock, in one atomic step
+TAKE_SCRIPT = """
+local capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    """
+    Buckets shared by every worker and node. Needs the optional ``redis``
+    package.
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._take = redis.Redis.from_url(url).register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, tokens = self._take(keys=[key], args=[capacity, rate])
+        return bool(allowed), float(tokens)
+
+
+def make_buckets(name):
+    if name == "memory":
+        return MemoryBuckets(RATE_LIMIT_MAX_KEYS)
+    if name == "local":
+        return LocalSharedBuckets()
+    if name == "redis":
+        return RedisBuckets(REDIS_URL)
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+buckets = make_buckets(RATE_LIMIT_BACKEND)
+
+metrics.describe("rate_limited_total", "counter", "Requests refused by a rate limit, by route class and client kind.")
+metrics.describe("admission_shed_total", "counter", "Requests turned away while the database pool was congested.")
+
+
+# --- rate limits ---
+
+def route_class():
+    name = ROUTE_CLASSES.get(request.endpoint)
+    if name is not None:
+        return name
+    if request.endpoint == "products.get_all_products" and request.args.get("search"):
+        return "search"
+    if request.method in ("POST", "PUT", "PATCH", "DELETE"):
+        return "write"
+    return "default"
+
+
+def client_ip():
+    """
+    The client's address; behind RATE_LIMIT_PROXIES trusted proxies, the
+    address the outermost of them saw.
+    """
+    if RATE_LIMIT_PROXIES:
+        hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        if len(hops) >= RATE_LIMIT_PROXIES:
+            return hops[-RATE_LIMIT_PROXIES]
+    return request.remote_addr or "unknown"
+
+
+def too_many_requests(retry_after):
+    return jsonify({"error": "Too many requests, slow down"}), 429, {"Retry-After": str(retry_after)}
+
+
+def check_limit(kind, client):
+    """
+    Takes a token from the client's bucket for this route's class. Returns
+    a 429 response when it is empty, None when the request may go on.
+    """
+    if not RATE_LIMITING:
+        return None
+    name = route_class()
+    burst, seconds = LIMITS.get(name, LIMITS["default"])
+    rate = burst / seconds
+    allowed, tokens = buckets.take(f"ratelimit:{name}:{kind}:{client}", burst, rate)
+    if allowed:
+        return None
+    metrics.inc("rate_limited_total", {"class": name, "client": kind})
+    return too_many_requests(max(math.ceil((1 - tokens) / rate), 1))
+
+
+def check_user_limit(user_id):
+    """
+    Called by token_required once the token is verified.
+    """
+    return check_limit("user", user_id)
+
+
+def _is_token_protected():
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "token_required", False)
+
+
+# --- Flask hooks ---
+
+def _admit():
+    if request.endpoint in EXEMPT_ENDPOINTS or request.method == "OPTIONS":
+        return None
+    # gthread workers run fewer threads than the pool has connections, so a
+    # count of requests in flight never reaches the pool size; the pool wait
+    # alone says whether the database keeps up
+    if ADMISSION_CONTROL and pool_wait_estimate() * 1000 > ADMISSION_MAX_POOL_WAIT_MS:
+        metrics.inc("admission_shed_total")
+        return (jsonify({"error": "Server busy, try again shortly"}), 503,
+                {"Retry-After": str(ADMISSION_RETRY_AFTER)})
+    if not _is_token_protected():
+        return check_limit("ip", client_ip())
+    return None
+
+
+def init_app(app):
+    """
+    Registers the hooks. Call before the routes need them, i.e. in
+    create_app, after metrics.init_app so refused requests are counted too.
+    """
+    if RATE_LIMITING or ADMISSION_CONTROL:
+        app.before_request(_admit)
@@ -0,0 +1,192 @@
+import os
+import threading
+import traceback
+from database import get_connection, stamp_catalog_write
+from cache import product_cache
+
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "900"))                    # seconds a hold lives
+RESERVATION_MAX_TTL = 3600
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))  # 0 disables the sweeper
+RESERVATION_SWEEP_BATCH = 500
+
+# SQL is kept in named-parameter form so the async API (aio/) can share it
+
+RESERVE_SQL = """
+    WITH requested AS (
+        SELECT product_id, SUM(quantity)::int AS quantity
+        FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS r(product_id, quantity)
+        GROUP BY product_id
+    ),
+    locked AS (
+        SELECT id, stock FROM products
+        WHERE id IN (SELECT product_id FROM requested)
+        ORDER BY id
+        FOR UPDATE
+    ),
+    shortages AS (
+        SELECT r.product_id, r.quantity AS requested, COALESCE(l.stock, 0) AS available
+        FROM requested r
+        LEFT JOIN locked l ON l.id = r.product_id
+        WHERE l.id IS NULL OR l.stock < r.quantity
+    ),
+    ok AS (
+        SELECT NOT EXISTS (SELECT 1 FROM shortages) AS all_available
+    ),
+    taken AS (
+        UPDATE products p
+        SET stock = p.stock - r.quantity
+        FROM requested r, ok
+        WHERE ok.all_available AND p.id = r.product_id AND p.stock >= r.quantity
+    ),
+    reservation AS (
+        INSERT INTO stock_reservations (user_id, expires_at)
+        SELECT %(user_id)s, NOW() + make_interval(secs => %(ttl)s)
+        FROM ok WHERE ok.all_available
+        RETURNING id, status, expires_at
+    ),
+    held AS (
+        INSERT INTO stock_reservation_items (reservation_id, product_id, quantity)
+        SELECT reservation.id, r.product_id, r.quantity
+        FROM reservation, requested r
+    )
+    SELECT
+        (SELECT row_to_json(reservation) FROM reservation) AS reservation,
+        (SELECT COALESCE(json_agg(shortages ORDER BY product_id), '[]') FROM shortages) AS shortages
+"""
+
+RELEASE_SQL = """
+    WITH released AS (
+        UPDATE stock_reservations
+        SET status = %(status)s
+        WHERE id = %(id)s AND status = 'active'
+          AND (%(user_id)s::int IS NULL OR user_id = %(user_id)s::int)
+        RETURNING id
+    ),
+    returned AS (
+        SELECT i.product_id, i.quantity
+        FROM stock_reservation_items i
+        JOIN released ON released.id = i.reservation_id
+    ),
+    -- in id order, like RESERVE_SQL and checkout, so they cannot deadlock
+    locked AS (
+        SELECT id FROM products
+        WHERE id IN (SELECT product_id FROM returned)
+        ORDER BY id
+        FOR UPDATE
+    ),
+    restocked AS (
+        UPDATE products p
+        SET stock = p.stock + returned.quantity
+        FROM returned, locked
+        WHERE p.id = returned.product_id AND locked.id = p.id
+        RETURNING p.id
+    )
+    SELECT (SELECT id FROM released) AS id, ARRAY(SELECT id FROM restocked) AS product_ids
+"""
+
+SWEEP_SQL = """
+    WITH expired AS (
+        UPDATE stock_reservations
+        SET status = 'expired'
+        WHERE id IN (
+            SELECT id FROM stock_reservations
+            WHERE status = 'active' AND expires_at < NOW()
+            ORDER BY id
+            LIMIT %(batch)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+    ),
+    returned AS (
+        SELECT i.product_id, SUM(i.quantity) AS quantity
+        FROM stock_reservation_items i
+        JOIN expired e ON e.id = i.reservation_id
+        GROUP BY i.product_id
+    ),
+    locked AS (
+        SELECT id FROM products
+        WHERE id IN (SELECT product_id FROM returned)
+        ORDER BY id
+        FOR UPDATE
+    ),
+    restocked AS (
+        UPDATE products p
+        SET stock = p.stock + returned.quantity
+        FROM returned, locked
+        WHERE p.id = returned.product_id AND locked.id = p.id
+        RETURNING p.id
+    )
+    SELECT (SELECT count(*) FROM expired) AS expired, ARRAY(SELECT id FROM restocked) AS product_ids
+"""
+
+
+def reserve_stock(cur, user_id, items, ttl=RESERVATION_TTL):
+    """
+    Holds stock for many (product_id, quantity) pairs in a single statement.
+    All-or-nothing: either every line is available and a reservation is
+    created, or nothing changes and the shortages are returned.
+    Returns (reservation row or None, shortages).
+    """
+    cur.execute(RESERVE_SQL, {
+        "product_ids": [int(item["product_id"]) for item in items],
+        "quantities": [int(item["quantity"]) for item in items],
+        "user_id": user_id,
+        "ttl": ttl,
+    })
+    row = cur.fetchone()
+    return row["reservation"], row["shortages"]
+
+
+def release_reservation(cur, reservation_id, user_id=None, status="released"):
+    """
+    Returns the stock of an active reservation and marks it ``status``.
+    Restricted to the owner when user_id is given.
+    Returns the affected product ids, or None if there was nothing to release.
+    """
+    cur.execute(RELEASE_SQL, {"id": reservation_id, "user_id": user_id, "status": status})
+    row = cur.fetchone()
+    return row["product_ids"] if row["id"] is not None else None
+
+
+def sweep_expired_reservations(batch=RESERVATION_SWEEP_BATCH):
+    """
+    Returns expired holds to stock. SKIP LOCKED lets several workers sweep at
+    the same time without blocking each other or checkouts.
+    Returns the number of reservations expired.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(SWEEP_SQL, {"batch": batch})
+        row = cur.fetchone()
+        conn.commit()
+        if row["product_ids"]:
+            stamp_catalog_write(conn)
+    finally:
+        cur.close()
+        conn.close()
+
+    if row["product_ids"]:
+        product_cache.invalidate_products(*row["product_ids"])
+    return row["expired"]
+
+
+def start_reservation_sweeper(interval=RESERVATION_SWEEP_INTERVAL):
+    """
+    Runs sweep_expired_reservations every ``interval`` seconds on a daemon
+    thread. Returns the stop event, or None when the sweeper is disabled.
+    """
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                while sweep_expired_reservations() >= RESERVATION_SWEEP_BATCH:
+                    pass
+            except Exception:
+                traceback.print_exc()
+
+    threading.Thread(target=run, name="reservation-sweeper", daemon=True).start()
+    return stop
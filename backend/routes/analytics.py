@@ -0,0 +1,242 @@
+from datetime import date, timedelta
+from flask import Blueprint, request, jsonify
+from database import get_connection
+from auth_middleware import token_required, admin_required
+from analytics import ANALYTICS_TOP_WINDOWS, refresh_params
+from conditional import make_etag, to_timestamp, conditional_json
+from jobs import ENQUEUE_SQL
+
+analytics_bp = Blueprint("analytics", __name__)
+
+REPORT_DEFAULT_DAYS = 30
+REPORT_MAX_DAYS = 366
+TOP_PRODUCTS_DEFAULT_LIMIT = 10
+LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_MAX_LIMIT = 500
+
+# Reports read the rollups only (analytics.py), never orders or
+# order_items, so they cost the same whatever the order volume.
+# Named-parameter form so the async API (aio/) can share them.
+
+ANALYTICS_STATE_SQL = "SELECT refreshed_at, duration_ms, days_refreshed FROM analytics_state"
+
+SALES_DAILY_SQL = """
+    SELECT to_char(day, 'YYYY-MM-DD') AS day, orders, units, revenue, cancelled_orders, cancelled_revenue
+    FROM sales_daily
+    WHERE day >= %(from)s AND day < %(to)s
+    ORDER BY day
+"""
+
+SALES_TOTALS_SQL = """
+    SELECT COALESCE(SUM(orders), 0)::int AS orders, COALESCE(SUM(units), 0)::int AS units,
+           COALESCE(SUM(revenue), 0) AS revenue,
+           COALESCE(SUM(cancelled_orders), 0)::int AS cancelled_orders,
+           COALESCE(SUM(cancelled_revenue), 0) AS cancelled_revenue
+    FROM sales_daily
+    WHERE day >= %(from)s AND day < %(to)s
+"""
+
+SALES_BY_CATEGORY_SQL = """
+    SELECT category, SUM(orders)::int AS orders, SUM(units)::int AS units, SUM(revenue) AS revenue
+    FROM sales_daily_category
+    WHERE day >= %(from)s AND day < %(to)s
+    GROUP BY category
+    ORDER BY revenue DESC, category
+"""
+
+TOP_PRODUCTS_SQL = """
+    SELECT t.rank, t.product_id, p.name, p.category, t.units, t.revenue
+    FROM top_products t
+    JOIN products p ON p.id = t.product_id
+    WHERE t.window_days = %(days)s
+    ORDER BY t.rank
+    LIMIT %(limit)s
+"""
+
+# live, not rolled up: stock changes with every checkout
+LOW_STOCK_SQL = """
+    SELECT id, name, category, stock
+    FROM products
+    WHERE stock <= %(threshold)s
+    ORDER BY stock, id
+    LIMIT %(limit)s
+"""
+
+
+def parse_report_range(args):
+    """
+    ?from=&to= (ISO dates, [from, to)) -> ({"from", "to"}, None) or (None, error message).
+    Defaults to the last REPORT_DEFAULT_DAYS days, today included.
+    """
+    try:
+        end = date.fromisoformat(args["to"]) if args.get("to") else date.today() + timedelta(days=1)
+        start = date.fromisoformat(args["from"]) if args.get("from") else end - timedelta(days=REPORT_DEFAULT_DAYS)
+    except ValueError:
+        return None, "from and to must be dates (YYYY-MM-DD)"
+    if start >= end:
+        return None, "from must be before to"
+    if (end - start).days > REPORT_MAX_DAYS:
+        return None, f"At most {REPORT_MAX_DAYS} days per report"
+    return {"from": start, "to": end}, None
+
+
+def parse_top_products_args(args):
+    """
+    ?days=&limit= -> ({"days", "limit"}, None) or (None, error message).
+    """
+    days = args.get("days", ANALYTICS_TOP_WINDOWS[0], type=int)
+    if days not in ANALYTICS_TOP_WINDOWS:
+        return None, "days must be one of " + ", ".join(str(window) for window in ANALYTICS_TOP_WINDOWS)
+    limit = min(max(args.get("limit", TOP_PRODUCTS_DEFAULT_LIMIT, type=int), 1), 100)
+    return {"days": days, "limit": limit}, None
+
+
+def report_etag(state, name, params):
+    # a report only changes when a refresh commits
+    return make_etag("analytics", name, state["refreshed_at"], params)
+
+
+def state_payload(state):
+    return {"refreshed_at": state["refreshed_at"], "refresh_duration_ms": state["duration_ms"],
+            "days_refreshed": state["days_refreshed"]}
+
+
+def _report(cur, name, params, build):
+    cur.execute(ANALYTICS_STATE_SQL)
+    state = cur.fetchone()
+
+    def payload():
+        return dict(build(), **state_payload(state))
+
+    return conditional_json(payload, report_etag(state, name, params), to_timestamp(state["refreshed_at"]),
+                            cache_control="private, no-cache")
+
+
+# Revenue per day over a date range, with totals
+@analytics_bp.route("/sales", methods=["GET"])
+@token_required
+@admin_required
+def sales(user):
+    try:
+        params, error = parse_report_range(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+        conn = get_connection()
+        cur = conn.cursor()
+
+        def build():
+            cur.execute(SALES_DAILY_SQL, params)
+            days = cur.fetchall()
+            cur.execute(SALES_TOTALS_SQL, params)
+            return {"days": days, "totals": cur.fetchone(),
+                    "from": params["from"].isoformat(), "to": params["to"].isoformat()}
+
+        response = _report(cur, "sales", params, build)
+        cur.close()
+        conn.close()
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Revenue per product category over a date range
+@analytics_bp.route("/categories", methods=["GET"])
+@token_required
+@admin_required
+def sales_by_category(user):
+    try:
+        params, error = parse_report_range(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+        conn = get_connection()
+        cur = conn.cursor()
+
+        def build():
+            cur.execute(SALES_BY_CATEGORY_SQL, params)
+            return {"categories": cur.fetchall(),
+                    "from": params["from"].isoformat(), "to": params["to"].isoformat()}
+
+        response = _report(cur, "categories", params, build)
+        cur.close()
+        conn.close()
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Best sellers by revenue over the last ?days= (one of ANALYTICS_TOP_WINDOWS)
+@analytics_bp.route("/top-products", methods=["GET"])
+@token_required
+@admin_required
+def top_products(user):
+    try:
+        params, error = parse_top_products_args(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+        conn = get_connection()
+        cur = conn.cursor()
+
+        def build():
+            cur.execute(TOP_PRODUCTS_SQL, params)
+            return {"products": cur.fetchall(), "days": params["days"]}
+
+        response = _report(cur, "top-products", params, build)
+        cur.close()
+        conn.close()
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Products at or under ?threshold= units of stock, lowest first
+@analytics_bp.route("/low-stock", methods=["GET"])
+@token_required
+@admin_required
+def low_stock(user):
+    try:
+        threshold = request.args.get("threshold", LOW_STOCK_THRESHOLD, type=int)
+        limit = min(max(request.args.get("limit", 100, type=int), 1), LOW_STOCK_MAX_LIMIT)
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(LOW_STOCK_SQL, {"threshold": threshold, "limit": limit})
+        products = cur.fetchall()
+        cur.close()
+        conn.close()
+        return jsonify({"products": products, "threshold": threshold}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# When the rollups were last refreshed
+@analytics_bp.route("/status", methods=["GET"])
+@token_required
+@admin_required
+def analytics_status(user):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(ANALYTICS_STATE_SQL)
+        state = cur.fetchone()
+        cur.close()
+        conn.close()
+        return jsonify(state_payload(state)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Queue a refresh now (worker.py runs it); repeated calls within a second share it
+@analytics_bp.route("/refresh", methods=["POST"])
+@token_required
+@admin_required
+def refresh(user):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(ENQUEUE_SQL, refresh_params(1))
+        queued = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        return jsonify({"message": "Refresh queued", "job_id": queued["id"] if queued else None}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
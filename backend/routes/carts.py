@@ -4,6 +4,46 @@ from auth_middleware import token_required
 
 cart_bp = Blueprint("carts", __name__)
 
+# Reading a cart does not create it: the common case stays a plain read
+CART_ID_SQL = "SELECT id FROM carts WHERE user_id = %(user_id)s"
+
+# Get-or-create that also locks the cart row, for statements that change its
+# items: a checkout holds the same lock (routes/orders.py), so the items it
+# validated cannot change before it orders them. DO UPDATE (not DO NOTHING)
+# so a row comes back even when another request created the cart meanwhile
+LOCKED_CART_CTE = """
+    cart AS (
+        INSERT INTO carts (user_id) VALUES (%(user_id)s)
+        ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+        RETURNING id
+    )
+"""
+
+UPDATE_ITEM_SQL = """
+    UPDATE cart_items
+    SET quantity = %s
+    WHERE product_id = %s AND cart_id = (SELECT id FROM carts WHERE user_id = %s FOR UPDATE)
+"""
+
+REMOVE_ITEM_SQL = """
+    DELETE FROM cart_items
+    WHERE product_id = %s AND cart_id = (SELECT id FROM carts WHERE user_id = %s FOR UPDATE)
+"""
+
+CLEAR_CART_SQL = """
+    DELETE FROM cart_items
+    WHERE cart_id = (SELECT id FROM carts WHERE user_id = %s FOR UPDATE)
+"""
+
+# rows are the response items as they are, prices already floats
+CART_ITEMS_SQL = """
+    SELECT ci.id AS item_id, p.name AS product_name, p.price::float8 AS price, ci.quantity,
+           (p.price * ci.quantity)::float8 AS total
+    FROM cart_items ci
+    JOIN products p ON ci.product_id = p.id
+    WHERE ci.cart_id = %s
+"""
+
 # --- Get current user's cart ---
 @cart_bp.route("/", methods=["GET"])
 @token_required
@@ -12,36 +52,18 @@ def get_cart(user):
         conn = get_connection()
         cur = conn.cursor()
 
-        # get or create cart
-        cur.execute("SELECT id FROM carts WHERE user_id = %s", (user["id"],))
+        cur.execute(CART_ID_SQL, {"user_id": user["id"]})
         cart = cur.fetchone()
-
-        if not cart:
-            cur.execute("INSERT INTO carts (user_id) VALUES (%s) RETURNING id;", (user["id"],))
-            cart_id = cur.fetchone()["id"]  
+        if cart is None:
+            # first visit: create it
+            cur.execute(f"WITH {LOCKED_CART_CTE} SELECT id FROM cart", {"user_id": user["id"]})
+            cart = cur.fetchone()
             conn.commit()
-        else:
-            cart_id = cart["id"]
+        cart_id = cart["id"]
 
         # fetch items
-        cur.execute("""
-            SELECT ci.id, p.name, p.price, ci.quantity, (p.price * ci.quantity) AS total
-            FROM cart_items ci
-            JOIN products p ON ci.product_id = p.id
-            WHERE ci.cart_id = %s
-        """, (cart_id,))
-        items = cur.fetchall()
-
-        cart_items = [
-    {
-        "item_id": row["id"],
-        "product_name": row["name"],
-        "price": float(row["price"]),
-        "quantity": row["quantity"],
-        "total": float(row["total"])
-    }
-    for row in items
-]
+        cur.execute(CART_ITEMS_SQL, (cart_id,))
+        cart_items = cur.fetchall()
 
         total_price = sum(item["total"] for item in cart_items)
 
@@ -74,20 +96,14 @@ def add_to_cart(user):
         conn = get_connection()
         cur = conn.cursor()
 
-        # Ensure user has a cart
-        cur.execute("SELECT id FROM carts WHERE user_id = %s", (user["id"],))
-        cart = cur.fetchone()
-        if not cart:
-            cur.execute("INSERT INTO carts (user_id) VALUES (%s) RETURNING id;", (user["id"],))
-            cart_id = cur.fetchone()["id"]
-        else:
-            cart_id = cart["id"]
-
-        # Add or update item
-        cur.execute("""
+        # Ensure user has a cart, then add the item or bump its quantity
+        cur.execute(f"""
+            WITH {LOCKED_CART_CTE}
             INSERT INTO cart_items (cart_id, product_id, quantity)
-            VALUES (%s, %s, %s)
-        """, (cart_id, product_id, quantity))
+            SELECT cart.id, %(product_id)s, %(quantity)s FROM cart
+            ON CONFLICT (cart_id, product_id)
+            DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        """, {"user_id": user["id"], "product_id": product_id, "quantity": quantity})
 
         conn.commit()
         cur.close()
@@ -99,6 +115,50 @@ def add_to_cart(user):
         return jsonify({"error": str(e)}), 500
 
 
+# --- Add many products to cart at once ---
+@cart_bp.route("/items", methods=["POST"])
+@token_required
+def add_items_to_cart(user):
+    try:
+        data = request.get_json() or {}
+        items = data.get("items")
+        if not items or not isinstance(items, list):
+            return jsonify({"error": "items must be a non-empty list"}), 400
+
+        product_ids = [int(item["product_id"]) for item in items]
+        quantities = [int(item.get("quantity", 1)) for item in items]
+        if any(quantity <= 0 for quantity in quantities):
+            return jsonify({"error": "Quantities must be positive"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        # duplicates are summed first: ON CONFLICT may touch a row only once
+        cur.execute(f"""
+            WITH {LOCKED_CART_CTE},
+            requested AS (
+                SELECT product_id, SUM(quantity)::int AS quantity
+                FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS r(product_id, quantity)
+                GROUP BY product_id
+            )
+            INSERT INTO cart_items (cart_id, product_id, quantity)
+            SELECT cart.id, requested.product_id, requested.quantity FROM cart, requested
+            ON CONFLICT (cart_id, product_id)
+            DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        """, {"user_id": user["id"], "product_ids": product_ids, "quantities": quantities})
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return jsonify({"message": "Products added to cart", "count": len(set(product_ids))}), 201
+
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each item needs a product_id and a quantity"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # --- Update quantity ---
 @cart_bp.route("/update/<int:product_id>", methods=["PUT"])
 @token_required
@@ -110,11 +170,7 @@ def update_quantity(user, product_id):
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            UPDATE cart_items
-            SET quantity = %s
-            WHERE product_id = %s AND cart_id = (SELECT id FROM carts WHERE user_id = %s)
-        """, (quantity, product_id, user["id"]))
+        cur.execute(UPDATE_ITEM_SQL, (quantity, product_id, user["id"]))
 
         conn.commit()
         cur.close()
@@ -134,10 +190,7 @@ def remove_item(user, product_id):
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            DELETE FROM cart_items
-            WHERE product_id = %s AND cart_id = (SELECT id FROM carts WHERE user_id = %s)
-        """, (product_id, user["id"]))
+        cur.execute(REMOVE_ITEM_SQL, (product_id, user["id"]))
 
         conn.commit()
         cur.close()
@@ -157,10 +210,7 @@ def clear_cart(user):
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            DELETE FROM cart_items
-            WHERE cart_id = (SELECT id FROM carts WHERE user_id = %s)
-        """, (user["id"],))
+        cur.execute(CLEAR_CART_SQL, (user["id"],))
 
         conn.commit()
         cur.close()
@@ -1,77 +1,369 @@
 # routes/orders.py
 
-from flask import Blueprint, request, jsonify
-from database import get_connection
+import base64
+import csv
+import io
+import psycopg2.errors
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from database import get_connection, get_read_connection, stamp_catalog_write
 from auth_middleware import token_required, admin_required
+from cache import product_cache
+from reservations import release_reservation
+from jobs import enqueue
+from analytics import schedule_refresh
+from idempotency import (IDEMPOTENCY_HEADER, claim_key, count_outcome, outcome_response, parse_key,
+                         request_hash, store_response)
+from conditional import make_etag, to_timestamp, conditional_json
+from metrics import metrics
 from datetime import datetime
 
 orders_bp = Blueprint("orders", __name__)
 
+metrics.describe("checkouts_total", "counter", "Checkout attempts by outcome.")
+metrics.describe("orders_created_total", "counter", "Orders placed.")
+metrics.describe("order_amount_total", "counter", "Sum of placed order totals.")
+
+
+def count_checkout(outcome):
+    metrics.inc("checkouts_total", {"outcome": outcome})
+
+
+def order_lines(lines):
+    """
+    CREATE_ORDER_SQL's product_ids and quantities, from the checked lines.
+    """
+    return {"product_ids": [line["product_id"] for line in lines],
+            "quantities": [int(line["quantity"]) for line in lines]}
+
+# Checkout SQL, in named-parameter form so the async API (aio/) can share it
+
+# Taken first: cart changes wait for the checkout (routes/carts.py locks the
+# same row), so the lines validated below are the lines ordered
+LOCK_CART_SQL = "SELECT id FROM carts WHERE user_id = %(user_id)s FOR UPDATE"
+
+LOCK_RESERVATION_SQL = """
+    SELECT id FROM stock_reservations
+    WHERE id = %(reservation_id)s AND user_id = %(user_id)s AND status = 'active'
+    FOR UPDATE
+"""
+
+# Every product in the cart (and the reservation), always locked in id order
+# so concurrent checkouts sharing products queue up instead of deadlocking
+LOCK_CHECKOUT_PRODUCTS_SQL = """
+    SELECT id FROM products
+    WHERE id IN (SELECT product_id FROM cart_items WHERE cart_id = %(cart_id)s)
+       OR id IN (SELECT product_id FROM stock_reservation_items
+                 WHERE reservation_id = %(reservation_id)s)
+    ORDER BY id
+    FOR UPDATE
+"""
+
+CHECKOUT_LINES_SQL = """
+    SELECT p.id AS product_id, p.name, p.stock, SUM(ci.quantity) AS quantity
+    FROM cart_items ci
+    JOIN products p ON ci.product_id = p.id
+    WHERE ci.cart_id = %(cart_id)s
+    GROUP BY p.id
+    ORDER BY p.id
+"""
+
+# Order, order items, stock and cart in one statement, for exactly the lines
+# whose stock was checked (product_ids, quantities); the total is summed in
+# SQL on DECIMAL so no float rounding creeps in
+CREATE_ORDER_SQL = """
+    WITH lines AS (
+        SELECT l.product_id, l.quantity, p.price
+        FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS l(product_id, quantity)
+        JOIN products p ON p.id = l.product_id
+    ),
+    new_order AS (
+        INSERT INTO orders (user_id, total_amount)
+        SELECT %(user_id)s, SUM(price * quantity) FROM lines
+        RETURNING id, status, total_amount, created_at
+    ),
+    items AS (
+        INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+        SELECT new_order.id, lines.product_id, lines.quantity, lines.price
+        FROM new_order, lines
+    ),
+    reserved AS (
+        UPDATE products p
+        SET stock = p.stock - lines.quantity
+        FROM lines
+        WHERE p.id = lines.product_id
+    ),
+    cleared AS (
+        DELETE FROM cart_items WHERE cart_id = %(cart_id)s AND product_id = ANY(%(product_ids)s::int[])
+    )
+    SELECT id, status, total_amount, created_at FROM new_order
+"""
+
+# Per-user reads; the validator comes from the (user_id, updated_at) index
+USER_ORDERS_VALIDATOR_SQL = """
+    SELECT count(*) AS n, max(updated_at) AS last_modified
+    FROM orders WHERE user_id = %s
+"""
+
+USER_ORDERS_SQL = """
+    SELECT id, total_amount, status, created_at, updated_at
+    FROM orders WHERE user_id = %s
+    ORDER BY created_at DESC
+"""
+
+ORDER_ITEMS_SQL = """
+    SELECT oi.id, p.name, oi.quantity, oi.unit_price, oi.subtotal
+    FROM order_items oi
+    JOIN products p ON oi.product_id = p.id
+    WHERE oi.order_id = %s
+"""
+
+# Item rows never change after checkout, but the products they show do
+# (p.name): every product write bumps its version, so the sum moves with them
+ORDER_ITEMS_VALIDATOR_SQL = """
+    SELECT count(*) AS n, COALESCE(sum(p.version), 0) AS versions, max(p.updated_at) AS last_modified
+    FROM order_items oi
+    JOIN products p ON oi.product_id = p.id
+    WHERE oi.order_id = %s
+"""
+
+ORDER_STATUSES = ["pending", "shipped", "delivered", "cancelled"]
+
+# The order's day goes on the analytics rollups' list of days to rebuild,
+# in the same round trip
+ORDER_STATUS_SQL = """
+    WITH updated AS (
+        UPDATE orders
+        SET status = %(status)s, updated_at = %(updated_at)s
+        WHERE id = %(order_id)s
+        RETURNING id, status, updated_at, created_at
+    ),
+    dirty AS (
+        INSERT INTO analytics_dirty_days (day)
+        SELECT created_at::date FROM updated
+        ON CONFLICT DO NOTHING
+    )
+    SELECT id, status, updated_at FROM updated
+"""
+
+# Admin export of /orders/all
+EXPORT_COLUMNS = ["id", "username", "total_amount", "status", "created_at"]
+EXPORT_FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_PAGE_SIZE = 100
+EXPORT_MAX_PAGE_SIZE = 1000
+EXPORT_FETCH_SIZE = 2000    # rows per round trip of the streaming cursor, and per chunk sent
+
+
+def encode_order_cursor(row):
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_order_cursor(cursor):
+    created_at, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(order_id)
+
+
+def parse_export_args(args):
+    """
+    ?status=&from=&to=&after=<cursor> -> (filters, None) or (None, error message).
+    from/to are ISO dates or datetimes; the range is [from, to).
+    """
+    filters = {"status": args.get("status"), "from": None, "to": None, "after": None}
+    if filters["status"] and filters["status"] not in ORDER_STATUSES:
+        return None, "Invalid status"
+    for key in ("from", "to"):
+        if args.get(key):
+            try:
+                filters[key] = datetime.fromisoformat(args[key])
+            except ValueError:
+                return None, f"Invalid '{key}' date"
+    if args.get("after"):
+        try:
+            filters["after"] = decode_order_cursor(args["after"])
+        except (ValueError, UnicodeDecodeError):
+            return None, "Invalid cursor"
+    return filters, None
+
+
+def is_paginated(args):
+    """
+    Pages ({"orders", "next_cursor"}) are opt-in with ?limit= or ?after=.
+    """
+    return "limit" in args or "after" in args
+
+
+def all_orders_query(filters, limit=None):
+    """
+    Newest-first order listing with the admin filters, in named-parameter form.
+    Keyset on (created_at, id); limit=None returns every matching row.
+    """
+    conditions, params = [], {}
+    if filters["status"]:
+        conditions.append("o.status = %(status)s")
+        params["status"] = filters["status"]
+    if filters["from"]:
+        conditions.append("o.created_at >= %(from)s")
+        params["from"] = filters["from"]
+    if filters["to"]:
+        conditions.append("o.created_at < %(to)s")
+        params["to"] = filters["to"]
+    if filters["after"]:
+        conditions.append("(o.created_at, o.id) < (%(after_created_at)s, %(after_id)s)")
+        params["after_created_at"], params["after_id"] = filters["after"]
+
+    query = """
+        SELECT o.id, u.username, o.total_amount, o.status, o.created_at
+        FROM orders o
+        JOIN users u ON o.user_id = u.id
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY o.created_at DESC, o.id DESC"
+    if limit is not None:
+        query += " LIMIT %(limit)s"
+        params["limit"] = limit
+    return query, params
+
+
+def export_chunk(rows, fmt, dumps):
+    """
+    Serialises one batch of export rows as NDJSON lines or CSV records.
+    """
+    if fmt == "ndjson":
+        return "".join(dumps(dict(row)) + "\n" for row in rows)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow([row["created_at"].isoformat() if column == "created_at" else row[column]
+                         for column in EXPORT_COLUMNS])
+    return out.getvalue()
+
+
+def export_header(fmt):
+    return ",".join(EXPORT_COLUMNS) + "\r\n" if fmt == "csv" else ""
+
+
+def export_headers(fmt):
+    headers = {"Cache-Control": "no-store"}
+    if fmt == "csv":
+        headers["Content-Disposition"] = 'attachment; filename="orders.csv"'
+    return headers
+
+
 # 1️⃣ Create Order from Cart
 @orders_bp.route("/create", methods=["POST"])
 @token_required
 def create_order(user):
+    key, error = parse_key(request.headers.get(IDEMPOTENCY_HEADER))
+    if error:
+        return jsonify({"error": error}), 400
     try:
         user_id = user["id"]
         conn = get_connection()
         cur = conn.cursor()
 
-        # Get user cart
-        cur.execute("SELECT id FROM carts WHERE user_id = %s", (user_id,))
+        # Retries with the same key get the first response; the key is held
+        # by this transaction, so a concurrent duplicate waits for its commit
+        if key is not None:
+            outcome = claim_key(cur, user_id, key, request_hash(request.method, request.path, request.get_data()))
+            if outcome is not None:
+                conn.rollback()
+                body, status, headers = outcome_response(outcome)
+                return jsonify(body), status, headers
+
+        # Get user cart, locked until the order commits
+        cur.execute(LOCK_CART_SQL, {"user_id": user_id})
         cart = cur.fetchone()
         if not cart:
+            conn.rollback()
+            count_checkout("cart_not_found")
             return jsonify({"error": "Cart not found"}), 404
 
         cart_id = cart["id"]
 
-        # Get items from cart
-        cur.execute("""
-            SELECT ci.product_id, ci.quantity, p.price
-            FROM cart_items ci
-            JOIN products p ON ci.product_id = p.id
-            WHERE ci.cart_id = %s
-        """, (cart_id,))
-        items = cur.fetchall()
-
-        if not items:
+        # Optional hold from POST /products/stock/reserve. Lock it before any
+        # product row, the same order the release endpoint and sweeper use.
+        data = request.get_json(silent=True) or {}
+        reservation_id = data.get("reservation_id")
+        params = {"cart_id": cart_id, "user_id": user_id, "reservation_id": reservation_id}
+        if reservation_id is not None:
+            cur.execute(LOCK_RESERVATION_SQL, params)
+            if not cur.fetchone():
+                conn.rollback()
+                count_checkout("reservation_inactive")
+                return jsonify({"error": "Reservation not found or no longer active"}), 409
+
+        cur.execute(LOCK_CHECKOUT_PRODUCTS_SQL, params)
+
+        # Held stock goes back to the shelf inside this transaction and is
+        # taken again below for the lines actually ordered
+        released_ids = []
+        if reservation_id is not None:
+            released_ids = release_reservation(cur, reservation_id, user_id, status="committed")
+
+        # Cart lines (duplicates merged) against the now-stable stock
+        cur.execute(CHECKOUT_LINES_SQL, params)
+        lines = cur.fetchall()
+
+        if not lines:
+            conn.rollback()
+            count_checkout("empty_cart")
             return jsonify({"error": "Cart is empty"}), 400
 
-        # Calculate total
-        total_amount = sum(float(item["price"]) * item["quantity"] for item in items)
-
-        # Create order
-        cur.execute("""
-            INSERT INTO orders (user_id, total_amount)
-            VALUES (%s, %s)
-            RETURNING id, status, created_at
-        """, (user_id, total_amount))
-        order = cur.fetchone()
-        order_id = order["id"]
+        shortages = [{
+            "product_id": line["product_id"],
+            "name": line["name"],
+            "requested": int(line["quantity"]),
+            "available": line["stock"]
+        } for line in lines if line["stock"] < line["quantity"]]
 
-        # Insert order items
-        for item in items:
-            cur.execute("""
-                INSERT INTO order_items (order_id, product_id, quantity, unit_price)
-                VALUES (%s, %s, %s, %s)
-            """, (order_id, item["product_id"], item["quantity"], float(item["price"])))
+        if shortages:
+            conn.rollback()
+            count_checkout("insufficient_stock")
+            return jsonify({"error": "Insufficient stock", "items": shortages}), 409
 
-        # Clear the user's cart
-        cur.execute("DELETE FROM cart_items WHERE cart_id = %s", (cart_id,))
+        cur.execute(CREATE_ORDER_SQL, dict(params, **order_lines(lines)))
+        order = cur.fetchone()
+        # everything else about the order runs after the 201, in worker.py;
+        # queued in this transaction, so only for orders that commit
+        enqueue(cur, "order_created", {"order_id": order["id"]}, key=f"order_created:{order['id']}")
+        response = jsonify({
+            "message": "Order created successfully",
+            "order_id": order["id"],
+            "status": order["status"],
+            "total_amount": order["total_amount"],
+            "created_at": order["created_at"]
+        })
+        if key is not None:
+            store_response(cur, user_id, key, 201, response.get_data(as_text=True))
+            count_outcome("created")
         conn.commit()
+        stamp_catalog_write(conn)   # the stock it took
 
         cur.close()
         conn.close()
 
-        return jsonify({
-            "message": "Order created successfully",
-            "order_id": order_id,
-            "status": order["status"],
-            "total_amount": total_amount,
-            "created_at": order["created_at"]
-        }), 201
+        product_cache.invalidate_products(*[line["product_id"] for line in lines], *released_ids)
+        count_checkout("created")
+        metrics.inc("orders_created_total")
+        metrics.inc("order_amount_total", value=float(order["total_amount"]))
+
+        return response, 201
+
+    except psycopg2.errors.LockNotAvailable:
+        conn.rollback()
+        body, status, headers = outcome_response(("in_progress",))
+        return jsonify(body), status, headers
+
+    except psycopg2.errors.CheckViolation:
+        # products_stock_non_negative: stock moved past a check
+        conn.rollback()
+        count_checkout("insufficient_stock")
+        return jsonify({"error": "Insufficient stock"}), 409
 
     except Exception as e:
         conn.rollback()
+        count_checkout("error")
         return jsonify({"error": str(e)}), 500
 
 
@@ -80,20 +372,25 @@ def create_order(user):
 @token_required
 def get_user_orders(user):
     try:
-        conn = get_connection()
+        conn = get_read_connection(user["id"])
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT id, total_amount, status, created_at, updated_at
-            FROM orders WHERE user_id = %s
-            ORDER BY created_at DESC
-        """, (user["id"],))
-        orders = cur.fetchall()
+        # validator from the (user_id, updated_at) index, no row payload needed
+        cur.execute(USER_ORDERS_VALIDATOR_SQL, (user["id"],))
+        validator = cur.fetchone()
+        etag = make_etag("orders", user["id"], validator["n"], validator["last_modified"])
+        last_modified = to_timestamp(validator["last_modified"])
+
+        def load_orders():
+            cur.execute(USER_ORDERS_SQL, (user["id"],))
+            return cur.fetchall()
+
+        response = conditional_json(load_orders, etag, last_modified, cache_control="private, no-cache")
 
         cur.close()
         conn.close()
 
-        return jsonify(orders), 200
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -113,21 +410,24 @@ def get_order_details(user, order_id):
         if not order:
             return jsonify({"error": "Order not found"}), 404
 
-        cur.execute("""
-            SELECT oi.id, p.name, oi.quantity, oi.unit_price, oi.subtotal
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = %s
-        """, (order_id,))
-        items = cur.fetchall()
+        cur.execute(ORDER_ITEMS_VALIDATOR_SQL, (order_id,))
+        items = cur.fetchone()
+        etag = make_etag("order", order_id, order["updated_at"], items["n"], items["versions"])
+        last_modified = to_timestamp(max(filter(None, (order["updated_at"], items["last_modified"]))))
+
+        def load_details():
+            cur.execute(ORDER_ITEMS_SQL, (order_id,))
+            return {
+                "order": order,
+                "items": cur.fetchall()
+            }
+
+        response = conditional_json(load_details, etag, last_modified, cache_control="private, no-cache")
 
         cur.close()
         conn.close()
 
-        return jsonify({
-            "order": order,
-            "items": items
-        }), 200
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -142,23 +442,19 @@ def update_order_status(user, order_id):
         data = request.get_json()
         new_status = data.get("status")
 
-        if new_status not in ["pending", "shipped", "delivered", "cancelled"]:
+        if new_status not in ORDER_STATUSES:
             return jsonify({"error": "Invalid status"}), 400
 
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            UPDATE orders
-            SET status = %s, updated_at = %s
-            WHERE id = %s
-            RETURNING id, status, updated_at
-        """, (new_status, datetime.utcnow(), order_id))
+        cur.execute(ORDER_STATUS_SQL, {"status": new_status, "updated_at": datetime.utcnow(), "order_id": order_id})
         updated = cur.fetchone()
 
         if not updated:
             return jsonify({"error": "Order not found"}), 404
 
+        schedule_refresh(cur)
         conn.commit()
         cur.close()
         conn.close()
@@ -174,26 +470,72 @@ def update_order_status(user, order_id):
 
 
 # 5️⃣ Admin View: Get All Orders
+#   ?format=json (default)  one keyset page: ?limit=&after=<next_cursor>
+#   ?format=ndjson|csv      every matching order, streamed from a server-side cursor
+#   filters for all formats: ?status=&from=&to=
 @orders_bp.route("/all", methods=["GET"])
 @token_required
 @admin_required
 def get_all_orders(user):
     try:
-        conn = get_connection()
+        fmt = request.args.get("format", "json")
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": "format must be json, ndjson or csv"}), 400
+        filters, error = parse_export_args(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        conn = get_read_connection(user["id"])
+
+        if fmt != "json":
+            if filters["after"]:
+                return jsonify({"error": "after is only supported with format=json"}), 400
+            dumps = current_app.json.dumps
+
+            def generate():
+                # named cursor: rows stay on the server and arrive one
+                # batch at a time, so memory stays flat whatever the size
+                cur = conn.cursor(name="orders_export")
+                try:
+                    cur.execute(*all_orders_query(filters))
+                    yield export_header(fmt)
+                    while True:
+                        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                        if not rows:
+                            break
+                        yield export_chunk(rows, fmt, dumps)
+                finally:
+                    cur.close()
+                    conn.close()
+
+            return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt],
+                            headers=export_headers(fmt))
+
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT o.id, u.username, o.total_amount, o.status, o.created_at
-            FROM orders o
-            JOIN users u ON o.user_id = u.id
-            ORDER BY o.created_at DESC
-        """)
+        # without ?limit= or ?after= the response stays the bare array it always was
+        if not is_paginated(request.args):
+            cur.execute(*all_orders_query(filters))
+            orders = cur.fetchall()
+            cur.close()
+            conn.close()
+            return jsonify(orders), 200
+
+        limit = min(max(request.args.get("limit", EXPORT_PAGE_SIZE, type=int), 1), EXPORT_MAX_PAGE_SIZE)
+
+        # one extra row tells us whether there is a next page
+        cur.execute(*all_orders_query(filters, limit + 1))
         orders = cur.fetchall()
 
         cur.close()
         conn.close()
 
-        return jsonify(orders), 200
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        return jsonify({
+            "orders": orders,
+            "next_cursor": encode_order_cursor(orders[-1]) if has_more else None
+        }), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,56 +1,243 @@
+import re
 from flask import Blueprint, request, jsonify
-from database import get_connection
+from database import get_connection, get_read_connection, stamp_catalog_write
 import psycopg2
 from auth_middleware import token_required, admin_required
+from cache import product_cache
+from reservations import RESERVATION_TTL, RESERVATION_MAX_TTL, reserve_stock, release_reservation
+from conditional import make_etag, to_timestamp, is_fresh, not_modified, conditional_json
+from json_provider import RawJSON
 
 products_bp = Blueprint("products", __name__)
 
+PRODUCT_FIELDS = ["id", "name", "description", "price", "stock", "category", "image_url"]
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def search_terms(term):
+    """
+    Turns free text into a prefix tsquery, e.g. "blue wid" -> "blue:* & wid:*".
+    """
+    words = re.findall(r"\w+", term.lower())
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_condition(term):
+    """
+    WHERE fragment matching the full-text vector (name, category, description)
+    or, for typos, trigram word similarity on the name. Both are index-backed.
+    """
+    return (
+        "(search_vector @@ to_tsquery('english', %s) OR %s <%% name)",
+        [search_terms(term), term],
+    )
+
+
+def product_row(row, fields):
+    product = {}
+    for field in fields:
+        value = row[field]
+        if field == "price":
+            value = float(value)
+        elif field == "stock":
+            value = int(value)
+        product[field] = value
+    return product
+
+
+# Query builders, shared with the async API (aio/)
+
+# Bumped at commit by every transaction that writes products
+# (migrations/add_catalog_version.sql); 64 primary-key rows, no catalog scan
+CATALOG_VALIDATOR_SQL = "SELECT sum(version) AS version FROM catalog_version"
+
+PRODUCT_SQL = f"""
+    SELECT {', '.join(PRODUCT_FIELDS)}, version, updated_at
+    FROM products WHERE id = %s
+"""
+
+
+def parse_fields(raw):
+    """
+    ?fields=id,name,price -> (columns, None) or (None, error message).
+    id is always returned, it is the pagination cursor.
+    """
+    if not raw:
+        return PRODUCT_FIELDS, None
+    requested = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PRODUCT_FIELDS]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}"
+    return ["id"] + [f for f in PRODUCT_FIELDS if f in requested and f != "id"], None
+
+
+def list_products_query(category, search, fields, after, limit):
+    """
+    Keyset-paginated (newest first) product list; limit=None fetches all rows,
+    otherwise one extra row is fetched to tell whether there is a next page.
+    """
+    conditions, params = [], []
+    if category:
+        conditions.append("category = %s")
+        params.append(category)
+    if search and search_terms(search):
+        condition, condition_params = search_condition(search)
+        conditions.append(condition)
+        params.extend(condition_params)
+    if after is not None:
+        conditions.append("id < %s")
+        params.append(after)
+
+    query = f"SELECT {', '.join(fields)} FROM products"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    return query, params
+
+
+def list_products_json_query(category, search, fields, after, limit):
+    """
+    list_products_query with the response body built by Postgres: one row of
+    ``body``, the JSON text of {"products": [...], "next_cursor": id} (no
+    next_cursor without a limit), and ``count``, the number of products in it.
+    """
+    query, params = list_products_query(category, search, fields, after, limit)
+    # keys in the order the JSON provider would sort them into
+    columns = ", ".join("price::float8 AS price" if f == "price" else f for f in sorted(fields))
+    products = "coalesce((SELECT json_agg(page ORDER BY page.id DESC) FROM page), '[]'::json)"
+    if limit is None:
+        page = f"SELECT {columns} FROM matches"
+        body = f"json_build_object('products', {products})"
+    else:
+        page = f"SELECT {columns} FROM matches ORDER BY id DESC LIMIT %s"
+        body = (f"json_build_object('products', {products}, 'next_cursor', "
+                "CASE WHEN (SELECT count(*) FROM matches) > %s THEN (SELECT min(id) FROM page) END)")
+        params += [limit, limit]
+    return f"""
+        WITH matches AS ({query}), page AS ({page})
+        SELECT {body}::text AS body, (SELECT count(*) FROM page) AS count
+    """, params
+
+
+def search_products_query(term, category, limit, offset):
+    condition, params = search_condition(term)
+    query = f"""
+        SELECT {', '.join(PRODUCT_FIELDS)},
+               ts_rank_cd(search_vector, to_tsquery('english', %s))
+                 + word_similarity(%s, name) AS rank
+        FROM products
+        WHERE {condition}
+    """
+    params = [search_terms(term), term] + params
+    if category:
+        query += " AND category = %s"
+        params.append(category)
+    # one extra row tells us whether there is a next page
+    query += " ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s"
+    params += [limit + 1, offset]
+    return query, params
+
+
+def search_products_payload(rows, limit, offset):
+    products = []
+    for row in rows[:limit]:
+        product = product_row(row, PRODUCT_FIELDS)
+        product["rank"] = round(float(row["rank"]), 4)
+        products.append(product)
+    return {
+        "products": products,
+        "next_offset": offset + limit if len(rows) > limit else None
+    }
+
+
 @products_bp.route("/", methods=["GET"])
 def get_all_products():
     try:
-        conn = get_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
         category = request.args.get("category")
         search = request.args.get("search")
 
-        query = "SELECT * FROM products"
-        params = []
-
-        if category:
-            query += " WHERE category = %s"
-            params.append(category)
-        if search:
-            if "WHERE" in query:
-                query += " AND name ILIKE %s"
-            else:
-                query += " WHERE name ILIKE %s"
-            params.append(f"%{search}%")
-
-        query += " ORDER BY id DESC"
-        cur.execute(query, params)
-        rows = cur.fetchall()
+        # ?fields=id,name,price - projection for list views
+        fields, error = parse_fields(request.args.get("fields"))
+        if error:
+            return jsonify({"error": error}), 400
+
+        # ?limit=20&after=<id> - keyset pagination on id (newest first)
+        limit = request.args.get("limit", type=int)
+        after = request.args.get("after", type=int)
+        paginate = limit is not None or after is not None
+        if paginate:
+            limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+        cache_params = {"category": category, "search": search, "fields": fields,
+                        "limit": limit, "after": after}
+        generation = product_cache.list_generation()
+        entry = product_cache.get_list("list-json", cache_params, generation)
+
+        if entry is None:
+            conn = get_read_connection()
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+            # catalog validator first: a client revalidating an unchanged
+            # catalog gets its 304 without the list query ever running
+            cur.execute(CATALOG_VALIDATOR_SQL)
+            validator = cur.fetchone()
+            # no Last-Modified: NOW() is the transaction's start, so a write
+            # committed late can carry a time older than the client's copy
+            etag = make_etag("products", cache_params, validator["version"])
+            if is_fresh(etag):
+                cur.close()
+                conn.close()
+                return not_modified(etag)
+
+            cur.execute(*list_products_json_query(category, search, fields, after, limit))
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
+
+            # the body is kept as Postgres wrote it, and sent as it is
+            entry = {"etag": etag, "body": row["body"], "count": row["count"]}
+            product_cache.set_list("list-json", cache_params, entry, generation)
 
-        if not rows:
+        if not paginate and not entry["count"]:
             return jsonify({"message": "No products found"}), 404
+        return conditional_json(RawJSON(entry["body"]), entry["etag"])
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# 🟢 Ranked product search
+@products_bp.route("/search", methods=["GET"])
+def search_products():
+    try:
+        term = (request.args.get("q") or "").strip()
+        if not search_terms(term):
+            return jsonify({"error": "Missing search query"}), 400
+
+        category = request.args.get("category")
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        offset = max(request.args.get("offset", 0, type=int), 0)
 
-        products = []
-        for row in rows:
-            products.append({
-                "id": row["id"],
-                "name": row["name"],
-                "description": row["description"],
-                "price": float(row["price"]),
-                "stock": int(row["stock"]),
-                "category": row["category"],
-                "image_url": row["image_url"]
-            })
+        cache_params = {"q": term, "category": category, "limit": limit, "offset": offset}
+        generation = product_cache.list_generation()
+        payload = product_cache.get_list("search", cache_params, generation)
+        if payload is not None:
+            return jsonify(payload), 200
 
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(*search_products_query(term, category, limit, offset))
+        rows = cur.fetchall()
         cur.close()
         conn.close()
-        return jsonify({
-        "products": products
-        }), 200
+
+        payload = search_products_payload(rows, limit, offset)
+        product_cache.set_list("search", cache_params, payload, generation)
+        return jsonify(payload), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -60,21 +247,30 @@ def get_all_products():
 @products_bp.route("/<int:product_id>", methods=["GET"])
 def get_product(product_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        version = product_cache.product_version(product_id)
+        entry = product_cache.get_product(product_id, version)
 
-        cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-        row = cur.fetchone()
+        if entry is None:
+            conn = get_read_connection()
+            cur = conn.cursor()
 
-        if not row:
-            return jsonify({"error": "Product not found"}), 404
+            cur.execute(PRODUCT_SQL, (product_id,))
+            row = cur.fetchone()
 
-        col_names = [desc[0] for desc in cur.description]
-        product = dict(zip(col_names, row))
+            if not row:
+                return jsonify({"error": "Product not found"}), 404
 
-        cur.close()
-        conn.close()
-        return jsonify(product), 200
+            entry = {
+                "etag": make_etag("product", product_id, row["version"]),
+                "last_modified": to_timestamp(row["updated_at"]),
+                "body": product_row(row, PRODUCT_FIELDS)
+            }
+            product_cache.set_product(product_id, entry, version)
+
+            cur.close()
+            conn.close()
+
+        return conditional_json(entry["body"], entry["etag"], entry["last_modified"])
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -108,12 +304,13 @@ def add_product(user):
         """, (name, description, price, stock, category, image_url))
 
         new_product = cur.fetchone()
-        col_names = [desc[0] for desc in cur.description]
         conn.commit()
+        stamp_catalog_write(conn)
         cur.close()
         conn.close()
+        product_cache.invalidate_lists()
 
-        return jsonify(dict(zip(col_names, new_product))), 201
+        return jsonify(product_row(new_product, PRODUCT_FIELDS)), 201
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -162,8 +359,10 @@ def update_product(user, product_id):
             return jsonify({"error": "Product not found"}), 404
 
         conn.commit()
+        stamp_catalog_write(conn)
         cur.close()
         conn.close()
+        product_cache.invalidate_products(product_id)
 
         return jsonify(updated_product), 200
 
@@ -184,12 +383,14 @@ def delete_product(user,product_id):
         deleted = cur.fetchone()
 
         conn.commit()
+        stamp_catalog_write(conn)
         cur.close()
         conn.close()
 
         if not deleted:
             return jsonify({"error": "Product not found"}), 404
 
+        product_cache.invalidate_products(product_id)
         return jsonify({"message": f"Product {product_id} deleted"}), 200
 
     except Exception as e:
@@ -211,19 +412,83 @@ def decrement_stock(user,product_id):
             UPDATE products 
             SET stock = stock - %s
             WHERE id = %s AND stock >= %s
-            RETURNING *;
+            RETURNING id, name, description, price, stock, category, image_url;
         """, (quantity, product_id, quantity))
 
         updated = cur.fetchone()
         if not updated:
             return jsonify({"error": "Insufficient stock or product not found"}), 400
 
-        col_names = [desc[0] for desc in cur.description]
         conn.commit()
+        stamp_catalog_write(conn)
+        cur.close()
+        conn.close()
+        product_cache.invalidate_products(product_id)
+
+        return jsonify(product_row(updated, PRODUCT_FIELDS)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# 🟢 Reserve stock for a whole checkout in one call
+@products_bp.route("/stock/reserve", methods=["POST"])
+@token_required
+def reserve_stock_batch(user):
+    try:
+        data = request.get_json() or {}
+        items = data.get("items")
+        if not items or not isinstance(items, list):
+            return jsonify({"error": "items must be a non-empty list"}), 400
+        for item in items:
+            if not isinstance(item, dict) or int(item.get("product_id", 0)) <= 0 \
+                    or int(item.get("quantity", 0)) <= 0:
+                return jsonify({"error": "Each item needs a product_id and a positive quantity"}), 400
+
+        ttl = min(max(int(data.get("ttl_seconds", RESERVATION_TTL)), 1), RESERVATION_MAX_TTL)
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        reservation, shortages = reserve_stock(cur, user["id"], items, ttl)
+        if reservation is None:
+            conn.rollback()
+            return jsonify({"error": "Insufficient stock", "items": shortages}), 409
+
+        conn.commit()
+        stamp_catalog_write(conn)
+        cur.close()
+        conn.close()
+        product_cache.invalidate_products(*{int(item["product_id"]) for item in items})
+
+        return jsonify({"reservation": reservation}), 201
+
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid product_id or quantity"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# 🟢 Release a stock reservation before it expires
+@products_bp.route("/stock/reservations/<int:reservation_id>/release", methods=["POST"])
+@token_required
+def release_stock_reservation(user, reservation_id):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+
+        product_ids = release_reservation(cur, reservation_id, user_id=user["id"])
+        if product_ids is None:
+            conn.rollback()
+            return jsonify({"error": "Reservation not found or no longer active"}), 404
+
+        conn.commit()
+        stamp_catalog_write(conn)
         cur.close()
         conn.close()
+        product_cache.invalidate_products(*product_ids)
 
-        return jsonify(dict(zip(col_names, updated))), 200
+        return jsonify({"message": f"Reservation {reservation_id} released"}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,11 +1,17 @@
 from flask import Blueprint, request, jsonify,current_app
 from database import get_connection
-import bcrypt
+from passwords import (PASSWORD_RETRY_AFTER, PasswordPoolBusy, REHASH_SQL,
+                       hash_password, verify_password)
 import os
 
 
 users_bp = Blueprint("users", __name__)
 
+
+def busy():
+    # shed load fast; the client retries instead of piling onto the queue
+    return jsonify({"error": "Server busy, try again shortly"}), 503, {"Retry-After": str(PASSWORD_RETRY_AFTER)}
+
 @users_bp.route("/register", methods=["POST"])
 def register():
     try:
@@ -17,7 +23,7 @@ def register():
         if not email or not username or not password:
             return jsonify({"error": "Missing required fields"}), 400
 
-        password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        password_hash = hash_password(password)
 
         conn = get_connection()
         cur = conn.cursor()
@@ -44,12 +50,19 @@ def register():
             "created_at": new_user["created_at"]
         }), 201
 
+    except PasswordPoolBusy:
+        return busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 import jwt
 import datetime
-from flask import current_app
+import uuid
+from flask import current_app, g
+from auth_middleware import TOKEN_LIFETIME, token_required, revoke_token
+
+# Login lookup; served by the unique index on users.email
+USER_BY_EMAIL_SQL = "SELECT * FROM users WHERE email = %(email)s"
 
 @users_bp.route("/login", methods=["POST"])
 def login():
@@ -64,7 +77,7 @@ def login():
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
+        cur.execute(USER_BY_EMAIL_SQL, {"email": email})
         user = cur.fetchone()
         cur.close()
         conn.close()
@@ -72,16 +85,30 @@ def login():
         if not user:
             return jsonify({"error": "Invalid email or password"}), 401
 
-        # Verify password
-        if not bcrypt.checkpw(password.encode("utf-8"), user["password_hash"].encode("utf-8")):
+        # Verify password (in the hashing pool)
+        ok, new_hash = verify_password(password, user["password_hash"])
+        if not ok:
             return jsonify({"error": "Invalid email or password"}), 401
 
+        # stored with an outdated cost factor: keep the upgraded hash
+        if new_hash:
+            conn = get_connection()
+            cur = conn.cursor()
+            cur.execute(REHASH_SQL, {"user_id": user["id"], "old_hash": user["password_hash"],
+                                     "new_hash": new_hash})
+            conn.commit()
+            cur.close()
+            conn.close()
+
         # Create JWT token
+        now = datetime.datetime.utcnow()
         payload = {
             "user_id": user["id"],
             "username": user["username"],
             "role": user["role"],
-            "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + TOKEN_LIFETIME
         }
         
         token = jwt.encode(payload, current_app.config["SECRET_KEY"], algorithm="HS256")
@@ -91,5 +118,16 @@ def login():
             "token": token
         }), 200
 
+    except PasswordPoolBusy:
+        return busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@users_bp.route("/logout", methods=["POST"])
+@token_required
+def logout(user):
+    claims = g.token_claims
+    if claims.get("jti"):
+        revoke_token(claims["jti"], claims["exp"])
+    return jsonify({"message": "Logged out"}), 200
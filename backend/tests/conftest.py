@@ -0,0 +1,108 @@
+"""
+Shared fixtures. The tests run against a real, migrated database:
+
+    DATABASE_URL=postgresql://... python migrate.py
+    DATABASE_URL=postgresql://... python -m pytest tests
+
+Tests that need the database are skipped when DATABASE_URL is unreachable.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# before any app module reads its configuration
+os.environ.setdefault("SECRET_KEY", "test-secret-key-of-sufficient-length-123")
+os.environ.setdefault("RESERVATION_SWEEP_INTERVAL", "0")
+os.environ.setdefault("QUERY_LOG", "off")
+os.environ.setdefault("RATE_LIMITING", "0")
+os.environ.setdefault("PASSWORD_WORKERS", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import psycopg2  # noqa: E402
+from psycopg2.extras import RealDictCursor  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    url = os.getenv("DATABASE_URL")
+    try:
+        psycopg2.connect(url, connect_timeout=3).close()
+    except (psycopg2.Error, TypeError):
+        pytest.skip("DATABASE_URL is not set or not reachable")
+    return url
+
+
+@pytest.fixture
+def db(database_url):
+    """
+    A connection of its own, outside the app's pool, in autocommit mode.
+    """
+    conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def app(database_url):
+    from app import app
+
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def register(client, db, role="user"):
+    """
+    A new user; returns {"id", "email", "headers"} with a bearer token.
+    """
+    name = "t" + uuid.uuid4().hex[:12]
+    email = f"{name}@example.test"
+    response = client.post("/users/register", json={"email": email, "username": name, "password": "pw"})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    with db.cursor() as cur:
+        cur.execute("UPDATE users SET role = %s WHERE email = %s RETURNING id", (role, email))
+        user_id = cur.fetchone()["id"]
+    token = client.post("/users/login", json={"email": email, "password": "pw"}).get_json()["token"]
+    return {"id": user_id, "email": email, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def cart_of(db, user):
+    with db.cursor() as cur:
+        cur.execute("SELECT id FROM carts WHERE user_id = %s", (user["id"],))
+        return cur.fetchone()["id"]
+
+
+def stock_of(db, product_id):
+    with db.cursor() as cur:
+        cur.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+        return cur.fetchone()["stock"]
+
+
+@pytest.fixture
+def user(client, db):
+    return register(client, db)
+
+
+@pytest.fixture
+def admin(client, db):
+    return register(client, db, role="admin")
+
+
+@pytest.fixture
+def make_product(client, admin):
+    def make(stock=10, price=9.99, **fields):
+        body = dict({"name": "Test " + uuid.uuid4().hex[:8], "description": "test product",
+                     "price": price, "stock": stock, "category": "tests"}, **fields)
+        response = client.post("/products/", json=body, headers=admin["headers"])
+        assert response.status_code == 201, response.get_data(as_text=True)
+        return response.get_json()["id"]
+    return make
@@ -0,0 +1,28 @@
+import threading
+import time
+
+import database
+from ratelimit import ADMISSION_MAX_POOL_WAIT_MS
+
+
+def test_congested_pool_sheds_new_requests(client):
+    client.get("/products/")
+    pool = database.get_pool()
+    held = [pool.getconn() for _ in range(pool.max_size)]
+    waiter = threading.Thread(target=lambda: held.append(pool.getconn()))
+    waiter.start()
+    try:
+        time.sleep(ADMISSION_MAX_POOL_WAIT_MS / 1000 + 0.1)
+
+        shed = client.get("/products/")
+        assert shed.status_code == 503
+        assert shed.headers["Retry-After"] == "1"
+        assert client.get("/health/live").status_code == 200
+    finally:
+        pool.putconn(held.pop(0))
+        waiter.join()
+        for conn in held:
+            pool.putconn(conn)
+
+    # one slow checkout does not keep the worker closed once the pool is free
+    assert client.get("/products/").status_code != 503
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+
+def place_orders(client, user, make_product, n):
+    product = make_product(stock=n)
+    for _ in range(n):
+        client.post("/carts/add", json={"product_id": product, "quantity": 1}, headers=user["headers"])
+        assert client.post("/orders/create", headers=user["headers"]).status_code == 201
+
+
+def test_all_orders_is_a_bare_array_without_paging_params(client, user, admin, make_product):
+    since = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    place_orders(client, user, make_product, 3)
+
+    response = client.get(f"/orders/all?from={since}", headers=admin["headers"])
+    assert response.status_code == 200
+    orders = response.get_json()
+    assert isinstance(orders, list)
+    assert len(orders) == 3
+
+
+def test_all_orders_pages_with_limit_and_after(client, user, admin, make_product):
+    since = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    place_orders(client, user, make_product, 3)
+
+    first = client.get(f"/orders/all?from={since}&limit=2", headers=admin["headers"]).get_json()
+    assert len(first["orders"]) == 2
+    assert first["next_cursor"]
+
+    rest = client.get(f"/orders/all?from={since}&after={first['next_cursor']}",
+                      headers=admin["headers"]).get_json()
+    assert rest["next_cursor"] is None
+    seen = [order["id"] for order in first["orders"] + rest["orders"]]
+    assert len(set(seen)) == 3
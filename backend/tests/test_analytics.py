@@ -0,0 +1,86 @@
+import random
+from datetime import date, timedelta
+
+from analytics import refresh_rollups
+
+
+def refresh(db):
+    db.autocommit = False
+    with db.cursor() as cur:
+        days = refresh_rollups(cur)
+    db.commit()
+    db.autocommit = True
+    return days
+
+
+def rollup_of(db, day):
+    with db.cursor() as cur:
+        cur.execute("SELECT orders, revenue, cancelled_orders, cancelled_revenue FROM sales_daily WHERE day = %s",
+                    (day,))
+        return cur.fetchone()
+
+
+def place_order_on(db, user, day, amount):
+    """
+    An order placed on a past day; it is never scanned as newly placed.
+    """
+    with db.cursor() as cur:
+        cur.execute("""
+            INSERT INTO orders (user_id, total_amount, status, created_at, updated_at)
+            VALUES (%s, %s, 'pending', %s, %s) RETURNING id
+        """, (user["id"], amount, day, day))
+        return cur.fetchone()["id"]
+
+
+def a_past_day():
+    return date(1900, 1, 1) + timedelta(days=random.randrange(36500))
+
+
+def test_status_change_rebuilds_only_its_day(client, db, user, admin):
+    refresh(db)
+    day, other_day = a_past_day(), a_past_day()
+    order_id = place_order_on(db, user, day, 12)
+    place_order_on(db, user, other_day, 30)
+    before, other_before = rollup_of(db, day), rollup_of(db, other_day)
+
+    # not placed since the last refresh, and nothing marked it: left alone
+    refresh(db)
+    assert rollup_of(db, day) == before
+
+    response = client.patch(f"/orders/{order_id}/status", json={"status": "cancelled"}, headers=admin["headers"])
+    assert response.status_code == 200
+    with db.cursor() as cur:
+        cur.execute("SELECT 1 FROM analytics_dirty_days WHERE day = %s", (day,))
+        assert cur.fetchone() is not None
+
+    refresh(db)
+    after = rollup_of(db, day)
+    assert after["cancelled_orders"] == (before["cancelled_orders"] if before else 0) + 1
+    assert float(after["cancelled_revenue"]) == float(before["cancelled_revenue"] if before else 0) + 12
+    with db.cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM analytics_dirty_days WHERE day = %s", (day,))
+        assert cur.fetchone()["n"] == 0
+    # the other day was never marked
+    assert rollup_of(db, other_day) == other_before
+
+
+def test_orders_placed_since_the_last_refresh_are_counted(client, db, user, make_product):
+    refresh(db)
+    product = make_product(stock=5, price=4)
+    client.post("/carts/add", json={"product_id": product, "quantity": 2}, headers=user["headers"])
+    assert client.post("/orders/create", headers=user["headers"]).status_code == 201
+    with db.cursor() as cur:
+        cur.execute("SELECT created_at::date AS day FROM orders WHERE user_id = %s", (user["id"],))
+        today = cur.fetchone()["day"]
+        cur.execute("""
+            SELECT count(*) AS orders, SUM(total_amount) AS revenue FROM orders
+            WHERE created_at::date = %s AND status <> 'cancelled'
+        """, (today,))
+        expected = cur.fetchone()
+
+    assert refresh(db) >= 1
+    rollup = rollup_of(db, today)
+    assert (rollup["orders"], rollup["revenue"]) == (expected["orders"], expected["revenue"])
+    with db.cursor() as cur:
+        cur.execute("SELECT units FROM sales_daily_product WHERE day = %s AND product_id = %s", (today, product))
+        assert cur.fetchone()["units"] == 2
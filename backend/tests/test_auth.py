@@ -0,0 +1,55 @@
+import time
+
+import auth_middleware
+from cache import LocalSharedBackend, make_expiring_backend
+
+
+def test_logout_revokes_the_token(client, user):
+    assert client.get("/orders/", headers=user["headers"]).status_code == 200
+    assert client.post("/users/logout", headers=user["headers"]).status_code == 200
+    response = client.get("/orders/", headers=user["headers"])
+    assert response.status_code == 401
+    assert response.get_json()["error"] == "Token has been revoked"
+
+
+def test_revocations_and_users_live_in_the_shared_store(monkeypatch):
+    # two workers sharing a store: what one revokes, the other rejects
+    store = LocalSharedBackend(ttl=60)
+    monkeypatch.setattr(auth_middleware, "revocations", store)
+    monkeypatch.setattr(auth_middleware, "user_cache", store)
+    claims = {"user_id": 1, "jti": "abc", "iat": int(time.time()) - 10}
+
+    assert not auth_middleware.is_revoked(claims)
+    auth_middleware.revoke_token("abc", time.time() + 60)
+    assert store.get("auth:revoked:abc")
+    assert auth_middleware.is_revoked(claims)
+
+    auth_middleware.cache_user({"id": 1, "username": "a", "role": "admin"})
+    auth_middleware.invalidate_user(1, revoke_tokens=False)
+    assert auth_middleware.cached_user(1) is None
+
+
+def test_cutoff_rejects_tokens_issued_in_its_second(monkeypatch):
+    monkeypatch.setattr(auth_middleware, "revocations", LocalSharedBackend(ttl=60))
+    now = int(time.time())
+    auth_middleware.invalidate_user(42)
+
+    assert auth_middleware.is_revoked({"user_id": 42, "iat": now})
+    assert auth_middleware.is_revoked({"user_id": 42, "iat": now - 100})
+    assert not auth_middleware.is_revoked({"user_id": 42, "iat": now + 2})
+    assert not auth_middleware.is_revoked({"user_id": 43, "iat": now})
+
+
+def test_revocations_are_not_evicted_to_make_room():
+    revocations = make_expiring_backend("memory", ttl=60)
+    for jti in range(2000):
+        revocations.set(f"auth:revoked:{jti}", True)
+    assert all(revocations.get(f"auth:revoked:{jti}") for jti in range(2000))
+
+
+def test_expired_revocations_are_purged():
+    revocations = make_expiring_backend("memory", ttl=0.05)
+    revocations.set("auth:revoked:old", True)
+    time.sleep(0.1)
+    revocations.set("auth:revoked:new", True)
+    assert list(revocations._data) == ["auth:revoked:new"]
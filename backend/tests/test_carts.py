@@ -0,0 +1,31 @@
+from tests.conftest import cart_of
+
+
+def carts_sequence(db):
+    with db.cursor() as cur:
+        cur.execute("SELECT last_value FROM carts_id_seq")
+        return cur.fetchone()["last_value"]
+
+
+def test_a_cart_read_returns_the_users_cart(client, db, user):
+    response = client.get("/carts/", headers=user["headers"])
+    assert response.status_code == 200
+    assert response.get_json()["cart_id"] == cart_of(db, user)
+
+
+def test_a_missing_cart_is_created_on_read(client, db, user):
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM carts WHERE user_id = %s", (user["id"],))
+
+    response = client.get("/carts/", headers=user["headers"])
+    assert response.status_code == 200
+    assert response.get_json() == {"cart_id": cart_of(db, user), "items": [], "total_price": 0}
+
+
+def test_later_cart_reads_write_nothing(client, db, user):
+    cart_id = client.get("/carts/", headers=user["headers"]).get_json()["cart_id"]
+    sequence = carts_sequence(db)
+
+    for _ in range(3):
+        assert client.get("/carts/", headers=user["headers"]).get_json()["cart_id"] == cart_id
+    assert carts_sequence(db) == sequence
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from tests.conftest import cart_of, stock_of
+
+
+def test_checkout_orders_the_cart_and_takes_the_stock(client, db, user, make_product):
+    first, second = make_product(stock=5, price=2), make_product(stock=5, price=3)
+    client.post("/carts/add", json={"product_id": first, "quantity": 2}, headers=user["headers"])
+    client.post("/carts/add", json={"product_id": second, "quantity": 1}, headers=user["headers"])
+
+    response = client.post("/orders/create", headers=user["headers"])
+    assert response.status_code == 201
+    assert float(response.get_json()["total_amount"]) == 7.0
+    assert (stock_of(db, first), stock_of(db, second)) == (3, 4)
+    assert client.get("/carts/", headers=user["headers"]).get_json()["items"] == []
+
+
+def test_checkout_refuses_missing_stock(client, db, user, make_product):
+    product = make_product(stock=1)
+    client.post("/carts/add", json={"product_id": product, "quantity": 2}, headers=user["headers"])
+
+    response = client.post("/orders/create", headers=user["headers"])
+    assert response.status_code == 409
+    assert response.get_json()["items"][0]["available"] == 1
+    assert stock_of(db, product) == 1
+
+
+def blocked_by_cart_lock(db, cart_id, call):
+    """
+    Runs ``call`` in a thread while holding the cart lock a checkout holds;
+    returns (whether it waited for the lock, its response).
+    """
+    db.autocommit = False
+    with db.cursor() as cur:
+        cur.execute("SELECT id FROM carts WHERE id = %s FOR UPDATE", (cart_id,))
+    responses = []
+    worker = threading.Thread(target=lambda: responses.append(call()))
+    worker.start()
+    try:
+        time.sleep(0.5)
+        waited = not responses
+    finally:
+        db.commit()
+        db.autocommit = True
+        worker.join(10)
+    return waited, responses[0]
+
+
+def test_cart_changes_wait_for_a_checkout_in_progress(app, db, user, make_product):
+    product = make_product(stock=5)
+    client = app.test_client()
+    client.post("/carts/add", json={"product_id": product, "quantity": 1}, headers=user["headers"])
+
+    waited, response = blocked_by_cart_lock(db, cart_of(db, user), lambda: app.test_client().put(
+        f"/carts/update/{product}", json={"quantity": 3}, headers=user["headers"]))
+    assert waited
+    assert response.status_code == 200
+
+
+def test_checkout_locks_the_cart_first(app, db, user, make_product):
+    product = make_product(stock=5)
+    app.test_client().post("/carts/add", json={"product_id": product, "quantity": 1}, headers=user["headers"])
+
+    waited, response = blocked_by_cart_lock(db, cart_of(db, user), lambda: app.test_client().post(
+        "/orders/create", headers=user["headers"]))
+    assert waited
+    assert response.status_code == 201
@@ -0,0 +1,63 @@
+import uuid
+
+from cache import product_cache
+
+
+def revalidate(client, url, response, **kwargs):
+    return client.get(url, headers=dict(kwargs.pop("headers", {}), **{"If-None-Match": response.headers["ETag"]}),
+                      **kwargs)
+
+
+def test_catalog_etag_changes_on_delete_and_insert(client, db, make_product):
+    stale = make_product()
+    make_product()
+    url = "/products/?category=tests"
+    first = client.get(url)
+    assert first.status_code == 200
+    assert revalidate(client, url, first).status_code == 304
+
+    # same count, same max(updated_at): only a write counter can tell
+    db.autocommit = False
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM products WHERE id = %s", (stale,))
+        cur.execute("""
+            INSERT INTO products (name, description, price, stock, category, updated_at)
+            VALUES (%s, 'test product', 1, 1, 'tests', '2000-01-01')
+        """, ("Test " + uuid.uuid4().hex[:8],))
+    db.commit()
+    db.autocommit = True
+    product_cache.invalidate_lists()
+
+    second = revalidate(client, url, first)
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert stale not in [product["id"] for product in second.get_json()["products"]]
+
+
+def test_catalog_etag_changes_on_stock_update(client, db, make_product):
+    product = make_product(stock=5)
+    url = "/products/?category=tests"
+    first = client.get(url)
+
+    with db.cursor() as cur:
+        cur.execute("UPDATE products SET stock = stock - 1 WHERE id = %s", (product,))
+    product_cache.invalidate_lists()
+
+    assert revalidate(client, url, first).status_code == 200
+
+
+def test_order_details_etag_follows_product_names(client, db, user, make_product):
+    product = make_product()
+    client.post("/carts/add", json={"product_id": product, "quantity": 1}, headers=user["headers"])
+    order_id = client.post("/orders/create", headers=user["headers"]).get_json()["order_id"]
+    url = f"/orders/{order_id}"
+    first = client.get(url, headers=user["headers"])
+    assert first.status_code == 200
+    assert revalidate(client, url, first, headers=user["headers"]).status_code == 304
+
+    with db.cursor() as cur:
+        cur.execute("UPDATE products SET name = 'Renamed' WHERE id = %s", (product,))
+
+    second = revalidate(client, url, first, headers=user["headers"])
+    assert second.status_code == 200
+    assert second.get_json()["items"][0]["name"] == "Renamed"
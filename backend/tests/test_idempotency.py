@@ -0,0 +1,122 @@
+import threading
+import time
+
+import idempotency
+from tests.conftest import stock_of
+
+
+def keyed(user, key):
+    return dict(user["headers"], **{"Idempotency-Key": key})
+
+
+def orders_of(db, user):
+    with db.cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM orders WHERE user_id = %s", (user["id"],))
+        return cur.fetchone()["n"]
+
+
+def fill_cart(client, user, product, quantity=1):
+    client.post("/carts/add", json={"product_id": product, "quantity": quantity}, headers=user["headers"])
+
+
+def test_retry_replays_the_first_response(client, db, user, make_product):
+    product = make_product(stock=5)
+    fill_cart(client, user, product, 2)
+
+    first = client.post("/orders/create", headers=keyed(user, "checkout-1"))
+    fill_cart(client, user, product, 1)
+    retry = client.post("/orders/create", headers=keyed(user, "checkout-1"))
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_data() == first.get_data()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert orders_of(db, user) == 1
+    assert stock_of(db, product) == 3
+
+
+def test_key_reused_for_another_request_is_refused(client, user, make_product):
+    fill_cart(client, user, make_product())
+    assert client.post("/orders/create", headers=keyed(user, "checkout-2")).status_code == 201
+
+    response = client.post("/orders/create", json={"reservation_id": 1}, headers=keyed(user, "checkout-2"))
+    assert response.status_code == 422
+
+
+def test_rejected_request_leaves_the_key_free(client, db, user, make_product):
+    assert client.post("/orders/create", headers=keyed(user, "checkout-3")).status_code == 400
+
+    fill_cart(client, user, make_product())
+    response = client.post("/orders/create", headers=keyed(user, "checkout-3"))
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+    assert orders_of(db, user) == 1
+
+
+def test_keys_are_per_user(client, db, user, admin, make_product):
+    product = make_product()
+    fill_cart(client, user, product)
+    fill_cart(client, admin, product)
+
+    assert client.post("/orders/create", headers=keyed(user, "shared")).status_code == 201
+    response = client.post("/orders/create", headers=keyed(admin, "shared"))
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_invalid_key_is_refused(client, user):
+    assert client.post("/orders/create", headers=keyed(user, " ")).status_code == 400
+    assert client.post("/orders/create", headers=keyed(user, "k" * 256)).status_code == 400
+
+
+def hold_key(db, user, key):
+    """
+    Claims ``key`` in an open transaction, as a first request still running would.
+    """
+    db.autocommit = False
+    with db.cursor() as cur:
+        cur.execute(idempotency.CLAIM_KEY_SQL, idempotency.claim_params(user["id"], key, "first"))
+
+
+def test_duplicate_of_a_running_request_gets_409_after_the_wait(client, db, user, make_product, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_TIMEOUT", 0.2)
+    fill_cart(client, user, make_product())
+    hold_key(db, user, "checkout-4")
+    try:
+        started = time.monotonic()
+        response = client.post("/orders/create", headers=keyed(user, "checkout-4"))
+        waited = time.monotonic() - started
+    finally:
+        db.rollback()
+        db.autocommit = True
+
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    assert 0.2 <= waited < 5
+    assert orders_of(db, user) == 0
+
+
+def test_duplicate_waits_for_the_first_and_replays_it(app, client, db, user, make_product):
+    fill_cart(client, user, make_product())
+    fingerprint = idempotency.request_hash("POST", "/orders/create", b"")
+    db.autocommit = False
+    with db.cursor() as cur:
+        cur.execute(idempotency.CLAIM_KEY_SQL, idempotency.claim_params(user["id"], "checkout-5", fingerprint))
+
+    responses = []
+    worker = threading.Thread(target=lambda: responses.append(
+        app.test_client().post("/orders/create", headers=keyed(user, "checkout-5"))))
+    worker.start()
+    time.sleep(0.3)
+    assert not responses   # waiting on the first request's key
+    with db.cursor() as cur:
+        idempotency.store_response(cur, user["id"], "checkout-5", 201, '{"order_id": 0}')
+    db.commit()
+    db.autocommit = True
+    worker.join(5)
+
+    [response] = responses
+    assert response.status_code == 201
+    assert response.get_json() == {"order_id": 0}
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert orders_of(db, user) == 0
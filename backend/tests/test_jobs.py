@@ -0,0 +1,121 @@
+import uuid
+
+import pytest
+
+import jobs
+from jobs import claim, enqueue, recover_abandoned, run
+
+WORKER = "test-worker"
+
+
+@pytest.fixture
+def kind(database_url):
+    """
+    A job kind of this test's own, so jobs queued by other tests are never claimed.
+    """
+    name = "test:" + uuid.uuid4().hex[:12]
+    yield name
+    jobs.HANDLERS.pop(name, None)
+
+
+def job_row(db, job_id):
+    with db.cursor() as cur:
+        cur.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
+        return cur.fetchone()
+
+
+def make_due(db, job_id):
+    with db.cursor() as cur:
+        cur.execute("UPDATE jobs SET run_at = NOW() WHERE id = %s", (job_id,))
+
+
+def test_enqueue_is_once_per_key(db, kind):
+    with db.cursor() as cur:
+        first = enqueue(cur, kind, {"n": 1}, key=f"{kind}:once")
+        again = enqueue(cur, kind, {"n": 2}, key=f"{kind}:once")
+    assert first is not None
+    assert again is None
+    assert job_row(db, first)["payload"] == {"n": 1}
+
+
+def test_claim_skips_jobs_locked_by_another_worker(db, database_url, kind):
+    import psycopg2
+
+    with db.cursor() as cur:
+        busy = enqueue(cur, kind)
+        free = enqueue(cur, kind)
+
+    other = psycopg2.connect(database_url)
+    try:
+        with other.cursor() as cur:
+            cur.execute("SET lock_timeout = '1s'")
+            cur.execute("SELECT id FROM jobs WHERE id = %s FOR UPDATE", (busy,))
+        # another worker is in the middle of claiming ``busy``: skipped, not waited for
+        assert [row["id"] for row in claim(WORKER, kinds=[kind], batch=2)] == [free]
+    finally:
+        other.rollback()
+        other.close()
+
+    assert [row["id"] for row in claim(WORKER, kinds=[kind], batch=2)] == [busy]
+    assert job_row(db, busy)["status"] == "running"
+
+
+def test_done_job_commits_with_its_handler(db, kind):
+    @jobs.job(kind)
+    def handler(cur, payload, job):
+        cur.execute("UPDATE jobs SET last_error = %s WHERE id = %s", (f"saw {payload['n']}", job["id"]))
+
+    with db.cursor() as cur:
+        job_id = enqueue(cur, kind, {"n": 7})
+    [claimed] = claim(WORKER, kinds=[kind])
+
+    assert run(claimed, WORKER) == "done"
+    row = job_row(db, job_id)
+    assert (row["status"], row["attempts"], row["locked_by"]) == ("done", 1, None)
+
+
+def test_failed_job_is_retried_later_then_dead_lettered(db, kind):
+    @jobs.job(kind)
+    def handler(cur, payload, job):
+        cur.execute("UPDATE jobs SET payload = '{\"rolled\": \"back\"}' WHERE id = %s", (job["id"],))
+        raise RuntimeError("boom")
+
+    with db.cursor() as cur:
+        job_id = enqueue(cur, kind, {"n": 1}, max_attempts=2)
+
+    [claimed] = claim(WORKER, kinds=[kind])
+    assert run(claimed, WORKER) == "queued"
+    row = job_row(db, job_id)
+    assert row["attempts"] == 1
+    assert "boom" in row["last_error"]
+    assert row["payload"] == {"n": 1}           # the handler's writes rolled back
+    assert claim(WORKER, kinds=[kind]) == []    # backing off
+
+    make_due(db, job_id)
+    [claimed] = claim(WORKER, kinds=[kind])
+    assert run(claimed, WORKER) == "failed"
+    assert job_row(db, job_id)["status"] == "failed"
+
+    make_due(db, job_id)
+    assert claim(WORKER, kinds=[kind]) == []
+
+
+def test_retry_delay_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_BASE", 5)
+    monkeypatch.setattr(jobs, "JOB_RETRY_MAX", 60)
+    assert 2.5 <= jobs.retry_delay(1) <= 5
+    assert 10 <= jobs.retry_delay(3) <= 20
+    assert 30 <= jobs.retry_delay(10) <= 60
+
+
+def test_abandoned_job_is_queued_again(db, kind):
+    with db.cursor() as cur:
+        job_id = enqueue(cur, kind)
+    claim("dead-worker", kinds=[kind])
+    with db.cursor() as cur:
+        cur.execute("UPDATE jobs SET locked_at = NOW() - interval '1 hour' WHERE id = %s", (job_id,))
+
+    assert recover_abandoned(timeout=60) >= 1
+    row = job_row(db, job_id)
+    assert (row["status"], row["locked_by"]) == ("queued", None)
+    assert "dead-worker" in row["last_error"]
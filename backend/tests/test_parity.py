@@ -0,0 +1,14 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("quart")
+pytest.importorskip("asyncpg")
+
+from aio.parity import run_parity  # noqa: E402
+
+
+def test_sync_and_async_apis_answer_alike(database_url):
+    steps, differences = asyncio.run(run_parity(database_url))
+    assert steps > 0
+    assert differences == [], "\n".join(differences)
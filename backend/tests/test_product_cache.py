@@ -0,0 +1,39 @@
+from cache import LocalSharedBackend, ProductCache
+
+
+def test_product_read_during_a_write_is_not_cached_over_it():
+    cache = ProductCache(LocalSharedBackend(ttl=60))
+
+    # a reader misses and loads the row...
+    version = cache.product_version(1)
+    assert cache.get_product(1, version) is None
+    # ...a write commits and invalidates before the reader stores it
+    cache.invalidate_products(1)
+    cache.set_product(1, {"body": "old"}, version)
+
+    assert cache.get_product(1, cache.product_version(1)) is None
+    cache.set_product(1, {"body": "new"}, cache.product_version(1))
+    assert cache.get_product(1, cache.product_version(1)) == {"body": "new"}
+
+
+def test_list_read_during_a_write_is_not_cached_over_it():
+    cache = ProductCache(LocalSharedBackend(ttl=60))
+    params = {"category": "books"}
+
+    generation = cache.list_generation()
+    assert cache.get_list("list-json", params, generation) is None
+    cache.invalidate_products(7)
+    cache.set_list("list-json", params, {"body": "old"}, generation)
+
+    assert cache.get_list("list-json", params, cache.list_generation()) is None
+
+
+def test_invalidating_one_product_keeps_the_others():
+    cache = ProductCache(LocalSharedBackend(ttl=60))
+    cache.set_product(1, {"body": "one"}, cache.product_version(1))
+    cache.set_product(2, {"body": "two"}, cache.product_version(2))
+
+    cache.invalidate_products(1)
+
+    assert cache.get_product(1, cache.product_version(1)) is None
+    assert cache.get_product(2, cache.product_version(2)) == {"body": "two"}
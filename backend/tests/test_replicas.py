@@ -0,0 +1,113 @@
+"""
+Read routing. The "replica" here is the test database itself: pointed at a
+primary, REPLICA_STATUS_SQL reports the primary's own WAL position and no
+lag, so a replica that is caught up, lagging, behind a write or down can all
+be set up without a standby.
+"""
+import time
+
+import pytest
+
+import database
+from cache import make_backend
+from database import (LSN_HEADER, get_connection, get_read_connection, parse_lsn, required_lsn,
+                      stamp_catalog_write, stamp_write)
+
+UNREACHABLE = "postgresql://postgres@127.0.0.1:1/shop?connect_timeout=1"
+
+
+def use_replicas(monkeypatch, urls):
+    monkeypatch.setattr(database, "DATABASE_REPLICA_URLS", urls)
+    monkeypatch.setattr(database, "_write_lsns", make_backend("memory", maxsize=100, ttl=60))
+    monkeypatch.setattr(database, "_replicas", None)
+    return database.get_replicas()
+
+
+@pytest.fixture
+def replica(monkeypatch, database_url):
+    replicas = use_replicas(monkeypatch, [database_url])
+    yield replicas[0]
+    replicas[0].pool.close()
+
+
+def served_by(conn):
+    return "replica" if conn._pool is not database.get_pool() else "primary"
+
+
+def test_parse_lsn_orders_wal_positions():
+    assert parse_lsn("16/B374D848") == 0x16 << 32 | 0xB374D848
+    assert parse_lsn("0/FFFFFFFF") < parse_lsn("1/0") < parse_lsn("1/1")
+    for value in (None, "", "nope", "1/zz", "10"):
+        assert parse_lsn(value) is None
+
+
+def test_reads_go_to_a_caught_up_replica(app, replica):
+    with app.test_request_context("/products/"):
+        conn = get_read_connection()
+        assert served_by(conn) == "replica"
+        assert conn.readonly
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 AS one")
+            assert cur.fetchone()["one"] == 1
+
+
+def test_a_lagging_replica_is_passed_over(app, replica):
+    replica.lag, replica.checked_at = database.DB_REPLICA_MAX_LAG + 1, time.monotonic()
+    with app.test_request_context("/products/"):
+        assert served_by(get_read_connection()) == "primary"
+
+
+def test_reads_wait_for_the_lsn_the_client_sent(app, replica):
+    with app.test_request_context("/products/", headers={LSN_HEADER: "FFFFFFFF/0"}):
+        assert served_by(get_read_connection()) == "primary"
+    assert replica.lsn < parse_lsn("FFFFFFFF/0")
+
+
+def test_a_users_writes_hold_back_only_that_users_reads(app, replica):
+    with app.test_request_context("/carts/add"):
+        lsn = stamp_write(get_connection(), user_id=42)
+
+    assert required_lsn(42) == parse_lsn(lsn)
+    assert required_lsn(43) == 0
+    assert required_lsn() == 0   # the catalog did not change
+
+
+def test_product_writes_hold_back_catalog_reads(app, replica):
+    with app.test_request_context("/products/"):
+        lsn = stamp_catalog_write(get_connection())
+
+    assert required_lsn() == parse_lsn(lsn)
+    assert required_lsn(42) == 0
+
+
+def test_cart_writes_leave_catalog_reads_on_the_replica(client, user, make_product, replica):
+    product = make_product()
+    catalog_lsn = required_lsn()
+    response = client.post("/carts/add", json={"product_id": product, "quantity": 1}, headers=user["headers"])
+    assert response.status_code == 201
+    assert parse_lsn(response.headers[LSN_HEADER]) > catalog_lsn
+
+    assert required_lsn() == catalog_lsn
+    assert required_lsn(user["id"]) == parse_lsn(response.headers[LSN_HEADER])
+
+
+def test_an_unreachable_replica_falls_back_to_the_primary(app, monkeypatch):
+    replicas = use_replicas(monkeypatch, [UNREACHABLE])
+    try:
+        with app.test_request_context("/products/"):
+            assert served_by(get_read_connection()) == "primary"
+        assert replicas[0].down_until > time.monotonic()
+    finally:
+        replicas[0].pool.close()
+
+
+def test_committed_writes_send_their_lsn(client, admin, replica):
+    response = client.post("/products/", headers=admin["headers"],
+                           json={"name": "Replica test", "price": 1, "stock": 1, "category": "tests"})
+    assert response.status_code == 201
+    lsn = response.headers[LSN_HEADER]
+    assert parse_lsn(lsn) is not None
+
+    listing = client.get("/products/?category=tests", headers={LSN_HEADER: lsn})
+    assert listing.status_code == 200
+    assert replica.lsn >= parse_lsn(lsn)
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+from reservations import sweep_expired_reservations
+from tests.conftest import stock_of
+
+
+def reserve(client, user, *items):
+    return client.post("/products/stock/reserve", headers=user["headers"], json={
+        "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in items]})
+
+
+def test_release_returns_the_stock(client, db, user, make_product):
+    first, second = make_product(stock=5), make_product(stock=5)
+    response = reserve(client, user, (second, 2), (first, 1))
+    assert response.status_code == 201
+    assert (stock_of(db, first), stock_of(db, second)) == (4, 3)
+
+    reservation_id = response.get_json()["reservation"]["id"]
+    release = client.post(f"/products/stock/reservations/{reservation_id}/release", headers=user["headers"])
+    assert release.status_code == 200
+    assert (stock_of(db, first), stock_of(db, second)) == (5, 5)
+
+
+def test_sweeper_returns_expired_holds(client, db, user, make_product):
+    first, second = make_product(stock=5), make_product(stock=5)
+    reservation_id = reserve(client, user, (first, 2), (second, 2)).get_json()["reservation"]["id"]
+    with db.cursor() as cur:
+        cur.execute("UPDATE stock_reservations SET expires_at = NOW() - interval '1 second' WHERE id = %s",
+                    (reservation_id,))
+
+    assert sweep_expired_reservations() >= 1
+    assert (stock_of(db, first), stock_of(db, second)) == (5, 5)
+
+
+def locks_higher_id_first(database_url, first, second, run):
+    """
+    Holds the lock on ``first`` (the lower id) and runs ``run`` in a thread:
+    True if it locked ``second`` before waiting for ``first`` - the order
+    that deadlocks against reservations and checkouts.
+    """
+    holder = psycopg2.connect(database_url)
+    other = psycopg2.connect(database_url)
+    try:
+        with holder.cursor() as cur:
+            cur.execute("SELECT id FROM products WHERE id = %s FOR UPDATE", (first,))
+        worker = threading.Thread(target=run)
+        worker.start()
+        time.sleep(0.5)
+        try:
+            with other.cursor() as cur:
+                cur.execute("SELECT id FROM products WHERE id = %s FOR UPDATE NOWAIT", (second,))
+            locked = False
+        except psycopg2.errors.LockNotAvailable:
+            locked = True
+        other.rollback()
+        holder.rollback()
+        worker.join(10)
+        return locked
+    finally:
+        holder.close()
+        other.close()
+
+
+@pytest.mark.parametrize("order", [(0, 1), (1, 0)])
+def test_release_locks_products_in_id_order(app, database_url, user, make_product, order):
+    products = sorted([make_product(stock=5), make_product(stock=5)])
+    client = app.test_client()
+    reservation_id = reserve(client, user, *[(products[i], 1) for i in order]).get_json()["reservation"]["id"]
+
+    def release():
+        app.test_client().post(f"/products/stock/reservations/{reservation_id}/release", headers=user["headers"])
+
+    assert not locks_higher_id_first(database_url, *products, release)
+
+
+@pytest.mark.parametrize("order", [(0, 1), (1, 0)])
+def test_sweep_locks_products_in_id_order(client, db, database_url, user, make_product, order):
+    products = sorted([make_product(stock=5), make_product(stock=5)])
+    reservation_id = reserve(client, user, *[(products[i], 1) for i in order]).get_json()["reservation"]["id"]
+    with db.cursor() as cur:
+        cur.execute("UPDATE stock_reservations SET expires_at = NOW() - interval '1 second' WHERE id = %s",
+                    (reservation_id,))
+
+    assert not locks_higher_id_first(database_url, *products, sweep_expired_reservations)
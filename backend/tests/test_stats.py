@@ -0,0 +1,36 @@
+import pytest
+
+import metrics
+
+STATS = ["/stats/db", "/stats/cache", "/stats/jobs", "/stats/passwords", "/stats/queries"]
+
+
+@pytest.mark.parametrize("url", STATS)
+def test_stats_are_for_admins(client, user, admin, url):
+    assert client.get(url).status_code == 401
+    assert client.get(url, headers=user["headers"]).status_code == 403
+    assert client.get(url, headers=admin["headers"]).status_code == 200
+
+
+def test_metrics_need_the_scrape_token(client, admin, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", None)
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=admin["headers"]).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "http_request_duration_seconds" in response.get_data(as_text=True)
+
+
+def test_readiness_hides_the_driver_error(client, monkeypatch):
+    import app as app_module
+
+    def unreachable():
+        raise RuntimeError('connection to server at "db.internal" failed: password authentication failed')
+
+    monkeypatch.setattr(app_module, "get_connection", unreachable)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.get_json() == {"status": "unavailable", "error": "Database unavailable"}
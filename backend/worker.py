@@ -0,0 +1,165 @@
+"""
+Background job worker: runs the jobs queued in the jobs table (jobs.py).
+
+    python worker.py                     # run until SIGTERM / Ctrl-C
+    python worker.py --concurrency 4     # four jobs at a time
+    python worker.py --kinds order_created
+    python worker.py --once              # run what is due, then exit
+
+Start as many workers, on as many nodes, as the queue needs: jobs are
+claimed with SKIP LOCKED, so each runs on one worker only. A worker sleeps
+until a job is enqueued (LISTEN/NOTIFY) or JOB_POLL_INTERVAL passes, which
+also picks up retries whose backoff has elapsed. On SIGTERM it finishes the
+jobs it is running and exits; jobs it had not started stay queued.
+"""
+import argparse
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import traceback
+import psycopg2
+from analytics import schedule_periodic_refresh
+from database import DATABASE_URL, close_pool
+from idempotency import purge_expired_keys
+from jobs import NOTIFY_CHANNEL, claim, logger, prune_finished, recover_abandoned, run
+from metrics import flush as flush_metrics, start_metrics_flusher
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))             # seconds between checks without a NOTIFY
+JOB_MAINTENANCE_INTERVAL = float(os.getenv("JOB_MAINTENANCE_INTERVAL", "60"))  # abandoned jobs, pruning, keys, refreshes
+
+
+class Worker:
+    def __init__(self, concurrency=1, kinds=None, once=False):
+        self.concurrency = concurrency
+        self.kinds = kinds
+        self.once = once
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stop = threading.Event()
+        self.wake = threading.Event()
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def _drain(self, name):
+        """
+        Runs jobs one at a time until none is due. Returns how many ran.
+        """
+        ran = 0
+        while not self.stop.is_set():
+            jobs = claim(name, self.kinds)
+            if not jobs:
+                break
+            run(jobs[0], name)
+            ran += 1
+        with self._lock:
+            self.processed += ran
+        return ran
+
+    def _run_thread(self, index):
+        name = f"{self.name}/{index}"
+        while not self.stop.is_set():
+            try:
+                self._drain(name)
+            except Exception:
+                traceback.print_exc()
+            if self.once:
+                return
+            self.wake.wait(JOB_POLL_INTERVAL)
+            self.wake.clear()
+
+    def _listen(self):
+        """
+        Wakes the threads whenever a job is enqueued, on a connection of its own.
+        """
+        while not self.stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(DATABASE_URL)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                while not self.stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self.wake.set()
+            except psycopg2.Error:
+                traceback.print_exc()
+                self.stop.wait(JOB_POLL_INTERVAL)   # polling still runs meanwhile
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _maintain(self):
+        try:
+            recovered = recover_abandoned()
+            pruned = prune_finished()
+            expired_keys = purge_expired_keys()
+            schedule_periodic_refresh()
+            if recovered or pruned or expired_keys:
+                logger.warning(json.dumps({"event": "jobs_maintenance", "recovered": recovered, "pruned": pruned,
+                                           "expired_idempotency_keys": expired_keys}))
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        self._maintain()
+        threads = [threading.Thread(target=self._run_thread, args=(i,), name=f"job-worker-{i}")
+                   for i in range(self.concurrency)]
+        if not self.once:
+            threads.append(threading.Thread(target=self._listen, name="job-listener", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        if not self.once:
+            while not self.stop.wait(JOB_MAINTENANCE_INTERVAL):
+                self._maintain()
+        for thread in threads:
+            if not thread.daemon:
+                thread.join()
+        return self.processed
+
+    def shutdown(self, *args):
+        self.stop.set()
+        self.wake.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued background jobs.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_CONCURRENCY", "2")),
+                        help="jobs run at the same time (threads)")
+    parser.add_argument("--kinds", help="comma-separated job kinds to run (default: all)")
+    parser.add_argument("--once", action="store_true", help="run the jobs that are due, then exit")
+    args = parser.parse_args()
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()] if args.kinds else None
+    worker = Worker(concurrency=max(args.concurrency, 1), kinds=kinds, once=args.once)
+    signal.signal(signal.SIGTERM, worker.shutdown)
+    signal.signal(signal.SIGINT, worker.shutdown)
+
+    flusher = start_metrics_flusher()
+    try:
+        processed = worker.run()
+    finally:
+        if flusher is not None:
+            flusher.set()
+        close_pool(drain_timeout=10.0)
+        flush_metrics()
+    if args.once:
+        print(f"✅ {processed} job(s) run")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())